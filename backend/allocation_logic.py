@@ -1,9 +1,12 @@
 import pandas as pd
-from typing import Dict, List, Optional, NamedTuple
+from typing import Callable, Dict, Iterator, List, Optional, NamedTuple, Tuple
 from datetime import datetime
 import logging
 from decimal import Decimal, ROUND_HALF_UP
 import json
+from stock_pool import StockPool, material_code
+from encoding import CompiledRestrictions, RestrictionResolver, StockEncoding
+import metrics
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -12,8 +15,19 @@ class ValidationError(Exception):
     """Custom exception for validation errors."""
     pass
 
+# Weights are held as integer grams during allocation and only turned into kg for output
+GRAMS_PER_KG = 1000
+
+def to_grams(kilograms) -> int:
+    """Convert a kilogram value to integer grams, rounding half up like the old 0.001 kg quantization."""
+    return int(Decimal(str(kilograms)).scaleb(3).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+def grams_to_kg(grams: int) -> float:
+    """Convert integer grams to kilograms for serialization."""
+    return grams / GRAMS_PER_KG
+
 class StockBatch:
-    def __init__(self, row: pd.Series):
+    def __init__(self, row: pd.Series, encoding: Optional[StockEncoding] = None):
         try:
             self.location = str(row['Location']) if pd.notnull(row['Location']) else ''
             self.batch_number = str(row['Batch Number'])
@@ -29,49 +43,58 @@ class StockBatch:
             self.minimum_size = str(row['MinimumSize']) if pd.notnull(row['MinimumSize']) else ''
             self.origin_pallet = str(row['Origin Pallet Number']) if pd.notnull(row['Origin Pallet Number']) else ''
             self.arrival_date = datetime.now()  # TODO: Add actual arrival date from data
+            self.codes = encoding.encode_batch(self) if encoding is not None else None
         except (KeyError, ValueError, TypeError) as e:
             raise ValidationError(f"Invalid data in stock batch: {str(e)}")
 
     def _parse_weight(self, weight_str: str) -> None:
-        """Parse weight string and convert to decimal for precise calculations."""
+        """Parse weight string and convert to integer grams for exact, fast calculations."""
         try:
             # Handle different weight formats and NaN values
             if pd.isnull(weight_str):
-                self.weight = Decimal('0')
+                self.weight_grams = 0
             else:
                 weight_value = str(weight_str).split()[0] if isinstance(weight_str, str) else str(weight_str)
-                self.weight = Decimal(weight_value).quantize(Decimal('0.003'), rounding=ROUND_HALF_UP)
-        except (ValueError, TypeError, IndexError) as e:
+                self.weight_grams = to_grams(weight_value)
+        except (ValueError, TypeError, IndexError, ArithmeticError) as e:
             raise ValidationError(f"Invalid weight format: {weight_str}")
 
-    def matches_restrictions(self, restrictions: Dict) -> bool:
-        """Check if this batch meets customer restrictions."""
+    @property
+    def weight(self) -> float:
+        """Remaining weight in kg."""
+        return grams_to_kg(self.weight_grams)
+
+    def matches_restrictions(self, restrictions) -> bool:
+        """Check if this batch meets customer restrictions (a dict or CompiledRestrictions)."""
         try:
             if not restrictions:
                 return True
 
+            if isinstance(restrictions, CompiledRestrictions):
+                return restrictions.matches(self.codes)
+
             if restrictions.get('quality') and self.quality not in restrictions['quality']:
-                logger.debug(f"Batch {self.batch_number} failed quality restriction")
+                logger.debug("Batch %s failed quality restriction", self.batch_number)
                 return False
                 
             if restrictions.get('origin') and self.origin not in restrictions['origin']:
-                logger.debug(f"Batch {self.batch_number} failed origin restriction")
+                logger.debug("Batch %s failed origin restriction", self.batch_number)
                 return False
                 
             if restrictions.get('variety') and self.variety not in restrictions['variety']:
-                logger.debug(f"Batch {self.batch_number} failed variety restriction")
+                logger.debug("Batch %s failed variety restriction", self.batch_number)
                 return False
                 
             if restrictions.get('ggn') and self.ggn != restrictions['ggn']:
-                logger.debug(f"Batch {self.batch_number} failed GGN restriction")
+                logger.debug("Batch %s failed GGN restriction", self.batch_number)
                 return False
                 
             if restrictions.get('supplier') and self.supplier not in restrictions['supplier']:
-                logger.debug(f"Batch {self.batch_number} failed supplier restriction")
+                logger.debug("Batch %s failed supplier restriction", self.batch_number)
                 return False
 
             if restrictions.get('minimum_size') and self.minimum_size != restrictions['minimum_size']:
-                logger.debug(f"Batch {self.batch_number} failed minimum size restriction")
+                logger.debug("Batch %s failed minimum size restriction", self.batch_number)
                 return False
                 
             return True
@@ -82,24 +105,55 @@ class StockBatch:
 class AllocationResult(NamedTuple):
     """Structured allocation result for type safety."""
     status: str  # 'fully_allocated', 'partially_allocated', or 'unfulfilled'
-    weight: Decimal
+    weight: float  # kg
     batches: List[Dict]
 
-def allocate_fruits(stock_df: pd.DataFrame, orders: List[Dict], restrictions: Dict) -> Dict:
+# Allocation engines selectable through allocate_fruits(engine=...)
+ALLOCATION_ENGINES = ('pool', 'vectorized', 'optimal')
+
+def iter_allocations(stock_df: pd.DataFrame, orders: List[Dict], restrictions: Dict, engine: str = 'pool',
+                     progress: Optional[Callable[[int], None]] = None,
+                     customer_restrictions: Optional[Dict[str, Dict]] = None) -> Iterator[Tuple[str, Dict]]:
     """
-    Allocate stock to orders using FIFO, respecting restrictions.
+    Allocate stock to orders using FIFO, yielding each order's result as soon as it is decided.
+
+    Orders are processed in sequence, so results come out in order. Invalid orders
+    are skipped; a sales document listed twice is yielded twice.
 
     Args:
         stock_df (pd.DataFrame): Stock data from Excel
         orders (List[Dict]): List of customer orders with Loading Date, Sales Document, etc.
-        restrictions (Dict): Customer restrictions
+        restrictions (Dict): Default restrictions, used for customers without their own
+        engine (str): 'pool' for the StockBatch pool, 'vectorized' for the columnar NumPy engine,
+            'optimal' for the min-cost-flow solver (results come out once it has finished)
+        progress (Callable[[int], None], optional): Called with the number of orders processed so far
+        customer_restrictions (Dict[str, Dict], optional): Restrictions per sold_to_party
 
-    Returns:
-        Dict: Allocation results per order
+    Yields:
+        Tuple[str, Dict]: Sales document and its AllocationResult as a dict
 
     Raises:
         ValidationError: If input data is invalid
     """
+    if engine not in ALLOCATION_ENGINES:
+        raise ValidationError(f"Unknown allocation engine: {engine}")
+    if engine == 'vectorized':
+        # Imported here because the vectorized engine builds on this module's types
+        from vectorized_allocation import iter_vectorized
+        yield from iter_vectorized(stock_df, orders, restrictions, progress, customer_restrictions)
+        return
+    if engine == 'optimal':
+        from optimal_allocation import optimize_positioned
+        positioned, _ = optimize_positioned(stock_df, orders, restrictions, customer_restrictions)
+        # Each order's position is reported just before its result, as the other engines do
+        for position, sales_doc, result in positioned:
+            if progress is not None:
+                progress(position)
+            yield sales_doc, result
+        if progress is not None:
+            progress(len(orders))
+        return
+
     try:
         # Validate input data
         if stock_df.empty:
@@ -108,90 +162,120 @@ def allocate_fruits(stock_df: pd.DataFrame, orders: List[Dict], restrictions: Di
             raise ValidationError("No orders provided")
 
         # Convert stock to list of StockBatch objects, sorted by age (FIFO)
-        try:
-            stock_batches = [
-                StockBatch(row) for _, row in 
-                stock_df.sort_values('Real Stock Age', ascending=True).iterrows()  # True for proper FIFO
-            ]
-        except ValidationError as e:
-            raise ValidationError(f"Error processing stock data: {str(e)}")
-
-        allocations = {}
-        remaining_stock = stock_batches.copy()
-
-        for order in orders:
+        with metrics.phase('build_batches'):
+            encoding = StockEncoding()
             try:
-                sales_doc = str(order.get('sales_document', ''))
-                material_desc = str(order.get('description_material', ''))
-                required_weight = Decimal(str(order.get('quantity', 0)))
-                loading_date = order.get('loading_date')
-                sold_to_party = str(order.get('sold_to_party', ''))
-
-                if not sales_doc or not material_desc or required_weight < 0:  # Allow zero quantity orders
-                    logger.warning(f"Skipping invalid order: {json.dumps(order)}")
-                    continue
-
-                allocated_weight = Decimal('0')
-                allocated_batches = []
-
-                # Filter batches by material description and sort by age
-                matching_batches = [
-                    b for b in remaining_stock 
-                    if b.matches_restrictions(restrictions)
+                stock_batches = [
+                    StockBatch(row, encoding) for _, row in 
+                    stock_df.sort_values('Real Stock Age', ascending=True, kind='stable').iterrows()  # True for proper FIFO
                 ]
-                matching_batches.sort(key=lambda x: x.age)  # Ensure FIFO order
-
-                for batch in matching_batches:
-                    if allocated_weight >= required_weight:
-                        break
-
-                    available_weight = min(required_weight - allocated_weight, batch.weight)
-                    if available_weight > 0:
-                        allocated_weight += available_weight
-                        batch.weight -= available_weight
-                        allocated_batches.append({
-                            "batch": batch.batch_number,
-                            "weight": float(available_weight),  # Convert Decimal to float for JSON
-                            "age": batch.age,
-                            "location": batch.location,
-                            "supplier": batch.supplier,
-                            "quality": batch.quality,
-                            "origin": batch.origin
-                        })
-
-                # Determine allocation status
-                if allocated_weight > 0:
-                    status = "fully_allocated" if allocated_weight >= required_weight else "partially_allocated"
-                    allocations[sales_doc] = AllocationResult(
-                        status=status,
-                        weight=float(allocated_weight),
-                        batches=allocated_batches
-                    )._asdict()
-                else:
-                    allocations[sales_doc] = AllocationResult(
-                        status="unfulfilled",
+            except ValidationError as e:
+                raise ValidationError(f"Error processing stock data: {str(e)}")
+
+            pool = StockPool(stock_batches)
+            resolver = RestrictionResolver(encoding, restrictions, customer_restrictions)
+
+        # Tallied locally and reported once so the loop stays free of instrumentation calls
+        batches_scanned = 0
+        batches_touched = 0
+        with metrics.phase('allocation'):
+            for index, order in enumerate(orders):
+                if progress is not None:
+                    progress(index)
+                try:
+                    sales_doc = str(order.get('sales_document', ''))
+                    material_desc = str(order.get('description_material', ''))
+                    required_weight = to_grams(order.get('quantity', 0))
+                    loading_date = order.get('loading_date')
+                    sold_to_party = str(order.get('sold_to_party', ''))
+
+                    if not sales_doc or not material_desc or required_weight < 0:  # Allow zero quantity orders
+                        logger.warning(f"Skipping invalid order: {json.dumps(order)}")
+                        continue
+
+                    allocated_weight = 0
+                    allocated_batches = []
+
+                    # Only batches of the ordered material that meet the restrictions, youngest first
+                    for batch in pool.candidates(material_code(material_desc), resolver.for_customer(sold_to_party)):
+                        if allocated_weight >= required_weight:
+                            break
+                        batches_scanned += 1
+
+                        available_weight = min(required_weight - allocated_weight, batch.weight_grams)
+                        if available_weight > 0:
+                            batches_touched += 1
+                            allocated_weight += available_weight
+                            batch.weight_grams -= available_weight
+                            allocated_batches.append({
+                                "batch": batch.batch_number,
+                                "weight": grams_to_kg(available_weight),
+                                "age": batch.age,
+                                "location": batch.location,
+                                "supplier": batch.supplier,
+                                "quality": batch.quality,
+                                "origin": batch.origin
+                            })
+
+                    # Determine allocation status
+                    if allocated_weight > 0:
+                        status = "fully_allocated" if allocated_weight >= required_weight else "partially_allocated"
+                        yield sales_doc, AllocationResult(
+                            status=status,
+                            weight=grams_to_kg(allocated_weight),
+                            batches=allocated_batches
+                        )._asdict()
+                    else:
+                        yield sales_doc, AllocationResult(
+                            status="unfulfilled",
+                            weight=0,
+                            batches=[]
+                        )._asdict()
+
+                except (ValueError, TypeError, ArithmeticError) as e:
+                    logger.error(f"Error processing order {order}: {str(e)}")
+                    yield sales_doc if 'sales_doc' in locals() else 'unknown', AllocationResult(
+                        status="error",
                         weight=0,
                         batches=[]
                     )._asdict()
 
-                # Update remaining stock
-                remaining_stock = [b for b in remaining_stock if b.weight > 0]
-
-            except (ValueError, TypeError) as e:
-                logger.error(f"Error processing order {order}: {str(e)}")
-                allocations[sales_doc if 'sales_doc' in locals() else 'unknown'] = AllocationResult(
-                    status="error",
-                    weight=0,
-                    batches=[]
-                )._asdict()
-
+        if progress is not None:
+            progress(len(orders))
+        metrics.count('stock_batches', len(stock_batches))
+        metrics.count('orders', len(orders))
+        metrics.count('batches_scanned', batches_scanned)
+        metrics.count('batches_touched', batches_touched)
         logger.info(f"Allocation completed successfully for {len(orders)} orders")
-        return allocations
 
     except Exception as e:
         logger.error(f"Error in allocation process: {str(e)}")
         raise ValidationError(f"Allocation failed: {str(e)}")
 
+def allocate_fruits(stock_df: pd.DataFrame, orders: List[Dict], restrictions: Dict, engine: str = 'pool',
+                    progress: Optional[Callable[[int], None]] = None,
+                    customer_restrictions: Optional[Dict[str, Dict]] = None, workers: int = 1) -> Dict:
+    """
+    Allocate stock to orders using FIFO, respecting restrictions.
+
+    Takes the same arguments as iter_allocations and collects its results; when a
+    sales document appears more than once, its last result is kept. With more than
+    one worker, materials are allocated in parallel processes with the same result.
+
+    Returns:
+        Dict: Allocation results per order
+
+    Raises:
+        ValidationError: If input data is invalid
+    """
+    if workers > 1:
+        # Imported here because the parallel runner builds on this module
+        from parallel_allocation import allocate_parallel
+        if engine not in ALLOCATION_ENGINES:
+            raise ValidationError(f"Unknown allocation engine: {engine}")
+        return allocate_parallel(stock_df, orders, restrictions, engine, workers, progress, customer_restrictions)
+    return dict(iter_allocations(stock_df, orders, restrictions, engine, progress, customer_restrictions))
+
 if __name__ == "__main__":
     # Convert document data to DataFrame for testing
     stock_data = [
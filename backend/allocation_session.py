@@ -0,0 +1,218 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from allocation_logic import ValidationError, to_grams
+from encoding import ATTRIBUTE_FIELDS, RestrictionResolver
+from stock_pool import material_code
+from vectorized_allocation import ColumnarStock, FilledOrder, fill_order
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SESSION_CHANGES = ('add_order', 'update_order', 'remove_order', 'set_batch_weight', 'add_batch')
+
+
+class OrderRecord:
+    """An order of the session with the result and stock draws of its last allocation."""
+
+    __slots__ = ('order', 'material', 'filled')
+
+    def __init__(self, order: Dict):
+        self.order = order
+        self.material = material_code(str(order.get('description_material', '')))
+        self.filled: Optional[FilledOrder] = None
+
+
+class AllocationSession:
+    """
+    Allocation state kept between edits so a change only replays the orders it affects.
+
+    Orders only compete with earlier orders of the same material. A change hands back
+    the stock drawn by that material's orders from the first affected position on and
+    allocates those orders again, so results always equal a full allocate_fruits run
+    over the edited stock and orders. Positions refer to the session's order list.
+    """
+
+    def __init__(self, stock_df: pd.DataFrame, orders: List[Dict], restrictions: Dict,
+                 customer_restrictions: Optional[Dict[str, Dict]] = None):
+        if stock_df.empty:
+            raise ValidationError("Stock data is empty")
+        self.stock = ColumnarStock(stock_df)
+        self.resolver = RestrictionResolver(self.stock.encoding, restrictions, customer_restrictions)
+        self.lock = threading.Lock()
+        self._records: List[OrderRecord] = []
+        self._batch_rows: Optional[Dict[str, List[int]]] = None
+        for order in orders:
+            record = OrderRecord(order)
+            self._fill(record)
+            self._records.append(record)
+        logger.info(f"Started allocation session for {len(orders)} orders")
+
+    @property
+    def records(self) -> Tuple[OrderRecord, ...]:
+        return tuple(self._records)
+
+    @property
+    def orders(self) -> List[Dict]:
+        return [record.order for record in self._records]
+
+    def results(self) -> Dict:
+        """Current allocation in the shape allocate_fruits returns."""
+        return {
+            record.filled.sales_document: record.filled.result
+            for record in self._records if record.filled is not None
+        }
+
+    def _fill(self, record: OrderRecord) -> None:
+        record.filled = fill_order(self.stock, self.resolver, record.order)
+
+    def _release(self, record: OrderRecord) -> None:
+        if record.filled is not None:
+            self.stock.release(record.material, record.filled.rows, record.filled.fills)
+
+    def _first_reaching(self, row: int) -> Optional[int]:
+        """Position of the first order whose result can depend on the weight of a stock row."""
+        material = self.stock.material_id[row]
+        codes = tuple(int(self.stock.codes[field][row]) for field in ATTRIBUTE_FIELDS)
+        row_key = self.stock.fifo_key(row)
+        for position, record in enumerate(self._records):
+            filled = record.filled
+            if record.material != material or filled is None or filled.result['status'] == 'error':
+                continue
+            if not self.resolver.for_customer(str(record.order.get('sold_to_party', ''))).matches(codes):
+                continue
+            # A filled order stopped at its last batch and never looked at younger stock
+            if filled.result['status'] == 'fully_allocated' and self.stock.fifo_key(filled.rows[-1]) < row_key:
+                continue
+            return position
+        return None
+
+    def _take_back(self, material: str, start: int) -> List[Tuple[int, OrderRecord]]:
+        """Release the draws of a material's orders from a position on and return them."""
+        replay = [(position, record) for position, record in enumerate(self._records[start:], start)
+                  if record.material == material]
+        for _, record in replay:
+            self._release(record)
+        return replay
+
+    def _refill(self, replay: List[Tuple[int, OrderRecord]]) -> List[Tuple[int, OrderRecord]]:
+        for _, record in replay:
+            self._fill(record)
+        return replay
+
+    def _check_position(self, position: int) -> int:
+        if not isinstance(position, int) or not 0 <= position < len(self._records):
+            raise ValidationError(f"No order at position {position}")
+        return position
+
+    def _rows_for_batch(self, batch_number: str) -> List[int]:
+        if self._batch_rows is None:
+            self._batch_rows = {}
+            for row, number in enumerate(self.stock.batch_number.tolist()):
+                self._batch_rows.setdefault(number, []).append(row)
+        return self._batch_rows.get(str(batch_number), [])
+
+    def add_order(self, order: Dict, position: Optional[int] = None) -> List[Tuple[int, OrderRecord]]:
+        """Insert an order, at the end unless a position is given."""
+        position = len(self._records) if position is None else position
+        if not isinstance(position, int) or not 0 <= position <= len(self._records):
+            raise ValidationError(f"Invalid order position: {position}")
+        record = OrderRecord(order)
+        replay = self._take_back(record.material, position)
+        self._records.insert(position, record)
+        return self._refill([(position, record)] + [(p + 1, r) for p, r in replay])
+
+    def update_order(self, position: int, order: Dict) -> List[Tuple[int, OrderRecord]]:
+        """Replace the order at a position."""
+        old = self._records[self._check_position(position)]
+        self._release(old)
+        record = OrderRecord(order)
+        self._records[position] = record
+        replay = self._take_back(record.material, position)
+        if old.material != record.material:
+            replay += self._take_back(old.material, position + 1)
+            replay.sort(key=lambda item: item[0])
+        return self._refill(replay)
+
+    def remove_order(self, position: int) -> List[Tuple[int, OrderRecord]]:
+        """Drop the order at a position."""
+        old = self._records.pop(self._check_position(position))
+        self._release(old)
+        return self._refill(self._take_back(old.material, position))
+
+    def set_batch_weight(self, batch_number: str, weight) -> List[Tuple[int, OrderRecord]]:
+        """Set a batch's stock weight in kg, as if it had been edited in the stock sheet."""
+        rows = self._rows_for_batch(batch_number)
+        if len(rows) != 1:
+            raise ValidationError(f"Batch Number {batch_number} " + ("is not unique" if rows else "not found"))
+        row = rows[0]
+        try:
+            grams = to_grams(weight)
+        except (ValueError, ArithmeticError):
+            raise ValidationError(f"Invalid weight format: {weight}")
+        if grams < 0:
+            raise ValidationError(f"Stock weight cannot be negative: {weight}")
+
+        start = self._first_reaching(row)
+        replay = [] if start is None else self._take_back(self.stock.material_id[row], start)
+        # With every order that reached the batch released, it holds its original weight
+        self.stock.weight[row] = grams
+        return self._refill(replay)
+
+    def add_batch(self, batch: Dict) -> List[Tuple[int, OrderRecord]]:
+        """Add a stock batch (a stock sheet row) as if it were appended to the sheet."""
+        row = int(self.stock.append(pd.DataFrame([batch]))[0])
+        if self._batch_rows is not None:
+            self._batch_rows.setdefault(self.stock.batch_number[row], []).append(row)
+        start = self._first_reaching(row)
+        replay = [] if start is None else self._take_back(self.stock.material_id[row], start)
+        return self._refill(replay)
+
+    def apply(self, change: Dict) -> List[Tuple[int, OrderRecord]]:
+        """
+        Apply one change given as a dict with an 'op' key.
+
+        Returns:
+            List[Tuple[int, OrderRecord]]: Position and record of every order allocated again
+        """
+        op = change.get('op')
+        if op not in SESSION_CHANGES:
+            raise ValidationError(f"Unknown change: {op}")
+        if op == 'add_order':
+            return self.add_order(change.get('order') or {}, change.get('position'))
+        if op == 'update_order':
+            return self.update_order(change.get('position'), change.get('order') or {})
+        if op == 'remove_order':
+            return self.remove_order(change.get('position'))
+        if op == 'set_batch_weight':
+            return self.set_batch_weight(change.get('batch'), change.get('weight'))
+        return self.add_batch(change.get('batch') or {})
+
+
+class SessionStore:
+    """Allocation sessions held by this worker; the least recently used are dropped first."""
+
+    def __init__(self, max_sessions: int = 20):
+        self.max_sessions = max_sessions
+        self._sessions: 'OrderedDict[str, AllocationSession]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, session: AllocationSession) -> str:
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id: str) -> Optional[AllocationSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            return session
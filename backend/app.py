@@ -1,22 +1,31 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, stream_with_context
 from flask_cors import CORS  # Import CORS
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)  # Enable CORS for all routes, allow credentials
-
-import pandas as pd
 import os
 import logging
 from logging.handlers import RotatingFileHandler
-from allocation_logic import allocate_fruits
-from restrictions import get_restrictions, Restriction
-import openpyxl
-from datetime import datetime
+from restrictions import current_restrictions_version, get_restrictions, get_restrictions_for_customers
+from datetime import date, datetime
 import tempfile
-from werkzeug.utils import secure_filename
 import hashlib
 from pathlib import Path
-from database import db
+from database import db, init_database
+from upload_store import UploadStore
+from jobs import JobManager
+from result_cache import ResultCache, result_key
+import importlib
+import json
+import time
+import threading
+import metrics
+import itertools
+
+# pandas and openpyxl are a large share of startup, so the modules that import them
+# are imported inside the routes that use them; warm_up() loads them ahead of time
+HEAVY_MODULES = (
+    'allocation_logic', 'vectorized_allocation', 'optimal_allocation', 'allocation_session',
+    'scheduling', 'validation', 'upload_cache', 'ingestion', 'stock_ledger', 'export',
+)
 
 
 # Environment configuration
@@ -24,254 +33,910 @@ IS_DEVELOPMENT = os.getenv('FLASK_ENV', 'development') == 'development'
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:3001')
 PORT = int(os.getenv('PORT', 5001))
 
-app = Flask(__name__)
+# Raw upload bodies accepted from machine clients, by Content-Type
+BODY_FORMATS = {
+    'text/csv': 'csv',
+    'application/json': 'json',
+    'application/vnd.apache.parquet': 'parquet',
+    'application/x-parquet': 'parquet',
+}
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STOCK_SOURCES = ('upload', 'ledger')
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 
-# CORS configuration - allow localhost in development, use env var in production
-if IS_DEVELOPMENT:
-    CORS(app, resources={
-        r"/*": {
-            "origins": ["http://localhost:3001"],
-            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type"]
-        }
-    })
-else:
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+api = Blueprint('api', __name__)
+
+
+def create_app(config=None):
+    """
+    Build and configure the Flask app.
+
+    Creating the app imports neither pandas nor openpyxl and leaves the database
+    schema alone, so it is cheap in every worker; init_db and warm_up are the
+    once-per-deployment steps.
+
+    Args:
+        config (dict): Settings applied over the environment's, e.g. in tests
+
+    Returns:
+        Flask: The configured app
+    """
+    app = Flask(__name__)
+
+    # CORS configuration - allow localhost in development, use env var in production
     CORS(app, resources={
         r"/*": {
-            "origins": [FRONTEND_URL],
+            "origins": ["http://localhost:3001"] if IS_DEVELOPMENT else [FRONTEND_URL],
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type"]
+            "allow_headers": ["Content-Type"],
+            "expose_headers": ["Server-Timing"]
         }
     })
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///fruit_allocation.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max file size
+    # Database configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///fruit_allocation.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Applied to every new connection: SQLite runs in WAL mode, and writers wait
+    # this long for a lock instead of failing with "database is locked"
+    app.config['DB_BUSY_TIMEOUT_MS'] = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+    app.config['DB_JOURNAL_MODE'] = os.getenv('DB_JOURNAL_MODE', 'wal')
+    app.config['DB_SYNCHRONOUS'] = os.getenv('DB_SYNCHRONOUS', 'normal')
+    # Connection pool per worker; recycling only applies to PostgreSQL
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_RECYCLE_SECONDS'] = int(os.getenv('DB_POOL_RECYCLE_SECONDS', 1800))
+    # Uploads are streamed to disk and parsed in chunks, so large warehouse exports are fine
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', 100)) * 1024 * 1024
 
-# Upload folder configuration
-if os.getenv('RENDER'):
-    app.config['UPLOAD_FOLDER'] = '/tmp'  # Use Render's temp directory
-else:
-    app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
+    # Upload folder configuration
+    if os.getenv('RENDER'):
+        app.config['UPLOAD_FOLDER'] = '/tmp'  # Use Render's temp directory
+    else:
+        app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
 
-# Debug mode in development
-app.config['DEBUG'] = IS_DEVELOPMENT
+    # Uploaded files and their parsed snapshots, both keyed by content hash
+    app.config['UPLOAD_STORE_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'uploads')
+    app.config['SNAPSHOT_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'snapshots')
+    app.config['UPLOAD_MAX_AGE_SECONDS'] = int(os.getenv('UPLOAD_MAX_AGE_HOURS', 24)) * 3600
+    app.config['UPLOAD_STORE_MAX_BYTES'] = int(os.getenv('UPLOAD_STORE_MAX_MB', 1024)) * 1024 * 1024
 
-ALLOWED_EXTENSIONS = {'xlsx'}
+    # Background allocation jobs, with their state in a folder every worker shares
+    app.config['ALLOCATION_JOB_WORKERS'] = int(os.getenv('ALLOCATION_JOB_WORKERS', 2))
+    app.config['ALLOCATION_JOB_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'jobs')
+    app.config['ALLOCATION_JOB_MAX_AGE_SECONDS'] = int(os.getenv('ALLOCATION_JOB_MAX_AGE_HOURS', 1)) * 3600
 
-# Initialize SQLAlchemy with the app
-db.init_app(app)
+    # Worker processes per allocation; materials are allocated in parallel when above 1
+    app.config['ALLOCATION_WORKERS'] = int(os.getenv('ALLOCATION_WORKERS', 1))
 
-# Initialize the database
-with app.app_context():
-    db.create_all()
+    # Incremental allocation sessions kept in this worker's memory
+    app.config['ALLOCATION_SESSIONS'] = int(os.getenv('ALLOCATION_SESSIONS', 20))
 
-# Configure logging
-log_dir = 'logs'
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
+    # Serialized /allocate responses, reused while uploads, restrictions and options are unchanged.
+    # They are also written to a folder every worker shares unless RESULT_CACHE_DISK=false
+    app.config['RESULT_CACHE_MAX_BYTES'] = int(os.getenv('RESULT_CACHE_MAX_MB', 64)) * 1024 * 1024
+    app.config['RESULT_CACHE_FOLDER'] = (
+        os.path.join(app.config['UPLOAD_FOLDER'], 'results')
+        if os.getenv('RESULT_CACHE_DISK', 'true').lower() in ('1', 'true', 'yes') else None
+    )
+    app.config['RESULT_CACHE_DISK_MAX_BYTES'] = int(os.getenv('RESULT_CACHE_DISK_MAX_MB', 256)) * 1024 * 1024
 
-log_file = os.path.join(log_dir, 'app.log')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+    # Parsed stock is also kept in the database, so allocations can run without a stored upload
+    app.config['STOCK_LEDGER'] = os.getenv('STOCK_LEDGER', 'true').lower() in ('1', 'true', 'yes')
 
-# Add file handler
-file_handler = RotatingFileHandler(
-    log_file,
-    maxBytes=1024*1024,
-    backupCount=5
-)
-file_handler.setFormatter(
-    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-)
-app.logger.addHandler(file_handler)
+    # Debug mode in development
+    app.config['DEBUG'] = IS_DEVELOPMENT
+
+    # Log file, created with the app rather than on import
+    app.config['LOG_DIR'] = os.getenv('LOG_DIR', 'logs')
+
+    if config:
+        app.config.update(config)
+
+    # Initialize SQLAlchemy with the app; tables are created by init_db
+    init_database(app)
+    # Stores and job queues, built on first use by service()
+    app.extensions['allocation_services'] = {}
+    add_log_file(app)
+    app.register_blueprint(api)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the database tables."""
+        init_db(app)
+
+    return app
+
+
+def add_log_file(app):
+    """Also write the app's log to a rotating file in LOG_DIR."""
+    log_dir = app.config['LOG_DIR']
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    file_handler = RotatingFileHandler(
+        os.path.join(log_dir, 'app.log'),
+        maxBytes=1024*1024,
+        backupCount=5
+    )
+    file_handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+    app.logger.addHandler(file_handler)
+
+
+def init_db(app):
+    """
+    Create any missing tables.
+
+    Run once per deployment rather than by each worker: by the gunicorn master
+    (see gunicorn.conf.py), `flask --app app init-db` or `python app.py`.
+    """
+    import stock_ledger  # Registers the stock ledger tables
+    with app.app_context():
+        db.create_all()
+        # Connections opened here are not carried into forked workers
+        db.engine.dispose()
+
+
+def warm_up(app):
+    """
+    Import the pandas-based modules and build the app's services before the first request.
+
+    Under gunicorn --preload this runs in the master, so the workers fork with
+    everything loaded and share those pages copy-on-write.
+    """
+    for module in HEAVY_MODULES:
+        importlib.import_module(module)
+    with app.app_context():
+        for name in SERVICES:
+            service(name)
+
+
+def build_upload_store(config):
+    return UploadStore(
+        config['UPLOAD_STORE_FOLDER'],
+        config['UPLOAD_MAX_AGE_SECONDS'],
+        config['UPLOAD_STORE_MAX_BYTES']
+    )
+
+def build_snapshot_cache(config):
+    from upload_cache import SnapshotCache
+    return SnapshotCache(config['SNAPSHOT_FOLDER'])
+
+def build_job_manager(config):
+    return JobManager(
+        max_workers=config['ALLOCATION_JOB_WORKERS'],
+        folder=config['ALLOCATION_JOB_FOLDER'],
+        max_age=config['ALLOCATION_JOB_MAX_AGE_SECONDS']
+    )
+
+def build_session_store(config):
+    from allocation_session import SessionStore
+    return SessionStore(max_sessions=config['ALLOCATION_SESSIONS'])
+
+def build_result_cache(config):
+    return ResultCache(
+        config['RESULT_CACHE_MAX_BYTES'],
+        config['RESULT_CACHE_FOLDER'],
+        config['RESULT_CACHE_DISK_MAX_BYTES']
+    )
+
+SERVICES = {
+    'upload_store': build_upload_store,
+    'snapshot_cache': build_snapshot_cache,
+    'job_manager': build_job_manager,
+    'session_store': build_session_store,
+    'result_cache': build_result_cache,
+}
+SERVICES_LOCK = threading.Lock()
+
+def service(name):
+    """The current app's upload store, snapshot cache, job manager, session store or result cache."""
+    services = current_app.extensions['allocation_services']
+    if name not in services:
+        with SERVICES_LOCK:
+            if name not in services:
+                services[name] = SERVICES[name](current_app.config)
+    return services[name]
+
+@api.before_app_request
+def start_request_timing():
+    g.timing_token = metrics.start_request()
+
+@api.after_app_request
+def record_request_timing(response):
+    """Expose the request's phase timings as Server-Timing and add them to /metrics."""
+    timing = metrics.current_timing()
+    if timing is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.registry.record(request.method, route, response.status_code, timing)
+        response.headers['Server-Timing'] = timing.server_timing()
+    return response
+
+@api.teardown_app_request
+def finish_request_timing(exc):
+    token = g.pop('timing_token', None)
+    if token is not None:
+        metrics.finish_request(token)
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    from ingestion import UPLOAD_FORMATS
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in UPLOAD_FORMATS
+
+def upload_source():
+    """
+    Find the uploaded content: a multipart 'file' field, or a raw CSV, JSON or Parquet body.
 
-def validate_excel_columns(df, required_columns, file_type):
-    """Validate that all required columns are present in the Excel file."""
-    missing_columns = [col for col in required_columns if col not in df.columns]
-    if missing_columns:
-        raise ValueError(f"Missing required columns in {file_type} file: {', '.join(missing_columns)}")
+    Returns:
+        Tuple: ((stream, format), None) on success, or (None, error response)
+    """
+    if 'file' in request.files:
+        file = request.files['file']
+        if file.filename == '':
+            return None, (jsonify({"error": "No selected file"}), 400)
+        if not allowed_file(file.filename):
+            return None, (jsonify({"error": "Invalid file format. Only .xlsx, .csv, .parquet and .json files are allowed"}), 400)
+        return (file.stream, file.filename.rsplit('.', 1)[1].lower()), None
+
+    file_format = BODY_FORMATS.get(request.mimetype)
+    if file_format is None:
+        return None, (jsonify({"error": "No file part"}), 400)
+    return (request.stream, file_format), None
+
+def evict_uploads():
+    """Drop expired uploads together with their parsed snapshots."""
+    for kind, upload_id in service('upload_store').evict():
+        service('snapshot_cache').discard(kind, upload_id)
+
+def sync_stock_ledger(upload_id, stock_df, mode='full'):
+    """
+    Load parsed stock into the ledger unless it already holds that upload.
+
+    Returns:
+        Dict: The recorded load with its change counts, or None if nothing was loaded
+    """
+    from stock_ledger import apply_stock_delta, ledger_upload_id, load_stock
+    if not current_app.config['STOCK_LEDGER'] or ledger_upload_id() == upload_id:
+        return None
+    with metrics.phase('ledger_load'):
+        if mode == 'delta':
+            return apply_stock_delta(stock_df, upload_id)
+        return load_stock(stock_df, upload_id)
+
+def stock_upload_response(upload_id, rows, changes):
+    response = {"status": "success", "rows": rows, "upload_id": upload_id}
+    if changes is not None:
+        response["changes"] = changes
+    return response
 
 def secure_temp_file():
     """Create a secure temporary file with a random name."""
     random_suffix = hashlib.md5(os.urandom(32)).hexdigest()
     return Path(tempfile.gettempdir()) / f"temp_{random_suffix}.xlsx"
 
-@app.route('/upload_stock', methods=['POST'])
+@api.route('/upload_stock', methods=['POST'])
 def upload_stock():
-    """Upload and validate stock Excel file."""
+    """
+    Upload and validate a stock file: Excel, CSV, Parquet or a JSON array of rows,
+    as a multipart 'file' field or as the raw request body.
+
+    With mode=delta the stock ledger is updated by diffing the sheet against it
+    instead of being replaced, and the response reports the changes applied.
+    """
+    import pandas as pd
+    from ingestion import read_stock_file
+    from stock_ledger import STOCK_LOAD_MODES
+    from validation import UploadValidationError
+
+    upload_store = service('upload_store')
+    snapshot_cache = service('snapshot_cache')
     try:
-        if 'file' not in request.files:
-            return jsonify({"error": "No file part"}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "No selected file"}), 400
-            
-        if not allowed_file(file.filename):
-            return jsonify({"error": "Invalid file format. Only .xlsx files are allowed"}), 400
+        mode = request.args.get('mode') or request.form.get('mode') or 'full'
+        if mode not in STOCK_LOAD_MODES:
+            return jsonify({"error": f"Unknown upload mode: {mode}"}), 400
+        if mode == 'delta' and not current_app.config['STOCK_LEDGER']:
+            return jsonify({"error": "Delta uploads need the stock ledger, which is disabled"}), 400
+
+        source, error = upload_source()
+        if error:
+            return error
+        stream, file_format = source
 
-        # Save with consistent name
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], 'stock.xlsx')
+        # Store under the content hash, which is returned as the upload ID
+        with metrics.phase('store_upload'):
+            upload_id, path, is_new = upload_store.save('stock', stream, file_format)
+            evict_uploads()
         try:
-            file.save(temp_path)
-            df = pd.read_excel(temp_path, engine='openpyxl')
-            
-            # Validate required columns
-            required_columns = [
-                'Location', 'Batch Number', 'Stock Weight', 'Material ID',
-                'Real Stock Age', 'Variety', 'GGN', 'Origin Country',
-                'Q3: Reinspection Quality', 'BL/AWB/CMR', 'Allocation',
-                'MinimumSize', 'Origin Pallet Number', 'Supplier'
-            ]
-            validate_excel_columns(df, required_columns, 'stock')
-            
-            # Basic data validation
-            if df.empty:
-                raise ValueError("Stock file is empty")
-            if df['Stock Weight'].isnull().any():
-                raise ValueError("Stock Weight cannot be empty")
-            
-            app.logger.info(f"Stock file processed successfully: {len(df)} rows")
-            return jsonify({"status": "success", "rows": len(df)}), 200
+            # Identical bytes were parsed and validated before
+            with metrics.phase('snapshot_load'):
+                snapshot = snapshot_cache.load('stock', upload_id)
+            if snapshot is not None:
+                current_app.logger.info(f"Stock file unchanged, reusing snapshot: {len(snapshot)} rows")
+                changes = sync_stock_ledger(upload_id, snapshot, mode)
+                return jsonify(stock_upload_response(upload_id, len(snapshot), changes)), 200
+
+            # Streams the file, checking columns and values chunk by chunk
+            df = read_stock_file(path)
+            # The snapshot is only kept once the ledger holds the stock, so a failed
+            # ledger load is retried by the next upload of the same file
+            changes = sync_stock_ledger(upload_id, df, mode)
+            with metrics.phase('snapshot_store'):
+                snapshot_cache.store('stock', upload_id, df)
+
+            current_app.logger.info(f"Stock file processed successfully: {len(df)} rows")
+            return jsonify(stock_upload_response(upload_id, len(df), changes)), 200
             
         except Exception as e:
-            # Clean up file on error
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            # Invalid content is not kept
+            if is_new:
+                upload_store.discard('stock', upload_id)
             raise e
                 
     except pd.errors.EmptyDataError:
-        app.logger.error("Empty Excel file uploaded")
+        current_app.logger.error("Empty Excel file uploaded")
         return jsonify({"error": "The Excel file is empty"}), 400
     except pd.errors.ParserError as e:
-        app.logger.error(f"Excel parsing error: {str(e)}")
+        current_app.logger.error(f"Excel parsing error: {str(e)}")
         return jsonify({"error": "Invalid Excel file format"}), 400
+    except UploadValidationError as e:
+        # Every row error at once, so the sheet can be fixed in one go
+        current_app.logger.error(f"Validation error: {str(e)}")
+        return jsonify({"error": str(e), "errors": e.errors, "error_count": e.total}), 400
     except ValueError as e:
-        app.logger.error(f"Validation error: {str(e)}")
+        current_app.logger.error(f"Validation error: {str(e)}")
         return jsonify({"error": str(e)}), 400
     except Exception as e:
-        app.logger.error(f"Unexpected error in upload_stock: {str(e)}")
+        current_app.logger.error(f"Unexpected error in upload_stock: {str(e)}")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
-@app.route('/upload_orders', methods=['POST'])
+@api.route('/upload_orders', methods=['POST'])
 def upload_orders():
-    """Upload and validate orders Excel file."""
+    """Upload and validate an orders file, in the same formats as /upload_stock."""
+    import pandas as pd
+    from ingestion import read_orders_file
+    from validation import UploadValidationError
+
+    upload_store = service('upload_store')
+    snapshot_cache = service('snapshot_cache')
     try:
-        if 'file' not in request.files:
-            return jsonify({"error": "No file part"}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "No selected file"}), 400
-            
-        if not allowed_file(file.filename):
-            return jsonify({"error": "Invalid file format. Only .xlsx files are allowed"}), 400
+        source, error = upload_source()
+        if error:
+            return error
+        stream, file_format = source
 
-        # Save with consistent name
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], 'orders.xlsx')
+        # Store under the content hash, which is returned as the upload ID
+        with metrics.phase('store_upload'):
+            upload_id, path, is_new = upload_store.save('orders', stream, file_format)
+            evict_uploads()
         try:
-            file.save(temp_path)
-            df = pd.read_excel(temp_path, engine='openpyxl')
-            
-            # Validate required columns
-            required_columns = [
-                'Loading Date', 'Sales Document Item', 'Sales Document',
-                'Order', 'Sold-to Party', 'Description material', 'Quantity KG'
-            ]
-            validate_excel_columns(df, required_columns, 'orders')
-            
-            # Basic data validation
-            if df.empty:
-                raise ValueError("Orders file is empty")
-            if df['Quantity KG'].isnull().any():
-                raise ValueError("Quantity cannot be empty")
-            if (df['Quantity KG'] < 0).any():
-                raise ValueError("Quantity cannot be negative")
-            
-            orders = [{
-                "loading_date": row['Loading Date'].strftime('%Y-%m-%d') if pd.notnull(row['Loading Date']) else None,
-                "sales_document": str(row['Sales Document']),
-                "sold_to_party": str(row['Sold-to Party']),
-                "description_material": str(row['Description material']),
-                "quantity": float(row['Quantity KG'])
-            } for _, row in df.iterrows()]
-            
-            app.logger.info(f"Orders file processed successfully: {len(orders)} orders")
-            return jsonify({"status": "success", "orders": len(orders)}), 200
+            # Identical bytes were parsed and validated before
+            with metrics.phase('snapshot_load'):
+                snapshot = snapshot_cache.load('orders', upload_id)
+            if snapshot is not None:
+                current_app.logger.info(f"Orders file unchanged, reusing snapshot: {len(snapshot)} orders")
+                return jsonify({"status": "success", "orders": len(snapshot), "upload_id": upload_id}), 200
+
+            # Streams the file, checking columns and values chunk by chunk
+            df = read_orders_file(path)
+            with metrics.phase('snapshot_store'):
+                snapshot_cache.store('orders', upload_id, df)
+
+            current_app.logger.info(f"Orders file processed successfully: {len(df)} orders")
+            return jsonify({"status": "success", "orders": len(df), "upload_id": upload_id}), 200
             
         except Exception as e:
-            # Clean up file on error
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            # Invalid content is not kept
+            if is_new:
+                upload_store.discard('orders', upload_id)
             raise e
                 
     except pd.errors.EmptyDataError:
-        app.logger.error("Empty Excel file uploaded")
+        current_app.logger.error("Empty Excel file uploaded")
         return jsonify({"error": "The Excel file is empty"}), 400
     except pd.errors.ParserError as e:
-        app.logger.error(f"Excel parsing error: {str(e)}")
+        current_app.logger.error(f"Excel parsing error: {str(e)}")
         return jsonify({"error": "Invalid Excel file format"}), 400
+    except UploadValidationError as e:
+        # Every row error at once, so the sheet can be fixed in one go
+        current_app.logger.error(f"Validation error: {str(e)}")
+        return jsonify({"error": str(e), "errors": e.errors, "error_count": e.total}), 400
     except ValueError as e:
-        app.logger.error(f"Validation error: {str(e)}")
+        current_app.logger.error(f"Validation error: {str(e)}")
         return jsonify({"error": str(e)}), 400
     except Exception as e:
-        app.logger.error(f"Unexpected error in upload_orders: {str(e)}")
+        current_app.logger.error(f"Unexpected error in upload_orders: {str(e)}")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
-@app.route('/allocate', methods=['POST'])
+def allocation_request(options):
+    """
+    Resolve and check the uploads, stock source, engine and order options of an
+    allocation request without loading any of its data.
+
+    Returns:
+        Tuple: (request dict, None) on success, or (None, error response)
+    """
+    from allocation_logic import ALLOCATION_ENGINES
+    from scheduling import SCHEDULE_PRIORITIES, TIE_BREAKS
+    from stock_ledger import ledger_upload_id
+
+    upload_store = service('upload_store')
+    # Explicit upload IDs, or the most recent uploads when none are given
+    stock_id = request.args.get('stock_id') or options.get('stock_id')
+    orders_id = request.args.get('orders_id') or options.get('orders_id')
+    if stock_id and not upload_store.path('stock', stock_id):
+        return None, (jsonify({"error": f"Unknown or expired stock upload: {stock_id}"}), 404)
+    if orders_id and not upload_store.path('orders', orders_id):
+        return None, (jsonify({"error": f"Unknown or expired orders upload: {orders_id}"}), 404)
+
+    stock_id = stock_id or upload_store.latest('stock')
+    orders_id = orders_id or upload_store.latest('orders')
+    stock_file = upload_store.path('stock', stock_id)
+    orders_file = upload_store.path('orders', orders_id)
+
+    # stock_source=ledger reads the stock from the database; without a stored stock
+    # upload, e.g. after a restart, the ledger is used when it holds any stock
+    stock_source = request.args.get('stock_source') or options.get('stock_source')
+    if stock_source is not None and stock_source not in STOCK_SOURCES:
+        return None, (jsonify({"error": f"Unknown stock source: {stock_source}"}), 400)
+    ledger_id = None
+    if stock_source == 'ledger':
+        ledger_id = ledger_upload_id()
+        if ledger_id is None:
+            return None, (jsonify({"error": "Stock ledger is empty, please upload a stock file first"}), 400)
+    elif stock_source is None and not stock_file and current_app.config['STOCK_LEDGER']:
+        ledger_id = ledger_upload_id()
+    use_ledger = ledger_id is not None
+    if not ((stock_file or use_ledger) and orders_file):
+        return None, (jsonify({"error": "Please upload both stock and orders files first"}), 400)
+
+    # Allocation engine from the query string or JSON body, defaulting to the stock pool
+    engine = request.args.get('engine') or options.get('engine') or 'pool'
+    if engine not in ALLOCATION_ENGINES:
+        return None, (jsonify({"error": f"Unknown allocation engine: {engine}"}), 400)
+
+    # Orders are allocated by loading date unless priority=sheet; horizon_days limits the run
+    priority = request.args.get('priority') or options.get('priority') or 'loading_date'
+    tie_break = request.args.get('tie_break') or options.get('tie_break') or 'sheet'
+    horizon_days = request.args.get('horizon_days', options.get('horizon_days'))
+    if priority not in SCHEDULE_PRIORITIES:
+        return None, (jsonify({"error": f"Unknown order priority: {priority}"}), 400)
+    if tie_break not in TIE_BREAKS:
+        return None, (jsonify({"error": f"Unknown tie-break: {tie_break}"}), 400)
+    if horizon_days is not None and horizon_days != '':
+        try:
+            horizon_days = int(horizon_days)
+        except (TypeError, ValueError):
+            return None, (jsonify({"error": f"Invalid horizon_days: {horizon_days}"}), 400)
+        if horizon_days < 0:
+            return None, (jsonify({"error": f"Horizon cannot be negative: {horizon_days}"}), 400)
+    else:
+        horizon_days = None
+
+    return {
+        "stock_id": None if use_ledger else stock_id,
+        "orders_id": orders_id,
+        "stock_file": stock_file,
+        "orders_file": orders_file,
+        # Upload ID of the stock load the ledger holds, when the stock comes from it
+        "ledger_id": ledger_id,
+        "engine": engine,
+        "priority": priority,
+        "tie_break": tie_break,
+        "horizon_days": horizon_days,
+    }, None
+
+def allocation_inputs(resolved):
+    """
+    Load the stock, scheduled orders and restrictions of a resolved allocation request.
+
+    Returns:
+        Tuple: (inputs dict, None) on success, or (None, error response)
+    """
+    from ingestion import read_orders_file, read_stock_file
+    from scheduling import schedule_orders
+    from stock_ledger import stock_for_orders
+
+    use_ledger = resolved["ledger_id"] is not None
+    stock_id, orders_id = resolved["stock_id"], resolved["orders_id"]
+    stock_file, orders_file = resolved["stock_file"], resolved["orders_file"]
+    priority, tie_break, horizon_days = resolved["priority"], resolved["tie_break"], resolved["horizon_days"]
+
+    # Load the parsed snapshots, falling back to the Excel files when one is missing
+    with metrics.phase('snapshot_load'):
+        if not use_ledger:
+            stock_df = service('snapshot_cache').load_for_file('stock', stock_file, read_stock_file, stock_id)
+        orders_df = service('snapshot_cache').load_for_file('orders', orders_file, read_orders_file, orders_id)
+        orders = orders_df.to_dict('records')
+
+    with metrics.phase('schedule'):
+        orders = schedule_orders(orders, priority, tie_break, horizon_days)
+    if not orders:
+        return None, (jsonify({"error": f"No orders load within the next {horizon_days} days"}), 400)
+
+    # Default and per-customer restrictions for every Sold-to Party in one query
+    with metrics.phase('restrictions'):
+        restrictions, customer_restrictions = get_restrictions_for_customers(
+            order['sold_to_party'] for order in orders
+        )
+
+    if use_ledger:
+        # Only batches of ordered materials that some order's restrictions accept
+        with metrics.phase('ledger_query'):
+            stock_df = stock_for_orders(orders, restrictions, customer_restrictions)
+
+    return {
+        "stock_df": stock_df,
+        "orders": orders,
+        "restrictions": restrictions,
+        "customer_restrictions": customer_restrictions,
+        "engine": resolved["engine"],
+    }, None
+
+def load_allocation_inputs(options):
+    """
+    Resolve the uploads, engine and restrictions for an allocation request.
+
+    Returns:
+        Tuple: (inputs dict, None) on success, or (None, error response)
+    """
+    resolved, error = allocation_request(options)
+    if error:
+        return None, error
+    return allocation_inputs(resolved)
+
+def allocation_result_key(resolved):
+    """
+    Cache key and ETag of an allocation: the stock and orders content hashes, the
+    restrictions version and every option that changes the result.
+
+    The optimal engine has no key, since what it returns within its time budget
+    depends on how fast the machine is at the time.
+    """
+    return result_key(
+        stock_id=resolved["stock_id"],
+        ledger_id=resolved["ledger_id"],
+        orders_id=resolved["orders_id"],
+        restrictions_version=current_restrictions_version(),
+        engine=resolved["engine"],
+        priority=resolved["priority"],
+        tie_break=resolved["tie_break"],
+        horizon_days=resolved["horizon_days"],
+        # A horizon counts from today, so the same request selects other orders tomorrow
+        today=date.today().isoformat() if resolved["horizon_days"] is not None else None,
+    )
+
+def run_allocation(inputs, workers=1, progress=None):
+    """Run allocate_fruits on resolved request inputs."""
+    from allocation_logic import allocate_fruits
+    return allocate_fruits(
+        inputs["stock_df"], inputs["orders"], inputs["restrictions"],
+        engine=inputs["engine"], progress=progress,
+        customer_restrictions=inputs["customer_restrictions"],
+        workers=workers
+    )
+
+def is_truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def wants_ndjson(options):
+    """Stream when asked with stream=true or when the client prefers NDJSON over JSON."""
+    if is_truthy(request.args.get('stream', options.get('stream', False))):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def start_allocation(inputs):
+    """
+    Begin a streamed allocation over resolved request inputs.
+
+    The first result is computed eagerly so invalid input raises here, before a
+    streamed response has started.
+    """
+    from allocation_logic import iter_allocations
+    results = iter_allocations(
+        inputs["stock_df"], inputs["orders"], inputs["restrictions"],
+        engine=inputs["engine"], customer_restrictions=inputs["customer_restrictions"]
+    )
+    first = next(results, None)
+    return results if first is None else itertools.chain([first], results)
+
+def stream_allocation(inputs):
+    """
+    Stream allocation results as NDJSON, one order per line, as each order is decided.
+
+    Invalid input still gets a regular error response; a failure later in the run
+    ends the stream with an {"error": ...} line.
+    """
+    from allocation_logic import ValidationError
+    results = start_allocation(inputs)
+
+    def lines():
+        try:
+            for sales_doc, result in results:
+                yield json.dumps({"sales_document": sales_doc, **result}) + '\n'
+        except ValidationError as e:
+            current_app.logger.error(f"Error during streamed allocation: {str(e)}")
+            yield json.dumps({"error": str(e)}) + '\n'
+
+    return Response(stream_with_context(lines()), mimetype=NDJSON_MIMETYPE,
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def cached_work(result):
+    """Job work that completes with a cached allocation."""
+    def work(progress):
+        progress(len(result["allocation"]))
+        return result
+    return work
+
+@api.route('/allocate', methods=['POST'])
 def allocate():
-    """Allocate stock based on orders and restrictions."""
+    """
+    Allocate stock based on orders and restrictions.
+
+    With async=true (query string or JSON body) the run is queued as a background
+    job and the response carries its ID instead of the allocation. With stream=true
+    or an Accept: application/x-ndjson header the results are streamed as NDJSON.
+
+    JSON results are cached under allocation_result_key and carry it as their ETag;
+    a request sending it in If-None-Match gets a 304 without anything being loaded
+    or allocated. Async jobs read and fill the same cache. Results of the optimal
+    engine are neither cached nor tagged.
+    """
+    from optimal_allocation import DEFAULT_TIME_BUDGET, optimize_allocation
+
     try:
-        # Get the latest uploaded files from temp storage
-        stock_file = os.path.join(app.config['UPLOAD_FOLDER'], 'stock.xlsx')
-        orders_file = os.path.join(app.config['UPLOAD_FOLDER'], 'orders.xlsx')
-        
-        if not (os.path.exists(stock_file) and os.path.exists(orders_file)):
-            return jsonify({"error": "Please upload both stock and orders files first"}), 400
-
-        # Read the Excel files
-        stock_df = pd.read_excel(stock_file)
-        orders_df = pd.read_excel(orders_file)
-        
-        # Get default restrictions
-        restrictions = get_restrictions("default")
-
-        # Ensure column names match stock data
-        stock_df.columns = [col.strip() for col in stock_df.columns]
-        stock_df['Stock Weight'] = stock_df['Stock Weight'].apply(
-            lambda x: float(str(x).split()[0]) if isinstance(x, str) else float(x)
-        )
-        stock_df['Real Stock Age'] = stock_df['Real Stock Age'].astype(int)
-
-        # Convert orders DataFrame to list of dictionaries
-        orders = []
-        for _, row in orders_df.iterrows():
-            order = {
-                "loading_date": row['Loading Date'].strftime('%Y-%m-%d') if pd.notnull(row['Loading Date']) else None,
-                "sales_document": str(row['Order Number']),
-                "sold_to_party": str(row['Customer']),
-                "description_material": str(row['Material ID']),
-                "quantity": float(row['Order Weight'])
-            }
-            orders.append(order)
-
-        # Perform allocation
-        allocation = allocate_fruits(stock_df, orders, restrictions)
-        
-        return jsonify({"allocation": allocation}), 200
+        options = request.get_json(silent=True) or {}
+        resolved, error = allocation_request(options)
+        if error:
+            return error
+        run_async = is_truthy(request.args.get('async', options.get('async', False)))
+        stream = not run_async and wants_ndjson(options)
+
+        time_budget = None
+        if resolved["engine"] == 'optimal' and not (run_async or stream):
+            # The solver reports how its allocation compares with greedy FIFO
+            time_budget = request.args.get('time_budget', options.get('time_budget', DEFAULT_TIME_BUDGET))
+            try:
+                time_budget = float(time_budget)
+            except (TypeError, ValueError):
+                return jsonify({"error": f"Invalid time_budget: {time_budget}"}), 400
+
+        result_cache = service('result_cache')
+        key = None
+        if not stream and resolved["engine"] != 'optimal':
+            key = allocation_result_key(resolved)
+            if not run_async and request.if_none_match.contains_weak(key):
+                metrics.count('result_cache_not_modified')
+                response = current_app.response_class(status=304)
+                response.set_etag(key)
+                return response
+            with metrics.phase('result_cache'):
+                payload = result_cache.get(key)
+            if payload is not None:
+                metrics.count('result_cache_hits')
+                if run_async:
+                    result = json.loads(payload)
+                    job = service('job_manager').submit(cached_work(result), total=len(result["allocation"]))
+                    return jsonify({"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}"}), 202
+                response = current_app.response_class(payload, mimetype=current_app.json.mimetype)
+                response.set_etag(key)
+                return response, 200
 
+        inputs, error = allocation_inputs(resolved)
+        if error:
+            return error
+
+        if run_async:
+            # Jobs run outside the app context, so the settings are read here
+            workers = current_app.config['ALLOCATION_WORKERS']
+            json_provider = current_app.json
+
+            def work(progress):
+                result = {"allocation": run_allocation(inputs, workers, progress)}
+                if key is not None:
+                    result_cache.put(key, json_provider.response(result).get_data())
+                return result
+
+            job = service('job_manager').submit(work, total=len(inputs["orders"]))
+            return jsonify({"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}"}), 202
+
+        if stream:
+            return stream_allocation(inputs)
+
+        if inputs["engine"] == 'optimal':
+            with metrics.phase('allocation'):
+                results, report = optimize_allocation(
+                    inputs["stock_df"], inputs["orders"], inputs["restrictions"],
+                    inputs["customer_restrictions"], time_budget
+                )
+            body = {"allocation": dict(results), "optimization": report}
+        else:
+            # Perform allocation
+            body = {"allocation": run_allocation(inputs, current_app.config['ALLOCATION_WORKERS'])}
+
+        with metrics.phase('serialize'):
+            response = jsonify(body)
+        if key is not None:
+            result_cache.put(key, response.get_data())
+            response.set_etag(key)
+        return response, 200
+
+    except Exception as e:
+        current_app.logger.error(f"Error during allocation: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/allocate/export', methods=['GET', 'POST'])
+def export_allocation():
+    """
+    Export the allocation as a spreadsheet with one row per order and batch line.
+
+    Takes the same upload and engine options as /allocate plus format=xlsx|csv.
+    CSV is streamed while orders are allocated, and a failure later in the run
+    ends it with an "error" row; xlsx is written with a write-only workbook to a
+    temporary file that is streamed back and removed when the response closes,
+    also if the client disconnects first.
+    """
+    from allocation_logic import ValidationError
+    from export import EXPORT_FORMATS, csv_error_row, iter_csv, iter_file, remove_file, write_xlsx
+
+    try:
+        options = request.get_json(silent=True) or {}
+        export_format = (request.args.get('format') or options.get('format') or 'xlsx').lower()
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error": f"Unknown export format: {export_format}"}), 400
+
+        inputs, error = load_allocation_inputs(options)
+        if error:
+            return error
+
+        results = start_allocation(inputs)
+        filename = f"allocation_{datetime.now():%Y%m%d_%H%M%S}.{export_format}"
+        headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+        if export_format == 'csv':
+            def blocks():
+                try:
+                    yield from iter_csv(results)
+                except ValidationError as e:
+                    current_app.logger.error(f"Error during streamed allocation export: {str(e)}")
+                    yield csv_error_row(str(e))
+
+            return Response(stream_with_context(blocks()), mimetype='text/csv', headers=headers)
+
+        with metrics.phase('export'):
+            path = write_xlsx(results, current_app.config['UPLOAD_FOLDER'])
+        headers["Content-Length"] = str(os.path.getsize(path))
+        response = Response(iter_file(path), mimetype=XLSX_MIMETYPE, headers=headers)
+        response.call_on_close(lambda: remove_file(path))
+        return response
+
+    except Exception as e:
+        current_app.logger.error(f"Error during allocation export: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def replayed_orders(replayed):
+    return [
+        {"position": position, "sales_document": record.filled.sales_document, **record.filled.result}
+        for position, record in replayed if record.filled is not None
+    ]
+
+@api.route('/sessions', methods=['POST'])
+def create_session():
+    """
+    Start an incremental allocation session over uploaded stock and orders.
+
+    Takes the same upload options as /allocate. Like jobs, sessions live in the
+    worker that created them.
+    """
+    from allocation_logic import ValidationError
+    from allocation_session import AllocationSession
+
+    try:
+        options = request.get_json(silent=True) or {}
+        inputs, error = load_allocation_inputs(options)
+        if error:
+            return error
+
+        with metrics.phase('allocation'):
+            session = AllocationSession(
+                inputs["stock_df"], inputs["orders"], inputs["restrictions"], inputs["customer_restrictions"]
+            )
+        session_id = service('session_store').add(session)
+        return jsonify({"session_id": session_id, "allocation": session.results()}), 201
+
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        app.logger.error(f"Error during allocation: {str(e)}")
+        current_app.logger.error(f"Error creating allocation session: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/get_restrictions', methods=['GET'])
+@api.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """Current allocation of a session."""
+    session = service('session_store').get(session_id)
+    if session is None:
+        return jsonify({"error": f"Unknown or expired session: {session_id}"}), 404
+    with session.lock:
+        return jsonify({"session_id": session_id, "allocation": session.results()}), 200
+
+@api.route('/sessions/<session_id>/changes', methods=['POST'])
+def apply_session_changes(session_id):
+    """
+    Apply order and stock changes to a session and return the orders allocated again.
+
+    The body holds {"changes": [...]}, each change an object with an "op" of
+    add_order, update_order, remove_order, set_batch_weight or add_batch. Changes
+    are applied in sequence; one that is rejected stops the rest.
+    """
+    from allocation_logic import ValidationError
+
+    session = service('session_store').get(session_id)
+    if session is None:
+        return jsonify({"error": f"Unknown or expired session: {session_id}"}), 404
+
+    changes = (request.get_json(silent=True) or {}).get('changes')
+    if not isinstance(changes, list):
+        return jsonify({"error": "Request body must contain a list of changes"}), 400
+
+    replayed = {}
+    with session.lock:
+        for index, change in enumerate(changes):
+            try:
+                for position, record in session.apply(change):
+                    replayed[id(record)] = (position, record)
+            except ValidationError as e:
+                return jsonify({"error": f"Change {index}: {str(e)}", "applied": index}), 400
+
+        # Positions are reported as they stand after the last change
+        current = {id(record): position for position, record in enumerate(session.records)}
+        changed = [(current[key], record) for key, (_, record) in replayed.items() if key in current]
+        changed.sort(key=lambda item: item[0])
+        metrics.count('orders_replayed', len(changed))
+        return jsonify({"session_id": session_id, "changes": len(changes), "orders": replayed_orders(changed)}), 200
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report an allocation job's status and progress, with the result once completed."""
+    job = service('job_manager').get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify(job.to_dict()), 200
+
+@api.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream an allocation job's progress as Server-Sent Events until it finishes."""
+    jobs = service('job_manager')
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+
+    def events():
+        nonlocal job
+        last = None
+        while True:
+            # Jobs run by another worker are read again from the shared folder
+            job = jobs.get(job_id) or job
+            state = (job.status, job.processed)
+            if state != last:
+                last = state
+                yield f"event: progress\ndata: {json.dumps(job.to_dict(include_result=False))}\n\n"
+            if job.finished:
+                yield f"event: {job.status}\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            time.sleep(0.5)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache"})
+
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request latency histograms, phase timings and item counts in the Prometheus text format."""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/get_restrictions', methods=['GET'])
 def get_restrictions_endpoint():
     """Retrieve customer restrictions from SQLite."""
     customer_id = request.args.get('customer_id', 'default')
@@ -279,4 +944,6 @@ def get_restrictions_endpoint():
     return jsonify({"restrictions": restrictions}), 200
 
 if __name__ == "__main__":
+    app = create_app()
+    init_db(app)
     app.run(debug=True, host='0.0.0.0', port=PORT)
@@ -1,3 +1,135 @@
+import logging
+from typing import Dict, List
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 db = SQLAlchemy()
+
+# SQLite journal and sync modes accepted from the environment
+SQLITE_JOURNAL_MODES = ('wal', 'delete', 'truncate', 'persist', 'memory')
+SQLITE_SYNCHRONOUS = ('off', 'normal', 'full', 'extra')
+
+
+def database_url(url: str) -> str:
+    """Accept the postgres:// scheme hosting providers hand out, which SQLAlchemy no longer does."""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def is_memory_sqlite(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == 'sqlite' and parsed.database in (None, '', ':memory:')
+
+
+def engine_options(url: str, pool_size: int = 5, max_overflow: int = 10,
+                   pool_recycle: int = 1800) -> Dict:
+    """
+    Pool settings for a database URL.
+
+    Args:
+        url (str): SQLAlchemy database URL
+        pool_size (int): Connections kept open per worker
+        max_overflow (int): Extra connections opened under load and closed afterwards
+        pool_recycle (int): Seconds after which a server connection is replaced
+
+    Returns:
+        Dict: Options for create_engine; empty for in-memory SQLite, which shares one connection
+    """
+    if is_memory_sqlite(url):
+        return {}
+    options = {"pool_size": pool_size, "max_overflow": max_overflow}
+    if make_url(url).get_backend_name() == 'postgresql':
+        # Server connections are dropped by proxies and restarts; test them before use
+        options["pool_pre_ping"] = True
+        options["pool_recycle"] = pool_recycle
+    return options
+
+
+def connection_settings(backend: str, busy_timeout_ms: int = 5000, journal_mode: str = 'wal',
+                        synchronous: str = 'normal') -> List[str]:
+    """
+    Statements run on every new connection.
+
+    On SQLite, WAL lets readers run while a write is in progress, synchronous=NORMAL
+    syncs the WAL at checkpoints rather than at every commit (still safe in WAL mode
+    against application crashes), and the busy timeout makes a second writer wait
+    instead of failing with "database is locked". PostgreSQL already writes a WAL and
+    syncs it on commit, so only the lock wait is set there.
+
+    Args:
+        backend (str): SQLAlchemy backend name, e.g. 'sqlite' or 'postgresql'
+        busy_timeout_ms (int): How long to wait for a lock before failing
+        journal_mode (str): SQLite journal mode
+        synchronous (str): SQLite synchronous setting
+
+    Returns:
+        List[str]: SQL statements, none for other backends
+
+    Raises:
+        ValueError: If the journal mode or synchronous setting is unknown
+    """
+    if backend == 'sqlite':
+        if journal_mode.lower() not in SQLITE_JOURNAL_MODES:
+            raise ValueError(f"Unknown SQLite journal mode: {journal_mode}")
+        if synchronous.lower() not in SQLITE_SYNCHRONOUS:
+            raise ValueError(f"Unknown SQLite synchronous setting: {synchronous}")
+        # The busy timeout comes first so switching the journal mode waits for other workers too
+        return [
+            f"PRAGMA busy_timeout = {int(busy_timeout_ms)}",
+            f"PRAGMA journal_mode = {journal_mode.upper()}",
+            f"PRAGMA synchronous = {synchronous.upper()}",
+        ]
+    if backend == 'postgresql':
+        return [f"SET lock_timeout = {int(busy_timeout_ms)}"]
+    return []
+
+
+def apply_on_connect(engine, statements: List[str]) -> None:
+    """Run the statements on every connection the engine opens."""
+    if not statements:
+        return
+
+    # The PostgreSQL driver would otherwise leave a transaction open behind the SET
+    toggle_autocommit = engine.dialect.name == 'postgresql'
+
+    @event.listens_for(engine, 'connect')
+    def configure_connection(dbapi_connection, connection_record):
+        if toggle_autocommit:
+            autocommit = dbapi_connection.autocommit
+            dbapi_connection.autocommit = True
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+            if toggle_autocommit:
+                dbapi_connection.autocommit = autocommit
+
+
+def init_database(app) -> None:
+    """
+    Bind db to the app with pool settings and per-connection settings for its database.
+
+    Reads SQLALCHEMY_DATABASE_URI and the DB_* settings from the app config. Engine
+    options already set in SQLALCHEMY_ENGINE_OPTIONS take precedence.
+    """
+    config = app.config
+    url = database_url(config['SQLALCHEMY_DATABASE_URI'])
+    config['SQLALCHEMY_DATABASE_URI'] = url
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(url, config['DB_POOL_SIZE'], config['DB_MAX_OVERFLOW'], config['DB_POOL_RECYCLE_SECONDS']),
+        **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+    }
+    statements = connection_settings(make_url(url).get_backend_name(), config['DB_BUSY_TIMEOUT_MS'],
+                                     config['DB_JOURNAL_MODE'], config['DB_SYNCHRONOUS'])
+    db.init_app(app)
+    with app.app_context():
+        apply_on_connect(db.engine, statements)
+    logger.info(f"Database {make_url(url).get_backend_name()} configured with {len(statements)} connection settings")
@@ -0,0 +1,163 @@
+import sys
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+# Stock columns holding the attributes restrictions filter on, keyed by restriction field
+ATTRIBUTE_COLUMNS = {
+    'quality': 'Q3: Reinspection Quality',
+    'origin': 'Origin Country',
+    'variety': 'Variety',
+    'ggn': 'GGN',
+    'supplier': 'Supplier',
+    'minimum_size': 'MinimumSize',
+}
+ATTRIBUTE_FIELDS = tuple(ATTRIBUTE_COLUMNS)
+LIST_RESTRICTIONS = ('quality', 'origin', 'variety', 'supplier')
+EXACT_RESTRICTIONS = ('ggn', 'minimum_size')
+
+
+def restriction_key(restrictions: Optional[Dict]) -> Tuple:
+    """
+    Build a hashable key for a restrictions dict so lookups on it can be cached.
+
+    Only the restriction fields count, and empty values are left out because they do
+    not restrict anything, so equivalent restrictions share one key.
+    """
+    if not restrictions:
+        return ()
+    key = []
+    for field in ATTRIBUTE_FIELDS:
+        value = restrictions.get(field)
+        if not value:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            value = tuple(value)
+        key.append((field, value))
+    return tuple(key)
+
+
+class AttributeDictionary:
+    """Maps the distinct values of one categorical column to small integer codes."""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        """Return the code for a value, adding an interned copy on first sight."""
+        code = self._codes.get(value)
+        if code is None:
+            value = sys.intern(value)
+            code = len(self.values)
+            self.values.append(value)
+            self._codes[value] = code
+        return code
+
+    def encode_series(self, series: pd.Series) -> np.ndarray:
+        """Encode a column at once; nulls map to the empty string like StockBatch does."""
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        # Sentinel -1 indexes the trailing empty-string entry
+        mapping = np.array([self.encode(str(u)) for u in uniques] + [self.encode('')], dtype=np.int32)
+        return mapping[codes]
+
+    def decode(self, code: int) -> str:
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class CompiledRestrictions:
+    """
+    Restrictions resolved to per-field sets of allowed attribute codes.
+
+    A field without a restriction holds None and accepts every code.
+    """
+
+    def __init__(self, allowed: Tuple[Optional[frozenset], ...], key: Tuple):
+        self.allowed = allowed
+        self.key = key
+
+    def matches(self, codes: Tuple[int, ...]) -> bool:
+        for allowed, code in zip(self.allowed, codes):
+            if allowed is not None and code not in allowed:
+                return False
+        return True
+
+    def mask(self, codes: Dict[str, np.ndarray], encoding: 'StockEncoding') -> np.ndarray:
+        """Evaluate the restrictions over encoded columns with one table lookup per field."""
+        length = len(next(iter(codes.values()))) if codes else 0
+        mask = np.ones(length, dtype=bool)
+        for field, allowed in zip(ATTRIBUTE_FIELDS, self.allowed):
+            if allowed is None:
+                continue
+            table = np.zeros(len(encoding.dictionaries[field]), dtype=bool)
+            table[list(allowed)] = True
+            mask &= table[codes[field]]
+        return mask
+
+
+class StockEncoding:
+    """Dictionary encoding shared by every batch of one stock load."""
+
+    def __init__(self):
+        self.dictionaries: Dict[str, AttributeDictionary] = {
+            field: AttributeDictionary() for field in ATTRIBUTE_FIELDS
+        }
+
+    def encode_batch(self, batch) -> Tuple[int, ...]:
+        """Encode a batch's attributes, swapping its strings for the interned copies."""
+        codes = []
+        for field, dictionary in self.dictionaries.items():
+            code = dictionary.encode(getattr(batch, field))
+            setattr(batch, field, dictionary.values[code])
+            codes.append(code)
+        return tuple(codes)
+
+    def encode_frame(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """Encode every attribute column of a stock DataFrame."""
+        return {
+            field: self.dictionaries[field].encode_series(df[column])
+            for field, column in ATTRIBUTE_COLUMNS.items()
+        }
+
+    def compile(self, restrictions: Optional[Dict]) -> CompiledRestrictions:
+        """Resolve a restrictions dict to allowed code sets once, before allocation."""
+        allowed = []
+        for field in ATTRIBUTE_FIELDS:
+            value = restrictions.get(field) if restrictions else None
+            if not value:
+                allowed.append(None)
+                continue
+            values = value if field in LIST_RESTRICTIONS else [value]
+            dictionary = self.dictionaries[field]
+            allowed.append(frozenset(dictionary.encode(str(v)) for v in values))
+        return CompiledRestrictions(tuple(allowed), restriction_key(restrictions))
+
+
+class RestrictionResolver:
+    """
+    Compiled restrictions per customer for one stock load.
+
+    Each distinct restriction set is compiled once and shared by every customer and
+    order that uses it; customers without their own entry get the default set.
+    """
+
+    def __init__(self, encoding: StockEncoding, restrictions: Optional[Dict],
+                 customer_restrictions: Optional[Dict[str, Dict]] = None):
+        compiled: Dict[Tuple, CompiledRestrictions] = {}
+
+        def compile_once(values: Optional[Dict]) -> CompiledRestrictions:
+            key = restriction_key(values)
+            if key not in compiled:
+                compiled[key] = encoding.compile(values)
+            return compiled[key]
+
+        self.default = compile_once(restrictions)
+        self._customers = {
+            customer: compile_once(values) for customer, values in (customer_restrictions or {}).items()
+        }
+
+    def for_customer(self, customer: str) -> CompiledRestrictions:
+        return self._customers.get(customer, self.default)
@@ -0,0 +1,111 @@
+import csv
+import io
+import logging
+import os
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from openpyxl import Workbook
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('xlsx', 'csv')
+EXPORT_COLUMNS = [
+    'Sales Document', 'Status', 'Allocated Weight KG', 'Batch Number', 'Batch Weight KG',
+    'Real Stock Age', 'Location', 'Supplier', 'Quality', 'Origin Country'
+]
+
+# Rows written to the CSV buffer before it is handed to the client
+CSV_FLUSH_ROWS = 1000
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def iter_export_rows(results: Iterable[Tuple[str, Dict]]) -> Iterator[List]:
+    """
+    Flatten allocation results into one row per order and batch line.
+
+    Orders without batches still get a row with the batch columns left empty.
+    """
+    for sales_doc, result in results:
+        order_columns = [sales_doc, result['status'], result['weight']]
+        if not result['batches']:
+            yield order_columns + [None] * 7
+            continue
+        for line in result['batches']:
+            yield order_columns + [
+                line['batch'], line['weight'], line['age'], line['location'],
+                line['supplier'], line['quality'], line['origin']
+            ]
+
+
+def iter_csv(results: Iterable[Tuple[str, Dict]]) -> Iterator[str]:
+    """
+    Render allocation results as CSV text, yielded in buffered blocks of rows.
+
+    If the results fail part way, the rows written so far are still yielded
+    before the error is raised.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    try:
+        for count, row in enumerate(iter_export_rows(results), start=1):
+            writer.writerow(row)
+            if count % CSV_FLUSH_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    except Exception:
+        yield buffer.getvalue()
+        raise
+    yield buffer.getvalue()
+
+
+def csv_error_row(message: str) -> str:
+    """Render the row that ends a CSV export whose allocation failed."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(['error', message])
+    return buffer.getvalue()
+
+
+def write_xlsx(results: Iterable[Tuple[str, Dict]], folder: str) -> str:
+    """
+    Write allocation results to a workbook on disk and return its path.
+
+    The workbook is opened in openpyxl's write_only mode, which streams rows to
+    disk instead of keeping a cell object per value in memory. The caller removes
+    the file once the response is closed.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Allocation')
+    sheet.append(EXPORT_COLUMNS)
+    rows = 0
+    for row in iter_export_rows(results):
+        sheet.append(row)
+        rows += 1
+
+    fd, path = tempfile.mkstemp(dir=folder, prefix='allocation_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+    except Exception:
+        os.remove(path)
+        raise
+    logger.info(f"Wrote allocation export with {rows} rows")
+    return path
+
+
+def iter_file(path: str) -> Iterator[bytes]:
+    """Yield a file in chunks."""
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FILE_CHUNK_SIZE), b''):
+            yield chunk
+
+
+def remove_file(path: str) -> None:
+    """Remove a sent export; safe to call more than once."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,312 @@
+import json
+import logging
+import os
+import zipfile
+from typing import Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from metrics import count, phase
+from upload_cache import orders_fields
+from validation import (MAX_REPORTED_ERRORS, ORDERS_SCHEMA, STOCK_SCHEMA, ColumnRule, UploadValidationError,
+                        duplicate_errors, validate_frame)
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    # Optional; CSV falls back to pandas' reader and Parquet to pandas' engines
+    pa = pa_csv = pa_parquet = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Columns an upload must contain
+STOCK_REQUIRED_COLUMNS = [
+    'Location', 'Batch Number', 'Stock Weight', 'Material ID',
+    'Real Stock Age', 'Variety', 'GGN', 'Origin Country',
+    'Q3: Reinspection Quality', 'BL/AWB/CMR', 'Allocation',
+    'MinimumSize', 'Origin Pallet Number', 'Supplier'
+]
+ORDER_REQUIRED_COLUMNS = [
+    'Loading Date', 'Sales Document Item', 'Sales Document',
+    'Order', 'Sold-to Party', 'Description material', 'Quantity KG'
+]
+
+# Columns actually read into memory; the rest are only checked for presence
+STOCK_PROJECTED_COLUMNS = [col for col in STOCK_REQUIRED_COLUMNS if col != 'BL/AWB/CMR']
+ORDER_PROJECTED_COLUMNS = [
+    'Loading Date', 'Sales Document', 'Sold-to Party', 'Description material', 'Quantity KG'
+]
+
+DEFAULT_CHUNK_SIZE = 5000
+
+UPLOAD_FORMATS = ('xlsx', 'csv', 'parquet', 'json')
+# Row numbers in error reports: sheet and CSV lines count the header, JSON and Parquet records do not
+FIRST_ROWS = {'xlsx': 2, 'csv': 2, 'parquet': 1, 'json': 1}
+PARSE_PHASES = {'xlsx': 'excel_parse', 'csv': 'csv_parse', 'parquet': 'parquet_parse', 'json': 'json_parse'}
+
+
+def _check_columns(columns, required_columns: List[str], file_type: str) -> None:
+    missing_columns = [col for col in required_columns if col not in columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns in {file_type} file: {', '.join(missing_columns)}")
+
+
+def iter_excel_chunks(path: str, required_columns: List[str], projected_columns: List[str],
+                      file_type: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream the first worksheet of a workbook as DataFrame chunks.
+
+    The workbook is opened in openpyxl's read_only mode so rows are parsed lazily,
+    and only the projected columns of each row are kept. Empty rows are skipped;
+    chunks are indexed by each row's offset below the header.
+
+    Raises:
+        ValueError: If the file is not a readable workbook or lacks required columns
+    """
+    try:
+        workbook = load_workbook(path, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError, OSError) as e:
+        raise ValueError(f"Invalid Excel file format: {str(e)}")
+
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            raise ValueError(f"{file_type.capitalize()} file is empty")
+
+        # A repeated header reads its first column, as pandas does
+        positions = {}
+        for i, name in enumerate(header):
+            if name is not None:
+                positions.setdefault(str(name).strip(), i)
+        _check_columns(positions, required_columns, file_type)
+        indices = [positions[col] for col in projected_columns]
+
+        buffer, offsets = [], []
+        for offset, row in enumerate(rows):
+            values = tuple(row[i] if i < len(row) else None for i in indices)
+            if all(value is None for value in values):
+                continue
+            buffer.append(values)
+            offsets.append(offset)
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame.from_records(buffer, columns=projected_columns, index=offsets).infer_objects()
+                buffer, offsets = [], []
+        if buffer:
+            yield pd.DataFrame.from_records(buffer, columns=projected_columns, index=offsets).infer_objects()
+    finally:
+        workbook.close()
+
+
+def _iter_frame_chunks(df: pd.DataFrame, required_columns: List[str], projected_columns: List[str],
+                       file_type: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Slice an already parsed frame into projected chunks, skipping empty rows like the Excel reader."""
+    df = df.rename(columns=lambda col: str(col).strip())
+    _check_columns(df.columns, required_columns, file_type)
+    df = df[projected_columns].reset_index(drop=True).dropna(how='all')
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+
+def iter_csv_chunks(path: str, required_columns: List[str], projected_columns: List[str],
+                    file_type: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream a CSV file as DataFrame chunks of the projected columns, all read as text.
+
+    Values are left as text so identifiers keep their leading zeros; the schema
+    coerces weights, numbers and dates afterwards. Uses pyarrow's multithreaded
+    reader when it is installed.
+
+    Raises:
+        ValueError: If the file is not readable CSV or lacks required columns
+    """
+    try:
+        header = pd.read_csv(path, nrows=0)
+    except pd.errors.EmptyDataError:
+        raise ValueError(f"{file_type.capitalize()} file is empty")
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid CSV file format: {str(e)}")
+
+    names = {str(name).strip(): name for name in header.columns}
+    _check_columns(names, required_columns, file_type)
+    columns = [names[col] for col in projected_columns]
+    renamed = dict(zip(columns, projected_columns))
+
+    # Blank rows (",,,") are read as empty rows and dropped below, so they still count
+    # towards row numbers; pyarrow cannot read a wholly empty line as a row, so only
+    # pandas' reader counts those
+    if pa_csv is not None:
+        reader = pa_csv.open_csv(path, convert_options=pa_csv.ConvertOptions(
+            include_columns=columns, column_types={col: pa.string() for col in columns}, strings_can_be_null=True
+        ))
+        offset = 0
+        for batch in reader:
+            chunk = batch.to_pandas().rename(columns=renamed)
+            chunk.index += offset
+            offset += len(chunk)
+            chunk = chunk.dropna(how='all')
+            for start in range(0, len(chunk), chunk_size):
+                yield chunk.iloc[start:start + chunk_size]
+        return
+
+    # Chunks keep counting the index where the previous one stopped
+    for chunk in pd.read_csv(path, usecols=columns, dtype=str, chunksize=chunk_size, skip_blank_lines=False):
+        yield chunk.rename(columns=renamed)[projected_columns].dropna(how='all')
+
+
+def iter_parquet_chunks(path: str, required_columns: List[str], projected_columns: List[str],
+                        file_type: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream a Parquet file as DataFrame chunks of the projected columns.
+
+    Raises:
+        ValueError: If the file is not readable Parquet, lacks required columns, or no
+            Parquet engine is installed
+    """
+    if pa_parquet is None:
+        try:
+            df = pd.read_parquet(path)
+        except ImportError:
+            raise ValueError("Parquet uploads need pyarrow or fastparquet installed")
+        yield from _iter_frame_chunks(df, required_columns, projected_columns, file_type, chunk_size)
+        return
+
+    try:
+        parquet = pa_parquet.ParquetFile(path)
+    except (pa.ArrowException, OSError) as e:
+        raise ValueError(f"Invalid Parquet file format: {str(e)}")
+    names = {str(name).strip(): name for name in parquet.schema_arrow.names}
+    _check_columns(names, required_columns, file_type)
+    columns = [names[col] for col in projected_columns]
+    renamed = dict(zip(columns, projected_columns))
+    # Only the projected columns are decoded
+    offset = 0
+    for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+        chunk = batch.to_pandas().rename(columns=renamed)
+        chunk.index += offset
+        offset += len(chunk)
+        yield chunk.dropna(how='all')
+
+
+def iter_json_chunks(path: str, required_columns: List[str], projected_columns: List[str],
+                     file_type: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Read a JSON array of row objects, keyed by the sheet's column names, as DataFrame chunks.
+
+    Raises:
+        ValueError: If the file is not a JSON array of objects or lacks required columns
+    """
+    try:
+        with open(path, 'rb') as f:
+            records = json.load(f)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid JSON file format: {str(e)}")
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise ValueError(f"{file_type.capitalize()} JSON must be an array of objects")
+    if not records:
+        raise ValueError(f"{file_type.capitalize()} file is empty")
+    yield from _iter_frame_chunks(pd.DataFrame.from_records(records), required_columns, projected_columns,
+                                  file_type, chunk_size)
+
+
+CHUNK_READERS = {
+    'xlsx': iter_excel_chunks,
+    'csv': iter_csv_chunks,
+    'parquet': iter_parquet_chunks,
+    'json': iter_json_chunks,
+}
+
+
+def upload_format(path: str) -> str:
+    """Format of a stored upload, from its file extension."""
+    return os.path.splitext(path)[1].lstrip('.').lower()
+
+
+def _read_chunks(chunks: Iterator[pd.DataFrame], schema: Dict[str, ColumnRule],
+                 shape: Callable[[pd.DataFrame], pd.DataFrame], file_type: str,
+                 file_format: str = 'xlsx') -> pd.DataFrame:
+    """
+    Validate and coerce chunks as they arrive, collecting the row errors of the whole file.
+
+    Once a row error is found the remaining chunks are still checked but no longer
+    kept, so one upload reports every error.
+
+    Raises:
+        UploadValidationError: With every row error found
+    """
+    parts = []
+    unique = {column: [] for column, rule in schema.items() if rule.unique}
+    errors: List[Dict] = []
+    total = 0
+    rows = 0
+    # Chunks are indexed by each row's offset in the file, counting skipped blank rows
+    first_row = FIRST_ROWS[file_format]
+    while True:
+        with phase(PARSE_PHASES[file_format]):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        with phase('validate'):
+            coerced, chunk_errors, chunk_total = validate_frame(
+                chunk, schema, first_row, MAX_REPORTED_ERRORS - len(errors)
+            )
+        errors.extend(chunk_errors)
+        total += chunk_total
+        for column, values in unique.items():
+            values.append(coerced[column])
+        if not total:
+            with phase('normalize'):
+                parts.append(shape(coerced))
+        rows += len(chunk)
+    if not rows:
+        raise ValueError(f"{file_type.capitalize()} file is empty")
+
+    with phase('validate'):
+        for column, values in unique.items():
+            found, repeated = duplicate_errors(pd.concat(values), column, first_row,
+                                               MAX_REPORTED_ERRORS - len(errors))
+            errors.extend(found)
+            total += repeated
+    count(f"{file_type}_rows", rows)
+    if total:
+        raise UploadValidationError(file_type, sorted(errors, key=lambda e: e['row']), total)
+    return pd.concat(parts, ignore_index=True)
+
+
+def read_stock_file(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    file_format: Optional[str] = None) -> pd.DataFrame:
+    """Stream, validate and normalize a stock upload in any of UPLOAD_FORMATS."""
+    file_format = file_format or upload_format(path)
+    if file_format not in CHUNK_READERS:
+        raise ValueError(f"Unsupported stock file format: {file_format}")
+    chunks = CHUNK_READERS[file_format](path, STOCK_REQUIRED_COLUMNS, STOCK_PROJECTED_COLUMNS, 'stock', chunk_size)
+    df = _read_chunks(chunks, STOCK_SCHEMA, lambda chunk: chunk, 'stock', file_format)
+    logger.info(f"Read stock {file_format} file: {len(df)} rows")
+    return df
+
+
+def read_orders_file(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     file_format: Optional[str] = None) -> pd.DataFrame:
+    """Stream, validate and normalize an orders upload in any of UPLOAD_FORMATS into allocate_fruits order fields."""
+    file_format = file_format or upload_format(path)
+    if file_format not in CHUNK_READERS:
+        raise ValueError(f"Unsupported orders file format: {file_format}")
+    chunks = CHUNK_READERS[file_format](path, ORDER_REQUIRED_COLUMNS, ORDER_PROJECTED_COLUMNS, 'orders', chunk_size)
+    df = _read_chunks(chunks, ORDERS_SCHEMA, orders_fields, 'orders', file_format)
+    logger.info(f"Read orders {file_format} file: {len(df)} orders")
+    return df
+
+
+def read_stock_excel(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> pd.DataFrame:
+    """Stream, validate and normalize a stock workbook."""
+    return read_stock_file(path, chunk_size, 'xlsx')
+
+
+def read_orders_excel(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> pd.DataFrame:
+    """Stream, validate and normalize an orders workbook into allocate_fruits order fields."""
+    return read_orders_file(path, chunk_size, 'xlsx')
@@ -0,0 +1,193 @@
+import glob
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ('completed', 'failed')
+
+# Shortest interval between progress writes to the shared job folder
+PROGRESS_WRITE_SECONDS = 0.5
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class Job:
+    """State of one background allocation run."""
+
+    def __init__(self, total: int):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.total = total
+        self.processed = 0
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        # Held while the job changes state, so readers never see a finished status
+        # without its result and finish time
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def report_progress(self, processed: int) -> None:
+        self.processed = processed
+
+    def start(self) -> None:
+        with self._lock:
+            self.status = 'running'
+
+    def finish(self, result: Optional[Dict] = None, error: Optional[str] = None) -> None:
+        """Record the outcome, setting the status last; a job with an error has failed."""
+        with self._lock:
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self.status = 'failed' if error is not None else 'completed'
+
+    def to_dict(self, include_result: bool = True) -> Dict:
+        with self._lock:
+            return self._to_dict(include_result)
+
+    def _to_dict(self, include_result: bool) -> Dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "orders_total": self.total,
+            "orders_processed": self.processed,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error is not None:
+            data["error"] = self.error
+        if include_result and self.status == 'completed':
+            data["result"] = self.result
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Job':
+        """Rebuild a job from to_dict output, e.g. one another worker wrote."""
+        job = cls(data["orders_total"])
+        job.id = data["job_id"]
+        job.status = data["status"]
+        job.processed = data["orders_processed"]
+        job.created_at = data["created_at"]
+        job.finished_at = data["finished_at"]
+        job.error = data.get("error")
+        job.result = data.get("result")
+        return job
+
+
+class JobManager:
+    """
+    In-process job queue backed by a thread pool.
+
+    Jobs run in the worker that accepted them. With a folder, each job's state is
+    also written there as <id>.json (progress at most every PROGRESS_WRITE_SECONDS),
+    so any gunicorn worker sharing the folder can answer GET /jobs/<id>. Only the
+    most recent finished jobs are kept in memory, and job files are removed after
+    max_age seconds.
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished: int = 100, folder: Optional[str] = None,
+                 max_age: int = 3600):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='allocation-job')
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self.max_finished = max_finished
+        self.folder = folder
+        self.max_age = max_age
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def submit(self, work: Callable[[Callable[[int], None]], Dict], total: int) -> Job:
+        """
+        Queue work for the pool.
+
+        Args:
+            work: Callable receiving a progress callback and returning the job result
+            total: Number of orders the job will process
+        """
+        job = Job(total)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._save(job)
+        self._executor.submit(self._run, job, work)
+        logger.info(f"Queued allocation job {job.id} for {total} orders")
+        return job
+
+    def _run(self, job: Job, work: Callable[[Callable[[int], None]], Dict]) -> None:
+        job.start()
+        self._save(job)
+        saved_at = [time.monotonic()]
+
+        def progress(processed: int) -> None:
+            job.report_progress(processed)
+            if time.monotonic() - saved_at[0] >= PROGRESS_WRITE_SECONDS:
+                saved_at[0] = time.monotonic()
+                self._save(job)
+
+        try:
+            result = work(progress)
+        except Exception as e:
+            logger.error(f"Allocation job {job.id} failed: {str(e)}")
+            job.finish(error=str(e))
+        else:
+            job.finish(result=result)
+        self._save(job)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.folder, f"{job_id}.json")
+
+    def _save(self, job: Job) -> None:
+        """Write the job's state atomically, so readers in other workers never see part of it."""
+        if not self.folder:
+            return
+        payload = json.dumps(job.to_dict(), default=str)
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(payload)
+            os.replace(temp_path, self._path(job.id))
+        except OSError as e:
+            logger.error(f"Could not save allocation job {job.id}: {str(e)}")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _prune(self) -> None:
+        finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.finished_at)
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.id]
+        if self.folder:
+            cutoff = time.time() - self.max_age
+            for path in glob.glob(os.path.join(self.folder, '*.json')):
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return a job of this worker, or a snapshot of one another worker saved, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or not self.folder or not JOB_ID_PATTERN.match(job_id):
+            return job
+        try:
+            with open(self._path(job_id)) as f:
+                return Job.from_dict(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
@@ -0,0 +1,173 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from cache hits up to full production-sized allocations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_timing: contextvars.ContextVar = contextvars.ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    """Phase durations and item counts collected while one request is handled."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        # Phases entered repeatedly, such as one per parsed chunk, accumulate
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Render the phases and counters as a Server-Timing header value."""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        entries.extend(f'{name};desc="{value}"' for name, value in self.counters.items())
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(entries)
+
+
+def start_request() -> contextvars.Token:
+    """Begin collecting timings for the current request."""
+    return _current_timing.set(RequestTiming())
+
+
+def current_timing() -> Optional[RequestTiming]:
+    return _current_timing.get()
+
+
+def finish_request(token: contextvars.Token) -> None:
+    _current_timing.reset(token)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Time a block as a named phase of the current request.
+
+    Outside a request (tests, background jobs, scripts) this does nothing beyond a
+    context variable lookup.
+    """
+    timing = _current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add_phase(name, time.perf_counter() - start)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add to a named counter of the current request, if any."""
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.count(name, value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...]) -> str:
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in the Prometheus model."""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str],
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            label_text = _labels(self.label_names, labels)
+            prefix = f"{label_text}," if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter per label set."""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], int] = {}
+
+    def inc(self, labels: Tuple[str, ...], value: int = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-wide aggregates of request timings, rendered in the Prometheus text format.
+
+    Each gunicorn worker keeps its own registry, so a scrape reports the worker that
+    answered it. Recording a request costs a few dictionary updates under a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request latency per route.', ('method', 'route', 'status')
+        )
+        self.phase_duration = Histogram(
+            'request_phase_duration_seconds', 'Time spent in each phase of a request.', ('route', 'phase')
+        )
+        self.items = Counter('request_items_total', 'Rows, orders and batches processed.', ('route', 'item'))
+
+    def record(self, method: str, route: str, status: int, timing: RequestTiming) -> None:
+        elapsed = timing.elapsed()
+        with self._lock:
+            self.request_duration.observe((method, route, str(status)), elapsed)
+            for name, seconds in timing.phases.items():
+                self.phase_duration.observe((route, name), seconds)
+            for name, value in timing.counters.items():
+                self.items.inc((route, name), value)
+
+    def render(self) -> str:
+        with self._lock:
+            lines = (self.request_duration.render() + self.phase_duration.render() + self.items.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,456 @@
+import bisect
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from allocation_logic import AllocationResult, ValidationError, grams_to_kg, to_grams
+from encoding import CompiledRestrictions, RestrictionResolver
+from stock_pool import material_code
+from vectorized_allocation import ColumnarStock, FilledOrder, fill_order
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Wall-clock budget for improving on the greedy allocation, per run
+DEFAULT_TIME_BUDGET = float(os.getenv('OPTIMAL_TIME_BUDGET_SECONDS', 5))
+
+
+class DeadlinePassed(Exception):
+    """Raised inside a solver pass once the time budget has run out."""
+
+
+def _check(deadline: Optional[float]) -> None:
+    if deadline is not None and time.perf_counter() > deadline:
+        raise DeadlinePassed()
+
+
+class FlowNetwork:
+    """
+    Residual network for min-cost flow with integer capacities and costs.
+
+    Edges are stored in flat lists; edge e and e ^ 1 are each other's reverse.
+    """
+
+    def __init__(self, nodes: int):
+        self.nodes = nodes
+        self.adjacent: List[List[int]] = [[] for _ in range(nodes)]
+        self.to: List[int] = []
+        self.capacity: List[int] = []
+        self.cost: List[int] = []
+
+    def add_edge(self, source: int, target: int, capacity: int, cost: int, flow: int = 0) -> int:
+        edge = len(self.to)
+        self.to += [target, source]
+        self.capacity += [capacity - flow, flow]
+        self.cost += [cost, -cost]
+        self.adjacent[source].append(edge)
+        self.adjacent[target].append(edge + 1)
+        return edge
+
+    def flow(self, edge: int) -> int:
+        return self.capacity[edge ^ 1]
+
+    def push(self, edge: int, amount: int) -> None:
+        self.capacity[edge] -= amount
+        self.capacity[edge ^ 1] += amount
+
+    def _push_path(self, edges: List[int]) -> int:
+        amount = min(self.capacity[edge] for edge in edges)
+        for edge in edges:
+            self.push(edge, amount)
+        return amount
+
+    def cancel_negative_cycle(self, deadline: Optional[float] = None) -> bool:
+        """
+        Find one negative-cost cycle in the residual network and saturate it (Bellman-Ford).
+
+        Raises:
+            DeadlinePassed: If the deadline passes between relaxation rounds
+        """
+        distance = [0] * self.nodes
+        parent = [-1] * self.nodes
+        updated = -1
+        for _ in range(self.nodes):
+            _check(deadline)
+            updated = -1
+            for node in range(self.nodes):
+                base = distance[node]
+                for edge in self.adjacent[node]:
+                    if self.capacity[edge] > 0:
+                        target = self.to[edge]
+                        if base + self.cost[edge] < distance[target]:
+                            distance[target] = base + self.cost[edge]
+                            parent[target] = edge
+                            updated = target
+            if updated < 0:
+                return False
+
+        # Walking back n steps from a node relaxed in round n lands on the cycle
+        node = updated
+        for _ in range(self.nodes):
+            node = self.to[parent[node] ^ 1]
+        cycle = []
+        current = node
+        while True:
+            edge = parent[current]
+            cycle.append(edge)
+            current = self.to[edge ^ 1]
+            if current == node:
+                break
+        self._push_path(cycle)
+        return True
+
+    def augment_shortest_path(self, source: int, sink: int, deadline: Optional[float] = None) -> int:
+        """
+        Push flow along a cheapest residual source-sink path (SPFA); returns the amount.
+
+        Raises:
+            DeadlinePassed: If the deadline passes during the search
+        """
+        distance = [None] * self.nodes
+        parent = [-1] * self.nodes
+        queued = [False] * self.nodes
+        distance[source] = 0
+        queue = deque([source])
+        visits = 0
+        while queue:
+            visits += 1
+            if visits % self.nodes == 0:
+                _check(deadline)
+            node = queue.popleft()
+            queued[node] = False
+            base = distance[node]
+            for edge in self.adjacent[node]:
+                if self.capacity[edge] > 0:
+                    target = self.to[edge]
+                    if distance[target] is None or base + self.cost[edge] < distance[target]:
+                        distance[target] = base + self.cost[edge]
+                        parent[target] = edge
+                        if not queued[target]:
+                            queued[target] = True
+                            queue.append(target)
+        if distance[sink] is None:
+            return 0
+        path = []
+        node = sink
+        while node != source:
+            path.append(parent[node])
+            node = self.to[parent[node] ^ 1]
+        return self._push_path(path)
+
+
+def summarize(results: List[Tuple[str, Dict]]) -> Dict:
+    """Totals used to compare two allocations of the same orders."""
+    allocated = sum(result['weight'] for _, result in results)
+    weighted_age = sum(line['weight'] * line['age'] for _, result in results for line in result['batches'])
+    return {
+        "allocated_kg": round(allocated, 3),
+        "fully_allocated_orders": sum(result['status'] == 'fully_allocated' for _, result in results),
+        "batch_lines": sum(len(result['batches']) for _, result in results),
+        "average_age": round(weighted_age / allocated, 3) if allocated else 0,
+    }
+
+
+class MaterialProblem:
+    """
+    Transportation problem for one material.
+
+    Batches that are eligible for the same restriction groups and share an age are
+    interchangeable, as are orders with the same restrictions, so both sides are
+    aggregated before solving: supply classes of (eligible groups, age) and demand
+    groups of restriction sets. Costs are stock age per gram, as in FIFO.
+    """
+
+    def __init__(self, stock: ColumnarStock, initial: np.ndarray, groups: List[CompiledRestrictions],
+                 material: str, demands: List[int]):
+        signature: Dict[int, int] = {}
+        for index, restrictions in enumerate(groups):
+            _, rows = stock.candidates(material, restrictions)
+            for row in rows.tolist():
+                signature[row] = signature.get(row, 0) | (1 << index)
+
+        classes: Dict[Tuple[int, int], List[int]] = {}
+        for row in sorted(signature, key=stock.fifo_key):
+            if initial[row] > 0:
+                classes.setdefault((signature[row], int(stock.age[row])), []).append(row)
+        self.class_keys = list(classes)
+        self.class_rows = [classes[key] for key in self.class_keys]
+        self.row_class = {row: index for index, rows in enumerate(self.class_rows) for row in rows}
+
+        # Nodes: source, supply classes, demand groups, sink
+        self.source = 0
+        self.sink = 1 + len(self.class_keys) + len(groups)
+        self.network = FlowNetwork(self.sink + 1)
+        self.supply_edges = []
+        self.link_edges: Dict[Tuple[int, int], int] = {}
+        self.demand_edges = []
+        self._class_supply = [int(initial[rows].sum()) for rows in self.class_rows]
+        self._demands = demands
+
+    def _group_node(self, group: int) -> int:
+        return 1 + len(self.class_keys) + group
+
+    def build(self, greedy_flow: Dict[Tuple[int, int], int]) -> None:
+        """Create the edges, starting from the flow of the greedy allocation."""
+        class_out = [0] * len(self.class_keys)
+        group_in = [0] * len(self._demands)
+        for (class_index, group), amount in greedy_flow.items():
+            class_out[class_index] += amount
+            group_in[group] += amount
+
+        for class_index, (signature, age) in enumerate(self.class_keys):
+            supply = self._class_supply[class_index]
+            self.supply_edges.append(
+                self.network.add_edge(self.source, 1 + class_index, supply, 0, class_out[class_index])
+            )
+            for group in range(len(self._demands)):
+                if signature & (1 << group):
+                    capacity = min(supply, self._demands[group])
+                    self.link_edges[(class_index, group)] = self.network.add_edge(
+                        1 + class_index, self._group_node(group), capacity, age,
+                        greedy_flow.get((class_index, group), 0)
+                    )
+        for group, demand in enumerate(self._demands):
+            self.demand_edges.append(
+                self.network.add_edge(self._group_node(group), self.sink, demand, 0, group_in[group])
+            )
+
+    def solve(self, deadline: float) -> bool:
+        """
+        Improve the warm-start flow until it is optimal or the deadline passes.
+
+        Negative cycles are cancelled first, making the flow the cheapest for its
+        amount; shortest augmenting paths then raise the amount while keeping that
+        property. Each pass stops as soon as the deadline passes, leaving the flow of
+        the last completed pass. Returns whether optimality was reached.
+        """
+        try:
+            while self.network.cancel_negative_cycle(deadline):
+                pass
+            while self.network.augment_shortest_path(self.source, self.sink, deadline):
+                pass
+        except DeadlinePassed:
+            return False
+        return True
+
+    def value_and_cost(self, flows: Dict[Tuple[int, int], int]) -> Tuple[int, int]:
+        """Grams allocated and their total age cost for class-to-group flows."""
+        value = sum(flows.values())
+        cost = sum(amount * self.class_keys[class_index][1] for (class_index, _), amount in flows.items())
+        return value, cost
+
+    def group_flows(self) -> Dict[Tuple[int, int], int]:
+        flows = {}
+        for key, edge in self.link_edges.items():
+            amount = self.network.flow(edge)
+            if amount > 0:
+                flows[key] = amount
+        return flows
+
+
+def _draw(available: List[Tuple[int, int]], amount: int) -> List[Tuple[int, int]]:
+    """
+    Take grams from interchangeable batches, fewest pieces first.
+
+    The smallest batch that covers the amount is used whole or in part; otherwise
+    the largest batch is emptied and the rest taken the same way.
+    """
+    draws = []
+    while amount > 0 and available:
+        index = bisect.bisect_left(available, (amount, -1))
+        if index == len(available):
+            index -= 1
+        weight, row = available.pop(index)
+        taken = min(weight, amount)
+        draws.append((row, taken))
+        amount -= taken
+        if weight > taken:
+            bisect.insort(available, (weight - taken, row))
+    return draws
+
+
+def optimize_allocation(stock_df: pd.DataFrame, orders: List[Dict], restrictions: Dict,
+                        customer_restrictions: Optional[Dict[str, Dict]] = None,
+                        time_budget: float = DEFAULT_TIME_BUDGET) -> Tuple[List[Tuple[str, Dict]], Dict]:
+    """
+    Allocate with a min-cost-flow model; see optimize_positioned.
+
+    Returns:
+        Tuple: (sales document, result) per order in sequence, and a report comparing
+        the greedy and optimized allocations
+    """
+    positioned, report = optimize_positioned(stock_df, orders, restrictions, customer_restrictions, time_budget)
+    return [(sales_doc, result) for _, sales_doc, result in positioned], report
+
+
+def optimize_positioned(stock_df: pd.DataFrame, orders: List[Dict], restrictions: Dict,
+                        customer_restrictions: Optional[Dict[str, Dict]] = None,
+                        time_budget: float = DEFAULT_TIME_BUDGET) -> Tuple[List[Tuple[int, str, Dict]], Dict]:
+    """
+    Allocate with a min-cost-flow model, warm-started from the greedy FIFO result.
+
+    Per material, the allocated weight is maximized first and the stock age of what
+    is allocated minimized second; eligibility follows the restrictions as in the
+    greedy engines. Within a restriction group, orders are served in sequence.
+    A material's greedy draws are only replaced when the model allocates more
+    weight, or the same weight from younger stock without more batch lines. When
+    the time budget runs out the solver keeps its best flow so far and materials
+    not yet reached keep their greedy draws.
+
+    Returns:
+        Tuple: (order position, sales document, result) per order in sequence, skipping
+        invalid orders, and a report comparing the greedy and optimized allocations
+
+    Raises:
+        ValidationError: If input data is invalid
+    """
+    started = time.perf_counter()
+    deadline = started + time_budget
+    try:
+        if stock_df.empty:
+            raise ValidationError("Stock data is empty")
+        if not orders:
+            raise ValidationError("No orders provided")
+
+        stock = ColumnarStock(stock_df)
+        initial = stock.weight.copy()
+        resolver = RestrictionResolver(stock.encoding, restrictions, customer_restrictions)
+        greedy: List[Optional[FilledOrder]] = [fill_order(stock, resolver, order) for order in orders]
+        greedy_results = [(filled.sales_document, filled.result) for filled in greedy if filled is not None]
+
+        # Orders that take part in the optimization, grouped by material and restrictions
+        materials: Dict[str, Dict] = {}
+        for position, (order, filled) in enumerate(zip(orders, greedy)):
+            if filled is None or filled.result['status'] == 'error':
+                continue
+            material = material_code(str(order.get('description_material', '')))
+            restrictions_for_order = resolver.for_customer(str(order.get('sold_to_party', '')))
+            problem = materials.setdefault(material, {"groups": [], "keys": {}, "orders": []})
+            group = problem["keys"].get(restrictions_for_order.key)
+            if group is None:
+                group = problem["keys"][restrictions_for_order.key] = len(problem["groups"])
+                problem["groups"].append(restrictions_for_order)
+            problem["orders"].append((position, group, to_grams(order.get('quantity', 0))))
+
+        optimal = True
+        draws: Dict[int, List[Tuple[int, int]]] = {}
+        for material, problem in materials.items():
+            greedy_draws = {
+                position: list(zip(greedy[position].rows.tolist(), greedy[position].fills.tolist()))
+                for position, _, _ in problem["orders"]
+            }
+            # Greedy draws stand unless the model finds something better; once the
+            # budget is spent the remaining materials are not modelled at all
+            draws.update(greedy_draws)
+            if time.perf_counter() > deadline:
+                optimal = False
+                continue
+
+            demands = [0] * len(problem["groups"])
+            for _, group, required in problem["orders"]:
+                demands[group] += required
+            model = MaterialProblem(stock, initial, problem["groups"], material, demands)
+
+            greedy_flow: Dict[Tuple[int, int], int] = {}
+            for position, group, _ in problem["orders"]:
+                for row, grams in greedy_draws[position]:
+                    key = (model.row_class[row], group)
+                    greedy_flow[key] = greedy_flow.get(key, 0) + grams
+            model.build(greedy_flow)
+            optimal = model.solve(deadline) and optimal
+
+            greedy_value, greedy_cost = model.value_and_cost(greedy_flow)
+            value, cost = model.value_and_cost(model.group_flows())
+            if value < greedy_value or (value == greedy_value and cost >= greedy_cost):
+                continue
+            candidate = _disaggregate(model, problem["orders"], initial)
+            if value == greedy_value and _lines(candidate) > _lines(greedy_draws):
+                # Younger stock for the same weight is not worth more split batches
+                continue
+            draws.update(candidate)
+
+        positioned = []
+        for position, filled in enumerate(greedy):
+            if filled is None:
+                continue
+            if filled.result['status'] == 'error':
+                positioned.append((position, filled.sales_document, filled.result))
+                continue
+            required = to_grams(orders[position].get('quantity', 0))
+            positioned.append((position, filled.sales_document, _result(stock, draws.get(position, []), required)))
+        results = [(sales_doc, result) for _, sales_doc, result in positioned]
+
+        report = {
+            "status": "optimal" if optimal else "time_budget_exceeded",
+            "seconds": round(time.perf_counter() - started, 3),
+            "greedy": summarize(greedy_results),
+            "optimized": summarize(results),
+        }
+        report["improvement"] = {
+            key: round(report["optimized"][key] - report["greedy"][key], 3)
+            for key in ("allocated_kg", "fully_allocated_orders", "batch_lines")
+        }
+        logger.info(f"Optimized allocation for {len(orders)} orders: {report['status']}, "
+                    f"{report['improvement']['allocated_kg']} kg more than greedy")
+        return positioned, report
+
+    except Exception as e:
+        logger.error(f"Error in optimized allocation process: {str(e)}")
+        raise ValidationError(f"Allocation failed: {str(e)}")
+
+
+def _lines(draws: Dict[int, List[Tuple[int, int]]]) -> int:
+    return sum(len(taken) for taken in draws.values())
+
+
+def _disaggregate(model: MaterialProblem, orders: List[Tuple[int, int, int]],
+                  initial: np.ndarray) -> Dict[int, List[Tuple[int, int]]]:
+    """Turn class-to-group flows back into batch draws per order position."""
+    flows = model.group_flows()
+    group_total: Dict[int, int] = {}
+    for (_, group), amount in flows.items():
+        group_total[group] = group_total.get(group, 0) + amount
+    # Youngest classes first, as FIFO would draw them
+    group_classes: Dict[int, List[int]] = {}
+    for class_index, group in sorted(flows, key=lambda key: (model.class_keys[key[0]][1], key[0])):
+        group_classes.setdefault(group, []).append(class_index)
+
+    available = [sorted((int(initial[row]), row) for row in rows) for rows in model.class_rows]
+    draws: Dict[int, List[Tuple[int, int]]] = {}
+    for position, group, required in orders:
+        need = min(required, group_total.get(group, 0))
+        group_total[group] = group_total.get(group, 0) - need
+        taken = []
+        for class_index in group_classes.get(group, []):
+            if need <= 0:
+                break
+            amount = min(need, flows[(class_index, group)])
+            if amount <= 0:
+                continue
+            flows[(class_index, group)] -= amount
+            need -= amount
+            taken.extend(_draw(available[class_index], amount))
+        draws[position] = taken
+    return draws
+
+
+def _result(stock: ColumnarStock, draws: List[Tuple[int, int]], required: int) -> Dict:
+    allocated = sum(grams for _, grams in draws)
+    if allocated <= 0:
+        return AllocationResult(status="unfulfilled", weight=0, batches=[])._asdict()
+    batches = [{
+        "batch": stock.batch_number[row],
+        "weight": grams_to_kg(grams),
+        "age": int(stock.age[row]),
+        "location": stock.location[row],
+        "supplier": stock.attribute('supplier', row),
+        "quality": stock.attribute('quality', row),
+        "origin": stock.attribute('origin', row)
+    } for row, grams in sorted(draws, key=lambda draw: stock.fifo_key(draw[0]))]
+    status = "fully_allocated" if allocated >= required else "partially_allocated"
+    return AllocationResult(status=status, weight=grams_to_kg(allocated), batches=batches)._asdict()
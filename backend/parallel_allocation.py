@@ -0,0 +1,166 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from allocation_logic import ValidationError, allocate_fruits, iter_allocations
+from stock_pool import material_code
+from vectorized_allocation import parse_weight_grams
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Workers are started by a fork server, a clean single-threaded process, because
+# forking a request or job thread would copy locks other threads hold into the child
+START_METHODS = ('forkserver', 'spawn')
+
+# One executor per process, reused by every parallel run, with the pid and size it was made for
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_key: Optional[Tuple[int, int]] = None
+_executor_lock = threading.Lock()
+
+
+def partition_orders(orders: List[Dict], partitions: int) -> List[List[int]]:
+    """
+    Group order positions by material and spread the materials over partitions.
+
+    Orders for different materials never draw from the same batches, so each
+    partition can be allocated on its own. Materials are placed largest first on
+    the partition with the fewest orders; positions stay in order within each.
+    """
+    by_material: Dict[str, List[int]] = {}
+    for position, order in enumerate(orders):
+        material = material_code(str(order.get('description_material', '')))
+        by_material.setdefault(material, []).append(position)
+
+    groups: List[List[int]] = [[] for _ in range(min(partitions, len(by_material)))]
+    for material in sorted(by_material, key=lambda m: (-len(by_material[m]), m)):
+        smallest = min(range(len(groups)), key=lambda i: (len(groups[i]), i))
+        groups[smallest].extend(by_material[material])
+    return [sorted(group) for group in groups if group]
+
+
+def _start_method() -> str:
+    available = multiprocessing.get_all_start_methods()
+    return next(method for method in START_METHODS if method in available)
+
+
+def get_executor(workers: int) -> ProcessPoolExecutor:
+    """
+    Return this process's worker pool, starting it on first use.
+
+    The pool is kept for later runs. It is replaced when a different size is asked
+    for, or in a process forked from the one that started it, which cannot use its
+    parent's workers; a pool that broke is dropped by the run that saw it break.
+    """
+    global _executor, _executor_key
+    key = (os.getpid(), workers)
+    with _executor_lock:
+        if _executor is not None and _executor_key != key:
+            if _executor_key[0] == key[0]:
+                _executor.shutdown(wait=False)
+            _executor = None
+        if _executor is None:
+            context = multiprocessing.get_context(_start_method())
+            if context.get_start_method() == 'forkserver':
+                # Workers fork from a server that already imported the engines
+                context.set_forkserver_preload(['parallel_allocation'])
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _executor_key = key
+            logger.info(f"Started {workers} allocation worker processes ({context.get_start_method()})")
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor) -> None:
+    global _executor, _executor_key
+    with _executor_lock:
+        if _executor is executor:
+            _executor = _executor_key = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _allocate_partition(stock_df: pd.DataFrame, orders: List[Dict], positions: List[int], restrictions: Dict,
+                        engine: str, customer_restrictions: Optional[Dict[str, Dict]]) -> List[Tuple[int, str, Dict]]:
+    """Allocate one partition in a worker, returning (order position, sales document, result)."""
+    # The engines report each order's position through progress just before yielding
+    # its result, which maps results back to positions even when orders are skipped
+    current = [0]
+    results = []
+    for sales_doc, result in iter_allocations(stock_df, orders, restrictions, engine,
+                                              progress=lambda index: current.__setitem__(0, index),
+                                              customer_restrictions=customer_restrictions):
+        results.append((positions[current[0]], sales_doc, result))
+    return results
+
+
+def _partition_stock(stock_df: pd.DataFrame, orders: List[Dict]) -> pd.DataFrame:
+    """Stock rows of the materials a partition's orders ask for."""
+    materials = {material_code(str(order.get('description_material', ''))) for order in orders}
+    stock = stock_df[stock_df['Material ID'].astype(str).isin(materials)]
+    if stock.empty:
+        # Nothing to draw from; allocate against one row no order can match, since
+        # material codes never contain whitespace
+        stock = stock_df.iloc[:1].assign(**{'Material ID': ' '})
+    return stock
+
+
+def allocate_parallel(stock_df: pd.DataFrame, orders: List[Dict], restrictions: Dict, engine: str = 'pool',
+                      workers: int = 2, progress: Optional[Callable[[int], None]] = None,
+                      customer_restrictions: Optional[Dict[str, Dict]] = None) -> Dict:
+    """
+    Allocate independent material partitions in worker processes.
+
+    The workers belong to a pool started once per process (see get_executor). Each
+    partition is sent with only the stock rows of its materials, so the stock is
+    pickled about once per run. Results are merged in order position, so the
+    outcome is identical to allocate_fruits, including which result wins for a
+    repeated sales document. Runs serially when there is only one partition.
+
+    Raises:
+        ValidationError: If input data is invalid
+    """
+    if stock_df.empty:
+        raise ValidationError("Allocation failed: Stock data is empty")
+    if not orders:
+        raise ValidationError("Allocation failed: No orders provided")
+
+    partitions = partition_orders(orders, workers) if workers > 1 else []
+    if len(partitions) < 2:
+        return allocate_fruits(stock_df, orders, restrictions, engine, progress, customer_restrictions)
+
+    # Stock rows of materials nobody ordered are never read by a worker, but a bad
+    # weight anywhere still fails the run as it does serially
+    try:
+        parse_weight_grams(stock_df['Stock Weight'])
+    except (KeyError, ValidationError) as e:
+        raise ValidationError(f"Allocation failed: {str(e)}")
+
+    executor = get_executor(workers)
+    futures = {}
+    for positions in partitions:
+        partition = [orders[position] for position in positions]
+        future = executor.submit(_allocate_partition, _partition_stock(stock_df, partition), partition, positions,
+                                 restrictions, engine, customer_restrictions)
+        futures[future] = positions
+
+    merged = []
+    processed = 0
+    try:
+        for future in as_completed(futures):
+            merged.extend(future.result())
+            processed += len(futures[future])
+            if progress is not None:
+                progress(processed)
+    except BrokenProcessPool:
+        # A worker died; the next run starts a fresh pool
+        _discard_executor(executor)
+        raise
+
+    merged.sort(key=lambda item: item[0])
+    logger.info(f"Parallel allocation completed for {len(orders)} orders in {len(partitions)} partitions")
+    return {sales_doc: result for _, sales_doc, result in merged}
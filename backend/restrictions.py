@@ -1,13 +1,29 @@
 from flask_sqlalchemy import SQLAlchemy
-from typing import Dict, Optional, List
+from typing import Dict, Iterable, Optional, List, Tuple
 import logging
 from datetime import datetime
 import json
+import threading
+from collections import OrderedDict
 from database import db
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Keeps IN lists under SQLite's bound-parameter limit
+IN_QUERY_CHUNK_SIZE = 500
+
+# Upper bound on customers kept in the in-process restriction cache
+RESTRICTION_CACHE_SIZE = 1024
+
+DEFAULT_RESTRICTIONS = {
+    "quality": ["Good Q/S", "Fair M/C"],
+    "origin": ["Chile"],
+    "variety": ["LEGACY"],
+    "ggn": None,
+    "supplier": []
+}
+
 class ValidationError(Exception):
     """Custom exception for validation errors."""
     pass
@@ -89,6 +105,89 @@ class Restriction(db.Model):
             logger.error(f"Error creating restriction from dict: {str(e)}")
             raise
 
+class RestrictionVersion(db.Model):
+    """Single-row counter bumped on every restriction change, shared by all workers."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def current_restrictions_version() -> int:
+    # A column query always reaches the database, unlike the session identity map
+    version = db.session.query(RestrictionVersion.version).filter_by(id=1).scalar()
+    return version or 0
+
+def bump_restrictions_version() -> None:
+    """Increment the version atomically inside the caller's transaction."""
+    updated = RestrictionVersion.query.filter_by(id=1).update(
+        {RestrictionVersion.version: RestrictionVersion.version + 1}
+    )
+    if not updated:
+        db.session.add(RestrictionVersion(id=1, version=1))
+
+class RestrictionCache:
+    """
+    Bounded LRU of parsed restrictions per customer ID.
+
+    Each read first compares the cached version with the shared version row, a
+    single primary-key lookup, and drops everything when another worker has
+    changed restrictions. Missing customers are cached as None.
+    """
+
+    def __init__(self, max_size: int = RESTRICTION_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[str, Optional[Dict]]' = OrderedDict()
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def sync(self) -> None:
+        """Invalidate the cache if the shared version moved since the last read."""
+        version = current_restrictions_version()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+
+    def lookup(self, customer_ids: Iterable[str]) -> Tuple[Dict[str, Optional[Dict]], List[str]]:
+        """Split customer IDs into cached entries and misses."""
+        hits, misses = {}, []
+        with self._lock:
+            for customer_id in customer_ids:
+                if customer_id in self._entries:
+                    self._entries.move_to_end(customer_id)
+                    hits[customer_id] = self._entries[customer_id]
+                else:
+                    misses.append(customer_id)
+        return hits, misses
+
+    def store(self, customer_id: str, restrictions: Optional[Dict]) -> None:
+        with self._lock:
+            self._entries[customer_id] = restrictions
+            self._entries.move_to_end(customer_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+restriction_cache = RestrictionCache()
+
+def load_restrictions(customer_ids: Iterable[str]) -> Dict[str, Optional[Dict]]:
+    """
+    Parsed restrictions for the given customer IDs, served from the cache where possible.
+
+    Misses are loaded with one IN query per chunk; customers without a row map to None.
+    """
+    restriction_cache.sync()
+    found, misses = restriction_cache.lookup(customer_ids)
+    for start in range(0, len(misses), IN_QUERY_CHUNK_SIZE):
+        chunk = misses[start:start + IN_QUERY_CHUNK_SIZE]
+        rows = {r.customer_id: r.to_dict() for r in Restriction.query.filter(Restriction.customer_id.in_(chunk)).all()}
+        for customer_id in chunk:
+            found[customer_id] = rows.get(customer_id)
+            restriction_cache.store(customer_id, found[customer_id])
+    return found
+
 def get_restrictions(customer_id: str = "default") -> Dict:
     """
     Retrieve restrictions for a customer from SQLite with proper error handling.
@@ -106,24 +205,72 @@ def get_restrictions(customer_id: str = "default") -> Dict:
         if not customer_id or not isinstance(customer_id, str):
             raise ValidationError("Invalid customer ID")
 
-        restriction = Restriction.query.filter_by(customer_id=customer_id).first()
+        restriction = load_restrictions([customer_id])[customer_id]
         
         if not restriction:
             logger.warning(f"No restrictions found for customer {customer_id}, using defaults")
-            return {
-                "quality": ["Good Q/S", "Fair M/C"],
-                "origin": ["Chile"],
-                "variety": ["LEGACY"],
-                "ggn": None,
-                "supplier": []
-            }
+            return dict(DEFAULT_RESTRICTIONS)
 
-        return restriction.to_dict()
+        return dict(restriction)
 
     except Exception as e:
         logger.error(f"Error retrieving restrictions for customer {customer_id}: {str(e)}")
         raise
 
+def customer_keys(sold_to_party: str) -> List[str]:
+    """
+    Candidate Restriction.customer_id values for an order's Sold-to Party.
+
+    Values such as "10054809 (SOFRUCE)" match either the full string or the
+    customer number in front of the name.
+    """
+    keys = [sold_to_party]
+    parts = sold_to_party.split()
+    if parts and parts[0] != sold_to_party:
+        keys.append(parts[0])
+    return keys
+
+def get_restrictions_for_customers(sold_to_parties: Iterable[str]) -> Tuple[Dict, Dict[str, Dict]]:
+    """
+    Resolve restrictions for many customers with a single IN query.
+
+    Args:
+        sold_to_parties (Iterable[str]): Distinct Sold-to Party values of an order book
+
+    Returns:
+        Tuple[Dict, Dict[str, Dict]]: The default restrictions, and restrictions for every
+        Sold-to Party that has its own row, each parsed once
+
+    Raises:
+        ValidationError: If a customer ID is invalid
+    """
+    try:
+        parties = sorted({str(p) for p in sold_to_parties if p})
+        wanted = {"default"}
+        for party in parties:
+            wanted.update(key for key in customer_keys(party) if len(key) <= 50)
+
+        rows = {key: value for key, value in load_restrictions(sorted(wanted)).items() if value is not None}
+
+        default = rows.get("default")
+        if default is None:
+            logger.warning("No restrictions found for customer default, using defaults")
+            default = dict(DEFAULT_RESTRICTIONS)
+
+        resolved = {}
+        for party in parties:
+            for key in customer_keys(party):
+                if key in rows and key != "default":
+                    resolved[party] = rows[key]
+                    break
+
+        logger.info(f"Resolved restrictions for {len(resolved)} of {len(parties)} customers")
+        return default, resolved
+
+    except Exception as e:
+        logger.error(f"Error retrieving restrictions in bulk: {str(e)}")
+        raise
+
 def set_restrictions(customer_id: str, restrictions: Dict) -> Dict:
     """
     Store or update restrictions for a customer in SQLite with validation.
@@ -172,7 +319,9 @@ def set_restrictions(customer_id: str, restrictions: Dict) -> Dict:
                 })
 
             db.session.add(restriction)
+            bump_restrictions_version()
             db.session.commit()
+            restriction_cache.clear()
 
             logger.info(f"Successfully updated restrictions for customer {customer_id}")
             return restriction.to_dict()
@@ -206,7 +355,9 @@ def delete_restrictions(customer_id: str) -> bool:
         restriction = Restriction.query.filter_by(customer_id=customer_id).first()
         if restriction:
             db.session.delete(restriction)
+            bump_restrictions_version()
             db.session.commit()
+            restriction_cache.clear()
             logger.info(f"Successfully deleted restrictions for customer {customer_id}")
             return True
         
@@ -0,0 +1,142 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def result_key(**parts) -> str:
+    """
+    SHA-256 hex digest of everything an allocation result depends on.
+
+    Args:
+        **parts: JSON-serializable values, e.g. upload hashes, the restrictions
+            version and the engine options
+
+    Returns:
+        str: The cache key, also used as the response's ETag
+    """
+    encoded = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Serialized allocation responses keyed by result_key.
+
+    Entries are kept in an in-memory LRU bounded by total size. With a folder the
+    cache is also written through to disk as <key>.json, so every worker sharing
+    the folder can serve a result another one computed; the folder is trimmed to
+    its own size limit, least recently used first.
+    """
+
+    def __init__(self, max_bytes: int, folder: Optional[str] = None, max_disk_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.json")
+
+    def _remember(self, key: str, payload: bytes) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = payload
+            self._size += len(payload)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the stored response for a key from memory or disk, or None."""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                return payload
+        if not self.folder:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            # Marks the file as recently used for trimming
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        self._remember(key, payload)
+        return payload
+
+    def put(self, key: str, payload: bytes) -> None:
+        """Store a response; on disk it is written atomically so readers never see part of it."""
+        self._remember(key, payload)
+        if not self.folder:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(temp_path, self._path(key))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.trim()
+
+    def trim(self) -> int:
+        """
+        Remove the least recently used files until the folder is under its size limit.
+
+        Returns:
+            int: Number of files removed
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.folder, '*.json')):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum(entry[1] for entry in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        if removed:
+            logger.info(f"Trimmed {removed} cached allocation results")
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        if self.folder:
+            for path in glob.glob(os.path.join(self.folder, '*.json')):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,89 @@
+import heapq
+import logging
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from allocation_logic import ValidationError
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SCHEDULE_PRIORITIES = ('loading_date', 'sheet')
+
+
+def _quantity(order: Dict) -> float:
+    try:
+        return float(order.get('quantity') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# Ordering among orders loading on the same day; sheet order breaks any remaining tie
+TIE_BREAKS: Dict[str, Callable[[Dict], Tuple]] = {
+    'sheet': lambda order: (),
+    'largest_first': lambda order: (-_quantity(order),),
+    'smallest_first': lambda order: (_quantity(order),),
+    'sales_document': lambda order: (str(order.get('sales_document', '')),),
+}
+
+
+def parse_loading_date(value) -> Optional[date]:
+    """Loading dates arrive as 'YYYY-MM-DD' strings from the orders snapshot, or None."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def schedule_orders(orders: List[Dict], priority: str = 'loading_date', tie_break: str = 'sheet',
+                    horizon_days: Optional[int] = None, today: Optional[date] = None) -> List[Dict]:
+    """
+    Put orders in the sequence they are allocated in.
+
+    With the loading_date priority, orders come off a priority queue by loading date,
+    earliest first, then by the tie-break, then by sheet position; orders without a
+    loading date go last. With a horizon, only orders loading within that many days
+    of today are kept (overdue ones included), so later orders never enter the run.
+
+    Args:
+        orders (List[Dict]): Orders in sheet order
+        priority (str): 'loading_date' or 'sheet' to keep the sheet order
+        tie_break (str): One of TIE_BREAKS, for orders loading on the same day
+        horizon_days (int, optional): Days ahead of today to allocate
+        today (date, optional): Reference date for the horizon, defaults to the current date
+
+    Returns:
+        List[Dict]: The orders to allocate, in allocation order
+
+    Raises:
+        ValidationError: If an option is unknown or out of range
+    """
+    if priority not in SCHEDULE_PRIORITIES:
+        raise ValidationError(f"Unknown order priority: {priority}")
+    if tie_break not in TIE_BREAKS:
+        raise ValidationError(f"Unknown tie-break: {tie_break}")
+    if horizon_days is not None and horizon_days < 0:
+        raise ValidationError(f"Horizon cannot be negative: {horizon_days}")
+
+    cutoff = (today or date.today()) + timedelta(days=horizon_days) if horizon_days is not None else None
+    tie_key = TIE_BREAKS[tie_break]
+    queue = []
+    for position, order in enumerate(orders):
+        loading_date = parse_loading_date(order.get('loading_date'))
+        if cutoff is not None and (loading_date is None or loading_date > cutoff):
+            continue
+        if priority == 'sheet':
+            key = (position,)
+        else:
+            key = (loading_date is None, loading_date or date.min) + tie_key(order) + (position,)
+        queue.append((key, position))
+
+    heapq.heapify(queue)
+    scheduled = [orders[heapq.heappop(queue)[1]] for _ in range(len(queue))]
+    if cutoff is not None:
+        logger.info(f"Scheduled {len(scheduled)} of {len(orders)} orders loading by {cutoff.isoformat()}")
+    return scheduled
@@ -0,0 +1,351 @@
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from allocation_logic import ValidationError, grams_to_kg
+from database import db
+from encoding import ATTRIBUTE_FIELDS, LIST_RESTRICTIONS
+from ingestion import STOCK_PROJECTED_COLUMNS
+from restrictions import IN_QUERY_CHUNK_SIZE
+from stock_pool import material_code
+from vectorized_allocation import parse_weight_grams
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Rows handed to one executemany call while loading the ledger
+LEDGER_INSERT_CHUNK_SIZE = 5000
+
+STOCK_LOAD_MODES = ('full', 'delta')
+
+
+class StockRecord(db.Model):
+    """One batch of the current stock sheet, kept in the database between uploads."""
+    __tablename__ = 'stock_batch'
+    __table_args__ = (
+        # Candidate queries select a material and read it in FIFO order
+        db.Index('ix_stock_batch_material_age', 'material_id', 'age', 'position'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    position = db.Column(db.Integer, nullable=False)  # Row in the stock sheet, which breaks age ties
+    location = db.Column(db.String(100))
+    batch_number = db.Column(db.String(50), nullable=False, index=True)
+    weight_grams = db.Column(db.BigInteger, nullable=False)
+    material_id = db.Column(db.String(50), nullable=False)
+    age = db.Column(db.Integer, nullable=False)
+    variety = db.Column(db.String(100), index=True)
+    ggn = db.Column(db.String(50), index=True)
+    origin = db.Column(db.String(100), index=True)
+    quality = db.Column(db.String(100), index=True)
+    allocation = db.Column(db.String(100))
+    minimum_size = db.Column(db.String(20), index=True)
+    origin_pallet_number = db.Column(db.String(50))
+    supplier = db.Column(db.String(200), index=True)
+    row_hash = db.Column(db.BigInteger, nullable=False)  # Hash of the sheet row, compared by delta loads
+
+
+class StockLoad(db.Model):
+    """A load of the stock ledger from an upload and the changes it made."""
+    __tablename__ = 'stock_load'
+
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.String(64), nullable=False)
+    mode = db.Column(db.String(10), nullable=False)
+    inserted = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.Integer, nullable=False, default=0)
+    deleted = db.Column(db.Integer, nullable=False, default=0)
+    unchanged = db.Column(db.Integer, nullable=False, default=0)
+    loaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self) -> Dict:
+        return {
+            "upload_id": self.upload_id,
+            "mode": self.mode,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "deleted": self.deleted,
+            "unchanged": self.unchanged,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None
+        }
+
+
+# Stock sheet column held by each text attribute of StockRecord; restriction fields
+# share their attribute names
+RECORD_COLUMNS = {
+    'location': 'Location',
+    'batch_number': 'Batch Number',
+    'material_id': 'Material ID',
+    'variety': 'Variety',
+    'ggn': 'GGN',
+    'origin': 'Origin Country',
+    'quality': 'Q3: Reinspection Quality',
+    'allocation': 'Allocation',
+    'minimum_size': 'MinimumSize',
+    'origin_pallet_number': 'Origin Pallet Number',
+    'supplier': 'Supplier',
+}
+
+
+def _text(series: pd.Series) -> List[Optional[str]]:
+    """Column values as the strings the allocation engines compare, with nulls kept as None."""
+    values = series.to_numpy(dtype=object)
+    text = values.astype(str).astype(object)
+    text[pd.isna(values)] = None
+    return text.tolist()
+
+
+def _record_values(stock_df: pd.DataFrame) -> Dict[str, List]:
+    """StockRecord attribute values for sheet rows, as the ledger stores them."""
+    columns = {attribute: _text(stock_df[column]) for attribute, column in RECORD_COLUMNS.items()}
+    # The engines read these two with str(), empty cells included
+    columns['material_id'] = [str(value) for value in stock_df['Material ID'].tolist()]
+    columns['batch_number'] = [str(value) for value in stock_df['Batch Number'].tolist()]
+    columns['weight_grams'] = parse_weight_grams(stock_df['Stock Weight']).tolist()
+    columns['age'] = pd.to_numeric(stock_df['Real Stock Age']).fillna(0).astype(int).tolist()
+    return columns
+
+
+def _hash_values(columns: Dict[str, List]) -> np.ndarray:
+    # Object columns hash the values themselves, whatever dtype the upload format gave them
+    frame = pd.DataFrame({attribute: pd.Series(values, dtype=object) for attribute, values in columns.items()})
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy().view(np.int64)
+
+
+def row_hashes(stock_df: pd.DataFrame) -> np.ndarray:
+    """
+    Hash each stock row as signed 64-bit integers.
+
+    The hash covers the values the ledger stores rather than the cells as read, so
+    the same sheet hashes alike whether it was uploaded as Excel, CSV, Parquet or JSON.
+    """
+    return _hash_values(_record_values(stock_df))
+
+
+def _record_columns(stock_df: pd.DataFrame, positions: Optional[List[int]] = None) -> Dict[str, List]:
+    """StockRecord values for sheet rows, column by column; positions default to the frame's row order."""
+    columns = _record_values(stock_df)
+    columns['row_hash'] = _hash_values(columns).tolist()
+    columns['position'] = list(range(len(stock_df))) if positions is None else positions
+    return columns
+
+
+def _mappings(columns: Dict[str, List]) -> List[Dict]:
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def _execute_chunked(statement, mappings: List[Dict]) -> None:
+    for start in range(0, len(mappings), LEDGER_INSERT_CHUNK_SIZE):
+        db.session.execute(statement, mappings[start:start + LEDGER_INSERT_CHUNK_SIZE])
+
+
+def _row_keys(batch_numbers: List[str], pallets: List[Optional[str]]) -> List[Tuple]:
+    """
+    Identify rows by Batch Number and Origin Pallet Number.
+
+    A key repeated in a sheet is told apart by its occurrence, counted in sheet order.
+    """
+    seen: Dict[Tuple, int] = {}
+    keys = []
+    for key in zip(batch_numbers, pallets):
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        keys.append(key + (occurrence,))
+    return keys
+
+
+def load_stock(stock_df: pd.DataFrame, upload_id: str) -> Dict:
+    """
+    Replace the stock ledger with a parsed stock sheet.
+
+    Rows go in with one executemany per chunk, and the old rows are deleted in the
+    same transaction, so readers see either the previous stock or the new one.
+
+    Args:
+        stock_df (pd.DataFrame): Stock data as returned by read_stock_excel
+        upload_id (str): Upload the stock came from
+
+    Returns:
+        Dict: The recorded load with its change counts
+
+    Raises:
+        ValidationError: If a weight cannot be parsed
+    """
+    try:
+        columns = _record_columns(stock_df)
+        deleted = db.session.query(StockRecord).delete(synchronize_session=False)
+        # A Core insert on the table is one executemany per chunk; the ORM bulk insert
+        # would split a chunk wherever the set of null columns changes
+        _execute_chunked(StockRecord.__table__.insert(), _mappings(columns))
+        load = StockLoad(upload_id=upload_id, mode='full', inserted=len(stock_df), deleted=deleted)
+        db.session.add(load)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error loading stock ledger: {str(e)}")
+        raise
+
+    logger.info(f"Loaded {len(stock_df)} batches into the stock ledger from upload {upload_id[:12]}")
+    return load.to_dict()
+
+
+def apply_stock_delta(stock_df: pd.DataFrame, upload_id: str) -> Dict:
+    """
+    Bring the stock ledger in line with a parsed stock sheet by applying only the changes.
+
+    Rows are matched on Batch Number and Origin Pallet Number and compared by row
+    hash: new keys are inserted, changed rows updated and missing keys deleted, all
+    in one transaction. Unchanged rows that moved in the sheet only get their
+    position updated, so FIFO ties still break as after a full load. An empty
+    ledger gets a full load.
+
+    Args:
+        stock_df (pd.DataFrame): Stock data as returned by read_stock_excel
+        upload_id (str): Upload the stock came from
+
+    Returns:
+        Dict: The recorded load with its change counts
+
+    Raises:
+        ValidationError: If a weight cannot be parsed
+    """
+    table = StockRecord.__table__
+    existing = db.session.execute(
+        db.select(table.c.id, table.c.batch_number, table.c.origin_pallet_number, table.c.row_hash, table.c.position)
+        .order_by(table.c.position)
+    ).all()
+    if not existing:
+        return load_stock(stock_df, upload_id)
+
+    try:
+        current = dict(zip(
+            _row_keys([row.batch_number for row in existing], [row.origin_pallet_number for row in existing]),
+            existing
+        ))
+        hashes = row_hashes(stock_df).tolist()
+        keys = _row_keys([str(value) for value in stock_df['Batch Number'].tolist()],
+                         _text(stock_df['Origin Pallet Number']))
+
+        inserts, updates, updated_ids, moves = [], [], [], []
+        for row, key in enumerate(keys):
+            record = current.pop(key, None)
+            if record is None:
+                inserts.append(row)
+            elif record.row_hash != hashes[row]:
+                updates.append(row)
+                updated_ids.append(record.id)
+            elif record.position != row:
+                moves.append({"record_id": record.id, "position": row})
+        deleted = [record.id for record in current.values()]
+
+        # Full records are only built for the rows that are written
+        changed = inserts + updates
+        mappings = _mappings(_record_columns(stock_df.iloc[changed], changed))
+        update_mappings = [dict(mapping, record_id=record_id)
+                           for mapping, record_id in zip(mappings[len(inserts):], updated_ids)]
+
+        for start in range(0, len(deleted), IN_QUERY_CHUNK_SIZE):
+            db.session.execute(table.delete().where(table.c.id.in_(deleted[start:start + IN_QUERY_CHUNK_SIZE])))
+        by_id = table.c.id == db.bindparam('record_id')
+        _execute_chunked(table.update().where(by_id), update_mappings)
+        _execute_chunked(table.update().where(by_id), moves)
+        _execute_chunked(table.insert(), mappings[:len(inserts)])
+
+        load = StockLoad(upload_id=upload_id, mode='delta', inserted=len(inserts), updated=len(updates),
+                         deleted=len(deleted), unchanged=len(stock_df) - len(inserts) - len(updates))
+        db.session.add(load)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error applying stock delta: {str(e)}")
+        raise
+
+    logger.info(f"Applied stock delta from upload {upload_id[:12]}: {len(inserts)} inserted, "
+                f"{len(updates)} updated, {len(deleted)} deleted")
+    return load.to_dict()
+
+
+def ledger_upload_id() -> Optional[str]:
+    """Upload the ledger was last loaded from, or None while it is empty."""
+    return db.session.query(StockLoad.upload_id).order_by(StockLoad.id.desc()).limit(1).scalar()
+
+
+def _restriction_filter(restrictions: Optional[Dict]):
+    """SQL condition for batches a restrictions dict accepts, or None if it accepts all."""
+    conditions = []
+    for field in ATTRIBUTE_FIELDS:
+        value = restrictions.get(field) if restrictions else None
+        if not value:
+            continue
+        values = [str(v) for v in (value if field in LIST_RESTRICTIONS else [value])]
+        column = getattr(StockRecord, field)
+        condition = column.in_(values)
+        if '' in values:
+            # Empty cells are stored as NULL and compare as empty strings
+            condition = db.or_(condition, column.is_(None))
+        conditions.append(condition)
+    return db.and_(*conditions) if conditions else None
+
+
+def query_stock(material_ids: Optional[Iterable[str]] = None, restriction_sets: Optional[List[Dict]] = None,
+                limit: Optional[int] = None) -> pd.DataFrame:
+    """
+    Read candidate batches from the ledger as a stock DataFrame, in stock sheet order.
+
+    Args:
+        material_ids (Iterable[str], optional): Material codes to read, all when omitted
+        restriction_sets (List[Dict], optional): Restrictions in use; a batch is read if
+            any of them accepts it
+        limit (int, optional): Read at most this many batches
+
+    Returns:
+        pd.DataFrame: Stock data in the layout read_stock_excel returns
+    """
+    attributes = list(RECORD_COLUMNS) + ['weight_grams', 'age']
+    # Plain column rows rather than StockRecord objects, which is far cheaper at 100k batches
+    query = db.select(*(getattr(StockRecord, attribute) for attribute in attributes))
+    if material_ids is not None:
+        query = query.where(StockRecord.material_id.in_(sorted(set(material_ids))))
+    if restriction_sets:
+        filters = [_restriction_filter(restrictions) for restrictions in restriction_sets]
+        if all(condition is not None for condition in filters):
+            query = query.where(db.or_(*filters))
+
+    rows = db.session.execute(query.order_by(StockRecord.position).limit(limit)).all()
+    df = pd.DataFrame.from_records(rows, columns=attributes).rename(columns=RECORD_COLUMNS)
+    df['Stock Weight'] = df.pop('weight_grams').map(grams_to_kg).astype(float)
+    df['Real Stock Age'] = df.pop('age').astype(int)
+    return df[STOCK_PROJECTED_COLUMNS]
+
+
+def stock_for_orders(orders: List[Dict], restrictions: Dict,
+                     customer_restrictions: Optional[Dict[str, Dict]] = None) -> pd.DataFrame:
+    """
+    Read only the batches some order could draw from.
+
+    A batch is left out when its material is not ordered or no restriction set in use
+    accepts it, which never changes an allocation since no order would look at it.
+
+    Raises:
+        ValidationError: If the ledger is empty
+    """
+    if ledger_upload_id() is None:
+        raise ValidationError("Stock ledger is empty")
+
+    customer_restrictions = customer_restrictions or {}
+    materials = {material_code(str(order.get('description_material', ''))) for order in orders}
+    customers = {str(order.get('sold_to_party', '')) for order in orders}
+    restriction_sets = [customer_restrictions[customer] for customer in customers if customer in customer_restrictions]
+    if any(customer not in customer_restrictions for customer in customers):
+        restriction_sets.append(restrictions)
+
+    stock_df = query_stock(materials, restriction_sets)
+    if stock_df.empty:
+        # Nothing to draw from; keep one row no order can match, since material codes
+        # never contain whitespace, so orders still come back unfulfilled
+        stock_df = query_stock(limit=1).assign(**{'Material ID': ' '})
+    logger.info(f"Read {len(stock_df)} candidate batches from the stock ledger")
+    return stock_df
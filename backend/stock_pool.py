@@ -0,0 +1,168 @@
+import heapq
+import logging
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from encoding import CompiledRestrictions, restriction_key
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Batch attributes that customer restrictions can filter on. Batches sharing a
+# material and all of these values are interchangeable as far as eligibility goes.
+BUCKET_ATTRIBUTES = ('quality', 'origin', 'variety', 'ggn', 'supplier', 'minimum_size')
+
+
+def material_code(description_material: Optional[str]) -> str:
+    """Extract the material code from an order's material description.
+
+    Order sheets carry values such as "BCB03000CBNLST (BLUEBERRY CON BULK 3,0kg CB NL ST)"
+    while the stock sheet only holds the code, so the first token is used.
+    """
+    if not description_material:
+        return ''
+    parts = str(description_material).split()
+    return parts[0] if parts else ''
+
+
+class StockBucket:
+    """Batches of one material with identical restriction attributes, youngest first."""
+
+    def __init__(self, material_id: str, attributes: Tuple):
+        self.material_id = material_id
+        self.attributes = attributes
+        self.batches = deque()
+
+    @property
+    def representative(self):
+        return self.batches[0] if self.batches else None
+
+    def head(self):
+        """Return the next batch to allocate from, dropping depleted ones in place."""
+        while self.batches and self.batches[0].weight_grams <= 0:
+            self.batches.popleft()
+        return self.batches[0] if self.batches else None
+
+    def __len__(self):
+        return len(self.batches)
+
+
+class MergedBuckets:
+    """
+    The eligible buckets of one material and restriction set, merged by their heads.
+
+    A heap holds one (age, sequence, bucket) entry per bucket that still has stock.
+    Buckets are shared between restriction sets, so an entry may be behind its bucket's
+    live head; stale entries are refreshed, and depleted buckets dropped, only when
+    they reach the top. The heap persists across orders, so each order pays for the
+    batches it takes rather than for every eligible bucket.
+    """
+
+    def __init__(self, buckets: List[StockBucket], sequence: Dict[int, int]):
+        self._sequence = sequence
+        self._heap = []
+        for bucket in buckets:
+            batch = bucket.head()
+            if batch is not None:
+                self._heap.append((batch.age, sequence[id(batch)], bucket))
+        heapq.heapify(self._heap)
+
+    @property
+    def buckets(self) -> List[StockBucket]:
+        return [entry[2] for entry in self._heap if entry[2].head() is not None]
+
+    def head(self):
+        """Return the youngest batch with remaining weight, or None once all are depleted."""
+        heap = self._heap
+        while heap:
+            age, seq, bucket = heap[0]
+            batch = bucket.head()
+            if batch is None:
+                heapq.heappop(heap)
+                continue
+            live_seq = self._sequence[id(batch)]
+            if live_seq != seq:
+                heapq.heapreplace(heap, (batch.age, live_seq, bucket))
+                continue
+            return batch
+        return None
+
+
+class StockPool:
+    """
+    Index of stock batches for FIFO allocation.
+
+    Batches are bucketed by material ID and restriction attributes. Each bucket keeps
+    its batches in age order, so an order only evaluates restrictions once per bucket
+    and then takes from the merged eligible buckets instead of rescanning every batch.
+    """
+
+    def __init__(self, batches: List):
+        self._buckets: Dict[str, List[StockBucket]] = {}
+        self._eligible_cache: Dict[Tuple, MergedBuckets] = {}
+        self._sequence = {}
+
+        index: Dict[Tuple, StockBucket] = {}
+        # Batches are expected in FIFO order already; sequence breaks age ties stably
+        for seq, batch in enumerate(batches):
+            self._sequence[id(batch)] = seq
+            attributes = batch.codes if batch.codes is not None else tuple(
+                getattr(batch, attr) for attr in BUCKET_ATTRIBUTES
+            )
+            bucket_id = (batch.material_id, attributes)
+            bucket = index.get(bucket_id)
+            if bucket is None:
+                bucket = StockBucket(batch.material_id, attributes)
+                index[bucket_id] = bucket
+                self._buckets.setdefault(batch.material_id, []).append(bucket)
+            bucket.batches.append(batch)
+
+        for bucket in index.values():
+            ordered = sorted(bucket.batches, key=lambda b: (b.age, self._sequence[id(b)]))
+            bucket.batches = deque(ordered)
+
+        logger.info(f"Stock pool built: {len(batches)} batches in {len(index)} buckets")
+
+    def _merged(self, material_id: str, restrictions) -> MergedBuckets:
+        if isinstance(restrictions, CompiledRestrictions):
+            cache_key = (material_id, restrictions.key)
+        else:
+            cache_key = (material_id, restriction_key(restrictions))
+        merged = self._eligible_cache.get(cache_key)
+        if merged is None:
+            eligible = []
+            for bucket in self._buckets.get(material_id, []):
+                batch = bucket.representative
+                if batch is not None and batch.matches_restrictions(restrictions):
+                    eligible.append(bucket)
+            merged = MergedBuckets(eligible, self._sequence)
+            self._eligible_cache[cache_key] = merged
+        return merged
+
+    def eligible_buckets(self, material_id: str, restrictions) -> List[StockBucket]:
+        """Return the buckets of a material with stock left whose attributes satisfy the restrictions."""
+        return self._merged(material_id, restrictions).buckets
+
+    def candidates(self, material_id: str, restrictions) -> Iterator:
+        """
+        Yield eligible batches with remaining weight, youngest first.
+
+        The generator reads the live bucket heads, so weight taken from a yielded
+        batch is accounted for before the next candidate is chosen; a batch that
+        still holds weight is yielded again.
+        """
+        merged = self._merged(material_id, restrictions)
+        batch = merged.head()
+        while batch is not None:
+            yield batch
+            batch = merged.head()
+
+    def remaining_batches(self) -> int:
+        """Count batches that still hold stock."""
+        return sum(
+            1
+            for buckets in self._buckets.values()
+            for bucket in buckets
+            for batch in bucket.batches
+            if batch.weight_grams > 0
+        )
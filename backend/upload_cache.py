@@ -0,0 +1,111 @@
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Callable, Optional
+
+import pandas as pd
+
+from upload_store import HASH_CHUNK_SIZE
+from validation import ORDERS_SCHEMA, STOCK_SCHEMA, coerce_frame
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 hex digest of a file on disk, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_stock_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return stock data with clean column names, numeric weights and integer ages.
+
+    Raises:
+        UploadValidationError: With every invalid value and repeated Batch Number
+    """
+    df = df.rename(columns=lambda col: str(col).strip())
+    return coerce_frame(df, STOCK_SCHEMA, 'stock')
+
+
+def orders_fields(df: pd.DataFrame) -> pd.DataFrame:
+    """Turn coerced order rows into the field layout allocate_fruits expects."""
+    loading_date = df['Loading Date']
+    return pd.DataFrame({
+        "loading_date": loading_date.dt.strftime('%Y-%m-%d').astype(object).where(loading_date.notna(), None),
+        "sales_document": df['Sales Document'].astype(str),
+        "sold_to_party": df['Sold-to Party'].astype(str),
+        "description_material": df['Description material'].astype(str),
+        "quantity": df['Quantity KG'],
+    })
+
+
+def normalize_orders_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return orders in the field layout allocate_fruits expects, one row per order.
+
+    Raises:
+        UploadValidationError: With every invalid value
+    """
+    df = df.rename(columns=lambda col: str(col).strip())
+    return orders_fields(coerce_frame(df, ORDERS_SCHEMA, 'orders'))
+
+
+class SnapshotCache:
+    """
+    Parsed upload snapshots stored on disk as pickles, keyed by the upload's content hash.
+
+    Uploading the same bytes again is a hash hit, and /allocate loads the typed
+    snapshot instead of parsing the workbook again.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, kind: str, digest: str) -> str:
+        return os.path.join(self.folder, f"{kind}_{digest}.pkl")
+
+    def load(self, kind: str, digest: str) -> Optional[pd.DataFrame]:
+        """Return the snapshot for a content hash, or None when it is missing or unreadable."""
+        path = self._path(kind, digest)
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_pickle(path)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable {kind} snapshot {digest}: {str(e)}")
+            os.remove(path)
+            return None
+
+    def store(self, kind: str, digest: str, df: pd.DataFrame) -> None:
+        """Write a snapshot atomically so concurrent readers never see a partial file."""
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        os.close(fd)
+        try:
+            df.to_pickle(temp_path)
+            os.replace(temp_path, self._path(kind, digest))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def discard(self, kind: str, digest: str) -> None:
+        path = self._path(kind, digest)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def load_for_file(self, kind: str, path: str, parse: Callable[[str], pd.DataFrame],
+                      digest: Optional[str] = None) -> pd.DataFrame:
+        """Load the snapshot matching a file's contents, parsing and storing it on a miss."""
+        digest = digest or file_hash(path)
+        df = self.load(kind, digest)
+        if df is None:
+            logger.info(f"No {kind} snapshot for {digest[:12]}, parsing {path}")
+            df = parse(path)
+            self.store(kind, digest, df)
+        return df
@@ -0,0 +1,132 @@
+import glob
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import BinaryIO, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Read size when streaming uploads to disk and hashing them
+HASH_CHUNK_SIZE = 1024 * 1024
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadStore:
+    """
+    Content-addressed storage for uploaded files.
+
+    Each upload is written to a temporary file while it is hashed and then moved
+    into place atomically as <kind>/<sha256>.<ext>, so readers never see a partial
+    file and concurrent planners never overwrite each other. The hash doubles as
+    the upload ID. Entries are evicted by age and by total size.
+    """
+
+    def __init__(self, folder: str, max_age_seconds: int, max_bytes: int):
+        self.folder = folder
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def _kind_folder(self, kind: str) -> str:
+        path = os.path.join(self.folder, kind)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _write_atomic(self, path: str, content: str) -> None:
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+    def save(self, kind: str, stream: BinaryIO, extension: str) -> Tuple[str, str, bool]:
+        """
+        Store an upload stream.
+
+        Returns:
+            Tuple[str, str, bool]: Upload ID, stored path, and whether the content is new
+        """
+        folder = self._kind_folder(kind)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+            upload_id = digest.hexdigest()
+            path = os.path.join(folder, f"{upload_id}.{extension}")
+            is_new = not os.path.exists(path)
+            if is_new:
+                os.replace(temp_path, path)
+            else:
+                # Same content already stored; refresh its age instead
+                os.utime(path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self._write_atomic(os.path.join(self.folder, f"{kind}.latest"), upload_id)
+        logger.info(f"Stored {kind} upload {upload_id[:12]} ({'new' if is_new else 'existing'})")
+        return upload_id, path, is_new
+
+    def path(self, kind: str, upload_id: str) -> Optional[str]:
+        """Return the stored file for an upload ID, or None if unknown or evicted."""
+        if not upload_id or not UPLOAD_ID_PATTERN.match(upload_id):
+            return None
+        matches = glob.glob(os.path.join(self.folder, kind, f"{upload_id}.*"))
+        matches = [m for m in matches if not m.endswith('.tmp')]
+        return matches[0] if matches else None
+
+    def latest(self, kind: str) -> Optional[str]:
+        """Upload ID of the most recent upload of a kind, from any worker."""
+        try:
+            with open(os.path.join(self.folder, f"{kind}.latest")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def discard(self, kind: str, upload_id: str) -> None:
+        path = self.path(kind, upload_id)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def evict(self) -> List[Tuple[str, str]]:
+        """
+        Remove entries older than the age limit, then the oldest until under the size limit.
+
+        Returns:
+            List[Tuple[str, str]]: (kind, upload ID) of every evicted entry
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.folder, '*', '*')):
+            if path.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            kind = os.path.basename(os.path.dirname(path))
+            upload_id = os.path.basename(path).split('.', 1)[0]
+            entries.append((stat.st_mtime, stat.st_size, kind, upload_id, path))
+        entries.sort()
+
+        now = time.time()
+        total = sum(entry[1] for entry in entries)
+        evicted = []
+        for mtime, size, kind, upload_id, path in entries:
+            if now - mtime <= self.max_age_seconds and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted.append((kind, upload_id))
+
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} stored uploads")
+        return evicted
@@ -0,0 +1,152 @@
+import logging
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Row errors kept for the response; the total is still counted past this
+MAX_REPORTED_ERRORS = 1000
+# Row errors spelled out in the error message
+SUMMARIZED_ERRORS = 5
+
+# A number with an optional KG unit, e.g. "361.056 KG"
+WEIGHT_PATTERN = r'^\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*(?:[kK][gG])?\s*$'
+
+
+class ColumnRule(NamedTuple):
+    """How one upload column is coerced and checked."""
+    kind: str  # 'text', 'weight', 'number', 'integer' (nulls count as 0) or 'date'
+    required: bool = False
+    non_negative: bool = False
+    unique: bool = False
+
+
+# Columns not listed are passed through as read
+STOCK_SCHEMA: Dict[str, ColumnRule] = {
+    'Batch Number': ColumnRule('text', required=True, unique=True),
+    'Stock Weight': ColumnRule('weight', required=True, non_negative=True),
+    'Real Stock Age': ColumnRule('integer'),
+}
+ORDERS_SCHEMA: Dict[str, ColumnRule] = {
+    'Loading Date': ColumnRule('date'),
+    'Quantity KG': ColumnRule('number', required=True, non_negative=True),
+}
+
+INVALID_MESSAGES = {
+    'weight': "is not a weight in KG",
+    'number': "is not a number",
+    'integer': "is not a number",
+    'date': "is not a date",
+}
+
+
+class UploadValidationError(ValueError):
+    """An upload with row-level errors; carries every error found, up to MAX_REPORTED_ERRORS."""
+
+    def __init__(self, file_type: str, errors: List[Dict], total: int):
+        self.errors = errors
+        self.total = total
+        summary = '; '.join(f"{e['column']} {e['error']} (row {e['row']})" for e in errors[:SUMMARIZED_ERRORS])
+        more = f" and {total - SUMMARIZED_ERRORS} more" if total > SUMMARIZED_ERRORS else ''
+        super().__init__(f"{file_type.capitalize()} file has {total} invalid values: {summary}{more}")
+
+
+def _coerce(series: pd.Series, kind: str) -> pd.Series:
+    """Convert a column to its kind; values that do not convert become null."""
+    if kind == 'weight':
+        if series.dtype == object or pd.api.types.is_string_dtype(series):
+            # Values such as "361.056 KG" carry a unit suffix
+            series = series.astype(str).str.extract(WEIGHT_PATTERN, expand=False).where(series.notna())
+        return pd.to_numeric(series, errors='coerce').astype(float)
+    if kind in ('number', 'integer'):
+        return pd.to_numeric(series, errors='coerce').astype(float)
+    if kind == 'date':
+        return pd.to_datetime(series, errors='coerce')
+    return series
+
+
+def _row_errors(mask: np.ndarray, column: str, error: str, row_numbers: np.ndarray,
+                limit: int) -> Tuple[List[Dict], int]:
+    rows = np.flatnonzero(mask)
+    errors = [{"row": int(row_numbers[row]), "column": column, "error": error} for row in rows[:max(limit, 0)]]
+    return errors, len(rows)
+
+
+def validate_frame(df: pd.DataFrame, schema: Dict[str, ColumnRule], first_row: int = 2,
+                   limit: int = MAX_REPORTED_ERRORS) -> Tuple[pd.DataFrame, List[Dict], int]:
+    """
+    Coerce and check the schema columns of a frame in one vectorized pass per column.
+
+    Uniqueness spans a whole upload, so it is checked separately by duplicate_errors.
+    Rows are numbered by the frame's integer index, which the upload readers keep as
+    each row's offset in the file, so rows skipped while reading are still counted.
+
+    Args:
+        df (pd.DataFrame): Rows as read, with clean column names
+        schema (Dict[str, ColumnRule]): Rules per column
+        first_row (int): Row number of index 0, for error reports
+        limit (int): Most row errors to return
+
+    Returns:
+        Tuple: The coerced frame, row errors sorted by row, and the total error count
+    """
+    df = df.copy()
+    row_numbers = first_row + df.index.to_numpy()
+    errors: List[Dict] = []
+    total = 0
+    for column, rule in schema.items():
+        if column not in df:
+            # Required columns are checked when the sheet is opened
+            continue
+        raw = df[column]
+        missing = raw.isna().to_numpy()
+        values = _coerce(raw, rule.kind)
+        checks = []
+        if rule.kind in INVALID_MESSAGES:
+            checks.append((values.isna().to_numpy() & ~missing, INVALID_MESSAGES[rule.kind]))
+        if rule.required:
+            checks.append((missing, "cannot be empty"))
+        if rule.non_negative:
+            checks.append(((values < 0).to_numpy(), "cannot be negative"))
+        for mask, error in checks:
+            found, count = _row_errors(mask, column, error, row_numbers, limit - len(errors))
+            errors.extend(found)
+            total += count
+        if rule.kind == 'integer':
+            values = values.fillna(0).astype(int)
+        df[column] = values
+    errors.sort(key=lambda e: e['row'])
+    return df, errors, total
+
+
+def duplicate_errors(values: pd.Series, column: str, first_row: int = 2,
+                     limit: int = MAX_REPORTED_ERRORS) -> Tuple[List[Dict], int]:
+    """Report every row whose value appears more than once in a column; nulls are ignored. Rows are numbered as in validate_frame."""
+    mask = (values.duplicated(keep=False) & values.notna()).to_numpy()
+    rows = np.flatnonzero(mask)
+    errors = [
+        {"row": int(first_row + values.index[row]), "column": column, "error": f"repeats {values.iloc[row]}"}
+        for row in rows[:max(limit, 0)]
+    ]
+    return errors, len(rows)
+
+
+def coerce_frame(df: pd.DataFrame, schema: Dict[str, ColumnRule], file_type: str) -> pd.DataFrame:
+    """
+    Validate a whole frame at once and return it coerced.
+
+    Raises:
+        UploadValidationError: With every row error found
+    """
+    df, errors, total = validate_frame(df, schema)
+    for column, rule in schema.items():
+        if rule.unique and column in df:
+            found, count = duplicate_errors(df[column], column, limit=MAX_REPORTED_ERRORS - len(errors))
+            errors.extend(found)
+            total += count
+    if total:
+        raise UploadValidationError(file_type, sorted(errors, key=lambda e: e['row']), total)
+    return df
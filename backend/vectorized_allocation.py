@@ -0,0 +1,265 @@
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import logging
+import json
+
+from allocation_logic import AllocationResult, ValidationError, grams_to_kg, to_grams
+from encoding import CompiledRestrictions, RestrictionResolver, StockEncoding
+from stock_pool import material_code
+import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Initial window when accumulating candidate weights; doubled until the order is covered
+FILL_WINDOW = 64
+
+
+def _text_column(series: pd.Series) -> np.ndarray:
+    """Stringify a column the way StockBatch does, with nulls as empty strings."""
+    return np.where(series.isna().to_numpy(), '', series.astype(str).to_numpy()).astype(object)
+
+
+def parse_weight_grams(series: pd.Series) -> np.ndarray:
+    """Parse 'Stock Weight' values such as '361.056 KG' into integer grams, rounding half up."""
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        values = pd.to_numeric(series.astype(str).str.split().str[0], errors='coerce')
+        values = values.where(series.notna())
+    else:
+        values = pd.to_numeric(series, errors='coerce')
+    if (values.isna() & series.notna()).any():
+        bad = series[values.isna() & series.notna()].iloc[0]
+        raise ValidationError(f"Invalid weight format: {bad}")
+    scaled = values.fillna(0).to_numpy(dtype=np.float64) * 1000
+    grams = np.floor(scaled + 0.5).astype(np.int64)
+    # Float products are off by a few ulps, which only matters next to a half gram;
+    # those values are rounded from their decimal text by to_grams, as StockBatch does
+    fraction = scaled - np.floor(scaled)
+    near_half = np.flatnonzero(np.abs(fraction - 0.5) <= 1e-9 * np.maximum(np.abs(scaled), 1))
+    for row in near_half.tolist():
+        value = series.iloc[row]
+        grams[row] = to_grams(value.split()[0] if isinstance(value, str) else str(value))
+    return grams
+
+
+class ColumnarStock:
+    """Age-sorted stock held as NumPy arrays, with cached eligibility index arrays."""
+
+    def __init__(self, stock_df: pd.DataFrame):
+        try:
+            ordered = stock_df.sort_values('Real Stock Age', ascending=True, kind='stable')
+            # Missing ages count as 0, as in StockBatch, so re-sort on the filled values
+            age = ordered['Real Stock Age'].fillna(0).to_numpy().astype(np.int64)
+            ordered = ordered.iloc[np.argsort(age, kind='stable')]
+            self.age = np.sort(age, kind='stable')
+            self.weight = parse_weight_grams(ordered['Stock Weight'])
+            self.batch_number = ordered['Batch Number'].astype(str).to_numpy()
+            self.material_id = ordered['Material ID'].astype(str).to_numpy()
+            self.location = _text_column(ordered['Location'])
+            self.encoding = StockEncoding()
+            self.codes = self.encoding.encode_frame(ordered)
+        except KeyError as e:
+            raise ValidationError(f"Invalid data in stock batch: {str(e)}")
+        self._materials = pd.Series(np.arange(len(self.weight))).groupby(self.material_id).indices
+        self._candidates: Dict[Tuple, np.ndarray] = {}
+        self._offsets: Dict[Tuple, int] = {}
+        # Rows summed while searching for fills, and rows actually drawn from
+        self.rows_scanned = 0
+        self.rows_touched = 0
+
+    def candidates(self, material_id: str, restrictions: CompiledRestrictions) -> Tuple[Tuple, np.ndarray]:
+        """Return the cache key and age-ordered row indices eligible for an order."""
+        key = (material_id, restrictions.key)
+        rows = self._candidates.get(key)
+        if rows is None:
+            rows = self._materials.get(material_id, np.empty(0, dtype=np.int64))
+            codes = {field: column[rows] for field, column in self.codes.items()}
+            rows = rows[restrictions.mask(codes, self.encoding)]
+            self._candidates[key] = rows
+            self._offsets[key] = 0
+        return key, rows
+
+    def append(self, stock_df: pd.DataFrame) -> np.ndarray:
+        """
+        Add batches as if they were appended to the stock sheet, returning their rows.
+
+        New rows go at the end of the arrays; each material's row list is updated so
+        it stays in FIFO order, with a new batch after existing batches of equal age.
+        """
+        try:
+            age = stock_df['Real Stock Age'].fillna(0).to_numpy().astype(np.int64)
+            weight = parse_weight_grams(stock_df['Stock Weight'])
+            batch_number = stock_df['Batch Number'].astype(str).to_numpy()
+            material_id = stock_df['Material ID'].astype(str).to_numpy()
+            location = _text_column(stock_df['Location'])
+            codes = self.encoding.encode_frame(stock_df)
+        except KeyError as e:
+            raise ValidationError(f"Invalid data in stock batch: {str(e)}")
+
+        start = len(self.weight)
+        self.age = np.concatenate([self.age, age])
+        self.weight = np.concatenate([self.weight, weight])
+        self.batch_number = np.concatenate([self.batch_number, batch_number])
+        self.material_id = np.concatenate([self.material_id, material_id])
+        self.location = np.concatenate([self.location, location])
+        self.codes = {field: np.concatenate([column, codes[field]]) for field, column in self.codes.items()}
+
+        rows = np.arange(start, len(self.weight))
+        for row in rows:
+            material = self.material_id[row]
+            material_rows = self._materials.get(material, np.empty(0, dtype=np.int64))
+            position = int(np.searchsorted(self.age[material_rows], self.age[row], side='right'))
+            self._materials[material] = np.insert(material_rows, position, row)
+            # Eligible row lists of the material are rebuilt on next use
+            for key in [key for key in self._candidates if key[0] == material]:
+                del self._candidates[key]
+                del self._offsets[key]
+        return rows
+
+    def release(self, material_id: str, rows: np.ndarray, fills: np.ndarray) -> None:
+        """Give back grams taken by an earlier fill so the orders after it can be replayed."""
+        self.weight[rows] += fills
+        for key in self._offsets:
+            if key[0] == material_id:
+                self._offsets[key] = 0
+
+    def fifo_key(self, row: int) -> Tuple[int, int]:
+        """Position of a row in FIFO order within its material."""
+        return int(self.age[row]), int(row)
+
+    def attribute(self, field: str, row: int) -> str:
+        """Decode one attribute value of a row."""
+        return self.encoding.dictionaries[field].values[self.codes[field][row]]
+
+    def fill(self, material_id: str, restrictions: CompiledRestrictions, required: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Take up to `required` grams FIFO from the eligible rows.
+
+        Returns the row indices touched and the grams taken from each.
+        """
+        key, rows = self.candidates(material_id, restrictions)
+        start = self._offsets[key]
+        # Skip the depleted prefix once so later orders never rescan it
+        while start < len(rows) and self.weight[rows[start]] <= 0:
+            start += 1
+        self._offsets[key] = start
+        if required <= 0 or start >= len(rows):
+            return rows[:0], self.weight[:0]
+
+        window = FILL_WINDOW
+        while True:
+            taken = rows[start:start + window]
+            cumulative = np.cumsum(self.weight[taken])
+            if cumulative[-1] >= required or start + window >= len(rows):
+                break
+            window *= 2
+
+        self.rows_scanned += len(taken)
+        cut = int(np.searchsorted(cumulative, required, side='left'))
+        if cut < len(taken):
+            taken = taken[:cut + 1]
+            fills = self.weight[taken].copy()
+            fills[-1] = required - (cumulative[cut - 1] if cut > 0 else 0)
+        else:
+            fills = self.weight[taken].copy()
+        self.weight[taken] -= fills
+
+        used = fills > 0
+        self.rows_touched += int(used.sum())
+        return taken[used], fills[used]
+
+
+class FilledOrder(NamedTuple):
+    """One order's result together with the rows and grams it drew."""
+    sales_document: str
+    result: Dict
+    rows: np.ndarray
+    fills: np.ndarray
+
+
+def fill_order(stock: ColumnarStock, resolver: RestrictionResolver, order: Dict) -> Optional[FilledOrder]:
+    """
+    Allocate one order FIFO from the columnar stock.
+
+    Returns None for orders that are skipped as invalid.
+    """
+    no_rows = np.empty(0, dtype=np.int64)
+    try:
+        sales_doc = str(order.get('sales_document', ''))
+        material_desc = str(order.get('description_material', ''))
+        sold_to_party = str(order.get('sold_to_party', ''))
+        required_weight = to_grams(order.get('quantity', 0))
+
+        if not sales_doc or not material_desc or required_weight < 0:
+            logger.warning(f"Skipping invalid order: {json.dumps(order)}")
+            return None
+
+        rows, fills = stock.fill(material_code(material_desc), resolver.for_customer(sold_to_party), required_weight)
+        allocated_weight = int(fills.sum())
+
+        if allocated_weight > 0:
+            status = "fully_allocated" if allocated_weight >= required_weight else "partially_allocated"
+            allocated_batches = [{
+                "batch": stock.batch_number[row],
+                "weight": grams_to_kg(grams),
+                "age": int(stock.age[row]),
+                "location": stock.location[row],
+                "supplier": stock.attribute('supplier', row),
+                "quality": stock.attribute('quality', row),
+                "origin": stock.attribute('origin', row)
+            } for row, grams in zip(rows.tolist(), fills.tolist())]
+            result = AllocationResult(
+                status=status,
+                weight=grams_to_kg(allocated_weight),
+                batches=allocated_batches
+            )._asdict()
+            return FilledOrder(sales_doc, result, rows, fills)
+
+        result = AllocationResult(status="unfulfilled", weight=0, batches=[])._asdict()
+        return FilledOrder(sales_doc, result, rows, fills)
+
+    except (ValueError, TypeError, ArithmeticError) as e:
+        logger.error(f"Error processing order {order}: {str(e)}")
+        result = AllocationResult(status="error", weight=0, batches=[])._asdict()
+        return FilledOrder(sales_doc if 'sales_doc' in locals() else 'unknown', result, no_rows, no_rows)
+
+
+def iter_vectorized(stock_df: pd.DataFrame, orders: List[Dict], restrictions: Dict,
+                    progress: Optional[Callable[[int], None]] = None,
+                    customer_restrictions: Optional[Dict[str, Dict]] = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    Columnar counterpart of iter_allocations.
+
+    Restriction eligibility is computed as boolean masks per material and FIFO fills
+    are taken with cumulative sums over the age-sorted weight array. Results are
+    yielded in the same order and shape as the pool engine's.
+    """
+    try:
+        if stock_df.empty:
+            raise ValidationError("Stock data is empty")
+        if not orders:
+            raise ValidationError("No orders provided")
+
+        with metrics.phase('build_columns'):
+            stock = ColumnarStock(stock_df)
+            resolver = RestrictionResolver(stock.encoding, restrictions, customer_restrictions)
+        with metrics.phase('allocation'):
+            for index, order in enumerate(orders):
+                if progress is not None:
+                    progress(index)
+                allocated = fill_order(stock, resolver, order)
+                if allocated is not None:
+                    yield allocated.sales_document, allocated.result
+
+        if progress is not None:
+            progress(len(orders))
+        metrics.count('stock_batches', len(stock.weight))
+        metrics.count('orders', len(orders))
+        metrics.count('batches_scanned', stock.rows_scanned)
+        metrics.count('batches_touched', stock.rows_touched)
+        logger.info(f"Vectorized allocation completed successfully for {len(orders)} orders")
+
+    except Exception as e:
+        logger.error(f"Error in vectorized allocation process: {str(e)}")
+        raise ValidationError(f"Allocation failed: {str(e)}")
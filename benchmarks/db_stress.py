@@ -0,0 +1,127 @@
+"""
+Concurrent read/write stress test of the restrictions tables on a local SQLite file.
+
+Forked worker processes, like gunicorn workers, update restrictions with
+set_restrictions and resolve them with get_restrictions_for_customers for a fixed
+time, once with Flask-SQLAlchemy's defaults (rollback journal, synchronous=FULL)
+and once with the settings applied by database.init_database (WAL,
+synchronous=NORMAL, busy timeout). Reports operations per second, "database is
+locked" failures and latency percentiles for each:
+
+    python benchmarks/db_stress.py --workers 4 --seconds 5 --write-ratio 0.2
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, '..', 'backend'))
+
+from flask import Flask
+
+from database import db, init_database
+from restrictions import get_restrictions_for_customers, restriction_cache, set_restrictions
+
+CUSTOMERS = [f"{10050000 + i}" for i in range(200)]
+ORIGINS = ["Chile", "Peru", "South Africa", "Argentina"]
+QUALITIES = ["Good Q/S", "Fair M/C", "Poor"]
+
+
+def make_app(path, tuned):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    if tuned:
+        app.config.update(DB_BUSY_TIMEOUT_MS=5000, DB_JOURNAL_MODE='wal', DB_SYNCHRONOUS='normal',
+                          DB_POOL_SIZE=5, DB_MAX_OVERFLOW=10, DB_POOL_RECYCLE_SECONDS=1800)
+        init_database(app)
+    else:
+        db.init_app(app)
+    return app
+
+
+def worker(path, tuned, seconds, write_ratio, seed, queue):
+    rng = random.Random(seed)
+    app = make_app(path, tuned)
+    ops = {"reads": 0, "writes": 0, "locked": 0, "errors": 0}
+    latencies = []
+    with app.app_context():
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                if rng.random() < write_ratio:
+                    set_restrictions(rng.choice(CUSTOMERS), {
+                        "origin": rng.sample(ORIGINS, 2), "quality": rng.sample(QUALITIES, 1)
+                    })
+                    ops["writes"] += 1
+                else:
+                    # Each read reaches the database, as in a worker whose cache is cold
+                    restriction_cache.clear()
+                    get_restrictions_for_customers(rng.sample(CUSTOMERS, 20))
+                    ops["reads"] += 1
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                db.session.rollback()
+                ops["locked" if "database is locked" in str(e) else "errors"] += 1
+        db.session.remove()
+    queue.put((ops, latencies))
+
+
+def run(tuned, workers, seconds, write_ratio):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'stress.db')
+        app = make_app(path, tuned)
+        with app.app_context():
+            db.create_all()
+            for customer in CUSTOMERS:
+                set_restrictions(customer, {"origin": ORIGINS[:2], "quality": QUALITIES[:1]})
+            db.session.remove()
+            db.engine.dispose()
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        processes = [context.Process(target=worker, args=(path, tuned, seconds, write_ratio, seed, queue))
+                     for seed in range(workers)]
+        for process in processes:
+            process.start()
+        outcomes = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    totals = {key: sum(ops[key] for ops, _ in outcomes) for key in ("reads", "writes", "locked", "errors")}
+    latencies = sorted(latency for _, worker_latencies in outcomes for latency in worker_latencies)
+    completed = totals["reads"] + totals["writes"]
+    return {
+        "settings": "wal" if tuned else "default",
+        **totals,
+        "ops_per_second": round(completed / seconds, 1),
+        "median_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent worker processes')
+    parser.add_argument('--seconds', type=float, default=5, help='Run time per configuration')
+    parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of operations that write')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    results = [run(tuned, args.workers, args.seconds, args.write_ratio) for tuned in (False, True)]
+    for result in results:
+        print(json.dumps(result))
+    baseline, tuned = results
+    if baseline["ops_per_second"]:
+        print(f"Throughput: {tuned['ops_per_second'] / baseline['ops_per_second']:.2f}x the default settings")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Seeded generators for stock and order sheets shaped like the files in xlsx/.
+
+Cardinalities follow the sample exports: a handful of origins and qualities, a
+dozen varieties per origin mix, tens of suppliers and GGNs, ages up to a month,
+and pallets of roughly 100-1200 kg. Every order references a stock material, so
+allocation does real work at every size.
+"""
+import numpy as np
+import pandas as pd
+
+RAW_MATERIALS = ['FIARGRN', 'FIARORG']
+PACKED_MATERIALS = [
+    ('BCB03500PBNLBP', 'BLUEBERRY CON BULK 3,5kg PB NL BP'),
+    ('BCB03600PBNLBP', 'BLUEBERRY CON BULK 3,6kg PB NL BP'),
+    ('BCB03000CBNLST', 'BLUEBERRY CON BULK 3,0kg CB NL ST'),
+    ('BCL12250BLSSST', 'BLUEBERRY CON PUNT 12x250gr BL SS ST'),
+    ('BCH12125BLICST', 'BLUEBERRY CON PUNS 12x125gr BL IC ST'),
+    ('BOH12125BLGOST', 'BLUEBERRY ORG TER 12x125gr BL GO ST'),
+    ('BCK06500BLSSST', 'BLUEBERRY CON CUBO 06x500gr BL SS ST'),
+    ('BCL10300BLRBST', 'BLUEBERRY CONV 10x300gr BL RB ST'),
+]
+ORIGINS = ['Chile', 'Peru', 'Morocco', 'South Africa', 'Spain', 'Zimbabwe']
+VARIETIES = ['LEGACY', 'BLUE RIBBON', 'ROCIO', 'MANILA', 'DUKE', 'EMERALD', 'VENTURA',
+             'STAR', 'BILOXI', 'SEKOYA POP', 'MAGICA', 'BIANCA']
+QUALITIES = ['Poor M/C', 'Fair M/C', 'Fair', 'Bad', 'Good Q/S', 'Good', None]
+QUALITY_WEIGHTS = [0.45, 0.37, 0.06, 0.05, 0.03, 0.01, 0.03]
+MINIMUM_SIZES = [10, 12, 14, 16]
+SUPPLIER_COUNT = 40
+GGN_COUNT = 120
+CUSTOMER_COUNT = 60
+
+
+def _materials():
+    codes = RAW_MATERIALS + [code for code, _ in PACKED_MATERIALS]
+    descriptions = {code: code for code in RAW_MATERIALS}
+    descriptions.update({code: f"{code} ({text})" for code, text in PACKED_MATERIALS})
+    return codes, descriptions
+
+
+def generate_stock(rows: int, seed: int = 42) -> pd.DataFrame:
+    """Stock sheet with the StockAllocation.xlsx columns, weights as 'N.NNN KG' strings."""
+    rng = np.random.default_rng(seed)
+    codes, _ = _materials()
+    # Raw fruit dominates the warehouse, as in the sample export
+    material_weights = np.array([0.45, 0.40] + [0.15 / len(PACKED_MATERIALS)] * len(PACKED_MATERIALS))
+    suppliers = np.array([f"SUPPLIER {i:02d} S.A." for i in range(SUPPLIER_COUNT)], dtype=object)
+    ggns = np.array([str(4050000000000 + i * 7919) for i in range(GGN_COUNT)], dtype=object)
+    weights = np.clip(rng.normal(880, 280, rows), 0.008, 1200)
+
+    return pd.DataFrame({
+        'Location': rng.choice(np.array([None] + [f"R{i:02d}-{j}" for i in range(30) for j in 'ABC'],
+                                        dtype=object), rows),
+        'Batch Number': [f"BT{seed % 100:02d}{i:08d}" for i in range(rows)],
+        'Stock Weight': [f"{w:.3f} KG" for w in weights],
+        'Material ID': rng.choice(np.array(codes, dtype=object), rows, p=material_weights),
+        'Real Stock Age': rng.integers(0, 31, rows),
+        'Variety': rng.choice(np.array(VARIETIES, dtype=object), rows),
+        'GGN': rng.choice(ggns, rows),
+        'Origin Country': rng.choice(np.array(ORIGINS, dtype=object), rows, p=[0.4, 0.3, 0.15, 0.08, 0.05, 0.02]),
+        'Q3: Reinspection Quality': rng.choice(np.array(QUALITIES, dtype=object), rows, p=QUALITY_WEIGHTS),
+        'BL/AWB/CMR': [f"{rng.integers(1, 28):02d}{rng.integers(1, 13):02d}2025" for _ in range(rows)],
+        'Allocation': [None] * rows,
+        'MinimumSize': rng.choice(MINIMUM_SIZES, rows),
+        'Origin Pallet Number': [f"FP{i:08d}" for i in range(rows)],
+        'Supplier': rng.choice(suppliers, rows),
+    })
+
+
+def generate_orders(rows: int, seed: int = 43) -> pd.DataFrame:
+    """Order sheet with the OrdersAllocation.xlsx columns."""
+    rng = np.random.default_rng(seed)
+    codes, descriptions = _materials()
+    customers = np.array([f"{10040000 + i * 37} (CUSTOMER {i:02d})" for i in range(CUSTOMER_COUNT)], dtype=object)
+    start = np.datetime64('2025-02-20')
+    # Order lines are a few pallets each, in whole kilograms
+    quantity = np.round(rng.gamma(2.0, 1500, rows))
+
+    return pd.DataFrame({
+        'Loading Date': pd.to_datetime(start + rng.integers(0, 14, rows).astype('timedelta64[D]')),
+        'Sales Document Item': rng.choice([10, 20, 30], rows),
+        'Sales Document': np.arange(700000, 700000 + rows),
+        'Order': np.arange(1030000, 1030000 + rows).astype(float),
+        'Sold-to Party': rng.choice(customers, rows),
+        'Description material': [descriptions[c] for c in rng.choice(np.array(codes, dtype=object), rows)],
+        'Quantity KG': quantity,
+    })
+
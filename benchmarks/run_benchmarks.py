@@ -0,0 +1,200 @@
+"""
+Allocation benchmark suite.
+
+Times app startup, Excel parsing, StockBatch construction, allocate_fruits per
+engine and JSON serialization of the result on seeded synthetic sheets, and
+writes the timings as JSON so runs can be compared between commits:
+
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<old>.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, '..', 'backend'))
+
+from allocation_logic import ALLOCATION_ENGINES, StockBatch, allocate_fruits
+from encoding import StockEncoding
+from ingestion import pa_csv, read_orders_excel, read_stock_excel, read_stock_file
+from upload_cache import normalize_orders_frame, normalize_stock_frame
+from generators import generate_orders, generate_stock
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+# Writing and parsing workbooks dominates beyond this, so larger sizes skip the Excel benchmark
+DEFAULT_MAX_EXCEL_ROWS = 100000
+
+# Run in a fresh interpreter: creating the app (what each gunicorn worker pays
+# without --preload), then warm_up (paid once by the master with --preload)
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import app
+application = app.create_app()
+created = time.perf_counter()
+app.warm_up(application)
+print(created - start, time.perf_counter() - created)
+"""
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def measure(func, repeat):
+    """Run func `repeat` times and return (timings, last result)."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def record(results, name, size, timings, **extra):
+    entry = {
+        "benchmark": name,
+        "size": size,
+        "min_seconds": min(timings),
+        "median_seconds": statistics.median(timings),
+        "runs": len(timings),
+        **extra,
+    }
+    results.append(entry)
+    label = ' '.join(f"{k}={v}" for k, v in extra.items())
+    print(f"{name:<28} {size:>9,} {entry['min_seconds']:>10.4f}s {label}", flush=True)
+
+
+def run_startup(repeat, results):
+    backend = os.path.join(BENCHMARK_DIR, '..', 'backend')
+    env = {**os.environ, 'PYTHONPATH': backend}
+    startups, warm_ups = [], []
+    with tempfile.TemporaryDirectory() as folder:
+        for _ in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT], cwd=folder, env=env,
+                                             stderr=subprocess.DEVNULL, text=True)
+            created, warmed = output.split()
+            startups.append(float(created))
+            warm_ups.append(float(warmed))
+    record(results, 'app_startup', 0, startups)
+    record(results, 'app_warm_up', 0, warm_ups)
+
+
+def run_size(size, repeat, max_excel_rows, engines, results):
+    stock_df = generate_stock(size)
+    orders_frame = generate_orders(size)
+
+    if size <= max_excel_rows:
+        with tempfile.TemporaryDirectory() as folder:
+            stock_path = os.path.join(folder, 'stock.xlsx')
+            orders_path = os.path.join(folder, 'orders.xlsx')
+            stock_df.to_excel(stock_path, index=False)
+            orders_frame.to_excel(orders_path, index=False)
+            timings, _ = measure(lambda: read_stock_excel(stock_path), repeat)
+            record(results, 'excel_parse_stock', size, timings, reader='streaming')
+            timings, _ = measure(lambda: pd.read_excel(stock_path, engine='openpyxl'), repeat)
+            record(results, 'excel_parse_stock', size, timings, reader='pandas')
+            timings, _ = measure(lambda: read_orders_excel(orders_path), repeat)
+            record(results, 'excel_parse_orders', size, timings, reader='streaming')
+
+    # Machine-client formats are cheap to write, so they run at every size
+    with tempfile.TemporaryDirectory() as folder:
+        csv_path = os.path.join(folder, 'stock.csv')
+        json_path = os.path.join(folder, 'stock.json')
+        stock_df.to_csv(csv_path, index=False)
+        stock_df.to_json(json_path, orient='records')
+        timings, _ = measure(lambda: read_stock_file(csv_path), repeat)
+        record(results, 'csv_parse_stock', size, timings, reader='pyarrow' if pa_csv is not None else 'pandas')
+        timings, _ = measure(lambda: read_stock_file(json_path), repeat)
+        record(results, 'json_parse_stock', size, timings)
+
+    normalized = normalize_stock_frame(stock_df)
+    orders = normalize_orders_frame(orders_frame).to_dict('records')
+
+    def build_batches():
+        encoding = StockEncoding()
+        return [StockBatch(row, encoding) for _, row in normalized.iterrows()]
+
+    timings, _ = measure(build_batches, repeat)
+    record(results, 'stockbatch_construction', size, timings)
+
+    allocation = None
+    for engine in engines:
+        timings, allocation = measure(lambda: allocate_fruits(normalized, orders, {}, engine=engine), repeat)
+        record(results, 'allocate_fruits', size, timings, engine=engine)
+
+    timings, payload = measure(lambda: json.dumps({"allocation": allocation}), repeat)
+    record(results, 'json_serialization', size, timings, bytes=len(payload))
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(entry):
+        extra = tuple(sorted((k, v) for k, v in entry.items()
+                             if k not in ('min_seconds', 'median_seconds', 'runs', 'bytes')))
+        return extra
+
+    previous = {key(entry): entry for entry in baseline['results']}
+    print(f"\nCompared with {baseline['commit']} (ratio > 1 means slower now):")
+    for entry in current['results']:
+        old = previous.get(key(entry))
+        if old:
+            ratio = entry['min_seconds'] / old['min_seconds'] if old['min_seconds'] else float('inf')
+            print(f"{entry['benchmark']:<28} {entry['size']:>9,} {ratio:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Row counts for stock and orders (e.g. 1000 10000 100000 1000000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark; the minimum is reported')
+    parser.add_argument('--engines', nargs='+', default=list(ALLOCATION_ENGINES), choices=ALLOCATION_ENGINES)
+    parser.add_argument('--max-excel-rows', type=int, default=DEFAULT_MAX_EXCEL_ROWS)
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='Earlier result file to compare against')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    commit = git_commit()
+    results = []
+    run_startup(args.repeat, results)
+    for size in args.sizes:
+        run_size(size, args.repeat, args.max_excel_rows, args.engines, results)
+
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output = args.output or os.path.join(BENCHMARK_DIR, 'results', f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
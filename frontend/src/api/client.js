@@ -49,12 +49,12 @@ export const uploadStock = async (file) => {
   try {
     const formData = new FormData();
     formData.append('file', file);
-    const response = await api.post('/upload_stock', formData, {
+    // The response interceptor already unwraps the body
+    return await api.post('/upload_stock', formData, {
       headers: {
         'Content-Type': 'multipart/form-data',
       },
     });
-    return response.data;
   } catch (error) {
     const handleError = (error) => {
       const errorMessage =
@@ -71,12 +71,12 @@ export const uploadOrders = async (file) => {
   try {
     const formData = new FormData();
     formData.append('file', file);
-    const response = await api.post('/upload_orders', formData, {
+    // The response interceptor already unwraps the body
+    return await api.post('/upload_orders', formData, {
       headers: {
         'Content-Type': 'multipart/form-data',
       },
     });
-    return response.data;
   } catch (error) {
     const handleError = (error) => {
       const errorMessage =
@@ -89,7 +89,15 @@ export const uploadOrders = async (file) => {
   }
 };
 
-export const allocateStock = async (stockFile, ordersFile) => {
+const JOB_POLL_INTERVAL_MS = 1000;
+
+const wait = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+export const getJob = async (jobId) => {
+  return api.get(`/jobs/${jobId}`);
+};
+
+export const allocateStock = async (stockFile, ordersFile, onProgress) => {
   try {
     // First upload the stock file
     const stockUploadResponse = await uploadStock(stockFile);
@@ -97,14 +105,31 @@ export const allocateStock = async (stockFile, ordersFile) => {
     // Then upload the orders file
     const ordersUploadResponse = await uploadOrders(ordersFile);
     
-    // Finally, trigger allocation
-    const response = await api.post('/allocate', {}, {
+    // Queue allocation on exactly these uploads as a background job
+    const job = await api.post('/allocate', {
+      stock_id: stockUploadResponse.upload_id,
+      orders_id: ordersUploadResponse.upload_id,
+      async: true,
+    }, {
       headers: {
         'Content-Type': 'application/json',
       },
     });
-    
-    return response;
+
+    // Poll instead of holding one long request open
+    for (;;) {
+      const status = await getJob(job.job_id);
+      if (onProgress) {
+        onProgress({ processed: status.orders_processed, total: status.orders_total });
+      }
+      if (status.status === 'completed') {
+        return status.result;
+      }
+      if (status.status === 'failed') {
+        throw new Error(status.error || 'Allocation failed');
+      }
+      await wait(JOB_POLL_INTERVAL_MS);
+    }
   } catch (error) {
     const handleError = (error) => {
       const errorMessage =
@@ -1,10 +1,14 @@
+import { useState } from 'react';
 import { useMutation } from 'react-query';
 import { allocateStock } from '../api/client';
 
 export function useAllocation() {
+  const [progress, setProgress] = useState(null);
+
   const mutation = useMutation(
     async ({ stockFile, ordersFile }) => {
-      return allocateStock(stockFile, ordersFile);
+      setProgress(null);
+      return allocateStock(stockFile, ordersFile, setProgress);
     },
     {
       onError: (error) => {
@@ -17,6 +21,7 @@ export function useAllocation() {
     allocate: mutation.mutate,
     isAllocating: mutation.isLoading,
     allocation: mutation.data?.allocation,
+    progress,
     error: mutation.error,
     reset: mutation.reset,
   };
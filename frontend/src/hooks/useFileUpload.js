@@ -17,8 +17,8 @@ export function useFileUpload() {
       return;
     }
 
-    if (uploadedFile.size > 10 * 1024 * 1024) {
-      setError('File size must be less than 10MB');
+    if (uploadedFile.size > 100 * 1024 * 1024) {
+      setError('File size must be less than 100MB');
       return;
     }
 
@@ -0,0 +1,18 @@
+"""
+gunicorn settings for the backend (run from the repository root, see Procfile).
+
+The app is loaded once in the master (preload), which also creates the schema
+and imports pandas and openpyxl, so forked workers start with all of it shared
+copy-on-write instead of each paying for it. gunicorn itself picks up PORT and
+WEB_CONCURRENCY from the environment.
+"""
+preload_app = True
+
+
+def when_ready(server):
+    """Runs in the master after the app is loaded and before any worker is forked."""
+    from app import init_db, warm_up
+
+    app = server.app.wsgi()
+    init_db(app)
+    warm_up(app)
@@ -1,4 +1,3 @@
-import pandas as pd
 import sys
 import os
 
@@ -6,28 +5,20 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
 
 from allocation_logic import allocate_fruits
+from ingestion import read_stock_excel, read_orders_excel
 import json
 
 def test_allocation():
     print("Loading stock file...")
-    stock_df = pd.read_excel('xlsx/StockAllocation.xlsx')
+    stock_df = read_stock_excel('xlsx/StockAllocation.xlsx')
     print(f"Loaded {len(stock_df)} stock records")
     
     print("\nLoading orders file...")
-    orders_df = pd.read_excel('xlsx/OrdersAllocation.xlsx')
+    orders_df = read_orders_excel('xlsx/OrdersAllocation.xlsx')
     print(f"Loaded {len(orders_df)} orders")
     
-    # Convert orders DataFrame to list of dictionaries
-    orders = []
-    for _, row in orders_df.iterrows():
-        order = {
-            "loading_date": row['Loading Date'].strftime('%Y-%m-%d') if pd.notnull(row['Loading Date']) else None,
-            "sales_document": str(row['Sales Document']),
-            "sold_to_party": str(row['Sold-to Party']),
-            "description_material": str(row['Description material']),
-            "quantity": float(row['Quantity KG'])
-        }
-        orders.append(order)
+    # Orders come back already in the allocate_fruits field layout
+    orders = orders_df.to_dict('records')
     
     print("\nStarting allocation...")
     # For testing, we'll use empty restrictions
@@ -0,0 +1,85 @@
+import random
+import sys
+import os
+
+import pandas as pd
+import pytest
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from allocation_logic import ValidationError, allocate_fruits
+from allocation_session import AllocationSession
+from test_stock_pool import make_stock, make_orders
+
+CUSTOMER_RESTRICTIONS = {"C1": {"origin": ["Chile", "Peru"]}, "C2": {"quality": ["Good Q/S"]}}
+
+
+def make_session_orders(count, seed=11):
+    rng = random.Random(seed)
+    orders = make_orders(count=count, seed=seed)
+    for order in orders:
+        order["sold_to_party"] = rng.choice(["C1", "C2", "C3"])
+    return orders
+
+
+def full_rerun(stock_df, orders):
+    return allocate_fruits(stock_df, orders, {}, customer_restrictions=CUSTOMER_RESTRICTIONS)
+
+
+def test_random_changes_match_a_full_rerun():
+    rng = random.Random(5)
+    stock_df = make_stock(rows=120)
+    orders = make_session_orders(60)
+    session = AllocationSession(stock_df, orders, {}, CUSTOMER_RESTRICTIONS)
+    assert session.results() == full_rerun(stock_df, orders)
+
+    for step in range(80):
+        op = rng.choice(['add_order', 'update_order', 'remove_order', 'set_batch_weight', 'add_batch'])
+        order = make_session_orders(1, seed=step + 100)[0]
+        order["sales_document"] = f"NEW{step}"
+        position = rng.randrange(len(session.orders))
+        if op == 'add_order':
+            session.apply({"op": op, "order": order, "position": rng.choice([None, position])})
+        elif op == 'update_order':
+            session.apply({"op": op, "position": position, "order": order})
+        elif op == 'remove_order':
+            session.apply({"op": op, "position": position})
+        elif op == 'set_batch_weight':
+            batch = rng.choice(stock_df['Batch Number'].tolist())
+            weight = rng.choice([0, rng.randint(1, 1500000) / 1000])
+            session.apply({"op": op, "batch": batch, "weight": weight})
+            stock_df.loc[stock_df['Batch Number'] == batch, 'Stock Weight'] = f"{weight:.3f} KG"
+        else:
+            batch = make_stock(rows=1, seed=step).iloc[0].to_dict()
+            batch["Batch Number"] = f"NEW{step}"
+            session.apply({"op": op, "batch": batch})
+            stock_df = pd.concat([stock_df, pd.DataFrame([batch])], ignore_index=True)
+
+        assert session.results() == full_rerun(stock_df, session.orders), f"step {step}: {op}"
+
+
+def test_changes_only_replay_affected_orders():
+    stock_df = make_stock(rows=200)
+    orders = make_session_orders(100)
+    session = AllocationSession(stock_df, orders, {}, CUSTOMER_RESTRICTIONS)
+
+    last = len(orders) - 1
+    replayed = session.update_order(last, dict(orders[last], quantity=1))
+    assert [position for position, _ in replayed] == [last]
+
+    replayed = session.update_order(0, dict(orders[0], quantity=10))
+    assert all(record.material == replayed[0][1].material for _, record in replayed)
+    assert len(replayed) < len(orders)
+
+
+def test_invalid_changes_are_rejected():
+    session = AllocationSession(make_stock(rows=20), make_session_orders(5), {})
+    with pytest.raises(ValidationError):
+        session.apply({"op": "rename_order"})
+    with pytest.raises(ValidationError):
+        session.apply({"op": "remove_order", "position": 5})
+    with pytest.raises(ValidationError):
+        session.apply({"op": "set_batch_weight", "batch": "NOPE", "weight": 1})
+    with pytest.raises(ValidationError):
+        session.apply({"op": "set_batch_weight", "batch": "B00001", "weight": -1})
@@ -0,0 +1,155 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+# Add the backend directory to Python path
+BACKEND = os.path.join(os.path.dirname(__file__), 'backend')
+sys.path.append(BACKEND)
+
+from app import create_app, init_db
+from restrictions import restriction_cache, set_restrictions
+
+XLSX = os.path.join(os.path.dirname(__file__), 'xlsx')
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+        'UPLOAD_STORE_FOLDER': str(tmp_path / 'uploads'),
+        'SNAPSHOT_FOLDER': str(tmp_path / 'snapshots'),
+        'RESULT_CACHE_FOLDER': str(tmp_path / 'results'),
+        'ALLOCATION_JOB_FOLDER': str(tmp_path / 'jobs'),
+        'LOG_DIR': str(tmp_path / 'logs'),
+    })
+    init_db(app)
+    restriction_cache.clear()
+    return app
+
+
+def upload(client, route, name):
+    with open(os.path.join(XLSX, name), 'rb') as f:
+        response = client.post(route, data={'file': (f, name)}, content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['upload_id']
+
+
+def test_importing_the_app_leaves_pandas_and_openpyxl_unloaded(tmp_path):
+    script = "import sys, app; print('pandas' in sys.modules, 'openpyxl' in sys.modules)"
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=tmp_path, text=True,
+                                     env={**os.environ, 'PYTHONPATH': BACKEND})
+    assert output.split() == ['False', 'False']
+
+
+def test_factory_app_serves_after_init_db(app):
+    client = app.test_client()
+    response = client.post('/allocate', json={'stock_source': 'ledger'})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Stock ledger is empty, please upload a stock file first"}
+    assert client.get('/metrics').status_code == 200
+
+
+def test_unchanged_allocations_are_cached_and_revalidated(app):
+    client = app.test_client()
+    body = {
+        'stock_id': upload(client, '/upload_stock', 'StockAllocation.xlsx'),
+        'orders_id': upload(client, '/upload_orders', 'OrdersAllocation.xlsx'),
+    }
+
+    first = client.post('/allocate', json=body)
+    assert first.status_code == 200 and first.headers['ETag']
+    assert 'allocation;' in first.headers['Server-Timing']
+
+    again = client.post('/allocate', json=body)
+    assert again.data == first.data
+    assert again.headers['ETag'] == first.headers['ETag']
+    assert 'allocation;' not in again.headers['Server-Timing']
+
+    revalidated = client.post('/allocate', json=body, headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+
+    # The optimal engine's result depends on its time budget and the machine's speed
+    optimal = client.post('/allocate', json={**body, 'engine': 'optimal'})
+    assert optimal.status_code == 200 and 'ETag' not in optimal.headers
+    assert 'allocation;' in client.post('/allocate', json={**body, 'engine': 'optimal'}).headers['Server-Timing']
+
+    # Another engine, or a restriction change, is another result
+    assert client.post('/allocate', json={**body, 'engine': 'vectorized'}).headers['ETag'] != first.headers['ETag']
+    with app.app_context():
+        set_restrictions("default", {"origin": ["Peru"], "quality": ["Good Q/S"], "variety": ["LEGACY"]})
+    changed = client.post('/allocate', json=body, headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != first.headers['ETag']
+
+    # Async jobs share the cache, and a fresh worker finds results on disk
+    other = create_app({key: app.config[key] for key in
+                        ('SQLALCHEMY_DATABASE_URI', 'UPLOAD_STORE_FOLDER', 'SNAPSHOT_FOLDER', 'RESULT_CACHE_FOLDER',
+                         'ALLOCATION_JOB_FOLDER', 'LOG_DIR')}).test_client()
+    job = other.post('/allocate', json={**body, 'async': True}).get_json()
+    for _ in range(100):
+        status = other.get(job['status_url']).get_json()
+        if status['status'] == 'completed':
+            break
+        time.sleep(0.02)
+    assert status['result'] == changed.get_json()
+    # Any worker sharing the job folder can report the job
+    assert client.get(job['status_url']).get_json() == status
+    assert 'allocation;' not in other.post('/allocate', json=body).headers['Server-Timing']
+
+
+def test_failed_ledger_load_keeps_no_snapshot(app, monkeypatch):
+    import stock_ledger
+    client = app.test_client()
+    load_stock = stock_ledger.load_stock
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(stock_ledger, 'load_stock', fail)
+    with open(os.path.join(XLSX, 'StockAllocation.xlsx'), 'rb') as f:
+        response = client.post('/upload_stock', data={'file': (f, 'StockAllocation.xlsx')},
+                               content_type='multipart/form-data')
+    assert response.status_code == 500
+    assert os.listdir(app.config['SNAPSHOT_FOLDER']) == []
+
+    # The same file again loads the ledger rather than trusting a snapshot
+    monkeypatch.setattr(stock_ledger, 'load_stock', load_stock)
+    upload_id = upload(client, '/upload_stock', 'StockAllocation.xlsx')
+    with app.app_context():
+        assert stock_ledger.ledger_upload_id() == upload_id
+
+
+def test_exports_end_with_an_error_row_and_leave_no_workbook_behind(app, monkeypatch, tmp_path):
+    import app as app_module
+    from allocation_logic import ValidationError
+    client = app.test_client()
+    body = {
+        'stock_id': upload(client, '/upload_stock', 'StockAllocation.xlsx'),
+        'orders_id': upload(client, '/upload_orders', 'OrdersAllocation.xlsx'),
+    }
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'exports')
+    os.makedirs(app.config['UPLOAD_FOLDER'])
+
+    # A client that disconnects before reading the workbook still gets it removed
+    response = client.post('/allocate/export?format=xlsx', json=body, buffered=False)
+    assert response.status_code == 200
+    assert len(os.listdir(app.config['UPLOAD_FOLDER'])) == 1
+    response.close()
+    assert os.listdir(app.config['UPLOAD_FOLDER']) == []
+
+    start_allocation = app_module.start_allocation
+
+    def failing_allocation(inputs):
+        results = start_allocation(inputs)
+        yield next(results)
+        raise ValidationError("Stock changed during allocation")
+
+    monkeypatch.setattr(app_module, 'start_allocation', failing_allocation)
+    rows = client.post('/allocate/export?format=csv', json=body).get_data(as_text=True).splitlines()
+    assert rows[0].startswith('Sales Document,')
+    assert len(rows) > 2
+    assert rows[-1] == 'error,Stock changed during allocation'
@@ -0,0 +1,48 @@
+import csv
+import io
+import sys
+import os
+
+from openpyxl import load_workbook
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+import export
+from allocation_logic import iter_allocations
+from export import EXPORT_COLUMNS, iter_csv, iter_file, remove_file, write_xlsx
+from test_stock_pool import make_stock, make_orders
+
+
+def expected_rows(stock_df, orders):
+    rows = []
+    for sales_doc, result in iter_allocations(stock_df, orders, {}):
+        for line in result['batches'] or [None]:
+            rows.append((sales_doc, result['status'], line['batch'] if line else None))
+    return rows
+
+
+def test_csv_export_has_one_row_per_batch_line(monkeypatch):
+    monkeypatch.setattr(export, 'CSV_FLUSH_ROWS', 7)
+    stock_df = make_stock(rows=60)
+    orders = make_orders(count=40)
+    blocks = list(iter_csv(iter_allocations(stock_df, orders, {})))
+    assert len(blocks) > 2
+
+    rows = list(csv.reader(io.StringIO(''.join(blocks))))
+    assert rows[0] == EXPORT_COLUMNS
+    assert [(r[0], r[1], r[3] or None) for r in rows[1:]] == expected_rows(stock_df, orders)
+
+
+def test_xlsx_export_round_trips(tmp_path):
+    stock_df = make_stock(rows=60)
+    orders = make_orders(count=40)
+    path = write_xlsx(iter_allocations(stock_df, orders, {}), str(tmp_path))
+
+    content = b''.join(iter_file(path))
+    remove_file(path)
+    assert not os.path.exists(path)
+    sheet = load_workbook(io.BytesIO(content)).active
+    rows = list(sheet.iter_rows(values_only=True))
+    assert list(rows[0]) == EXPORT_COLUMNS
+    assert [(str(r[0]), r[1], r[3]) for r in rows[1:]] == expected_rows(stock_df, orders)
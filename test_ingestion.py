@@ -0,0 +1,164 @@
+import sys
+import os
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from allocation_logic import allocate_fruits
+from ingestion import (STOCK_PROJECTED_COLUMNS, STOCK_REQUIRED_COLUMNS, read_orders_excel, read_orders_file,
+                       read_stock_excel, read_stock_file)
+from upload_cache import normalize_orders_frame, normalize_stock_frame
+from validation import UploadValidationError
+
+
+def test_streamed_stock_matches_full_read():
+    streamed = read_stock_excel('xlsx/StockAllocation.xlsx', chunk_size=37)
+    full = normalize_stock_frame(pd.read_excel('xlsx/StockAllocation.xlsx'))[STOCK_PROJECTED_COLUMNS]
+    assert list(streamed.columns) == STOCK_PROJECTED_COLUMNS
+    assert 'BL/AWB/CMR' not in streamed.columns
+    assert streamed['Stock Weight'].tolist() == full['Stock Weight'].tolist()
+    assert streamed['Batch Number'].tolist() == full['Batch Number'].tolist()
+    assert streamed['Real Stock Age'].tolist() == full['Real Stock Age'].tolist()
+    # The sheet repeats the Supplier header; the first column is the one read
+    assert streamed['Supplier'].tolist() == full['Supplier'].tolist()
+
+
+def test_streamed_orders_match_full_read():
+    streamed = read_orders_excel('xlsx/OrdersAllocation.xlsx', chunk_size=10)
+    full = normalize_orders_frame(pd.read_excel('xlsx/OrdersAllocation.xlsx'))
+    assert streamed.to_dict('records') == full.to_dict('records')
+
+
+def test_every_row_error_is_reported(tmp_path):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['Loading Date', 'Sales Document Item', 'Sales Document', 'Order',
+                  'Sold-to Party', 'Description material', 'Quantity KG'])
+    for i in range(10):
+        quantity = {2: None, 7: -5, 8: 'lots'}.get(i, 100)
+        sheet.append(['soon' if i == 5 else None, 10, 1000 + i, None, 'C1', 'FIARGRN', quantity])
+    path = tmp_path / 'orders.xlsx'
+    workbook.save(path)
+
+    with pytest.raises(UploadValidationError, match=r"negative \(row 9\)") as excinfo:
+        read_orders_excel(str(path), chunk_size=4)
+    assert excinfo.value.total == 4
+    assert excinfo.value.errors == [
+        {"row": 4, "column": "Quantity KG", "error": "cannot be empty"},
+        {"row": 7, "column": "Loading Date", "error": "is not a date"},
+        {"row": 9, "column": "Quantity KG", "error": "cannot be negative"},
+        {"row": 10, "column": "Quantity KG", "error": "is not a number"},
+    ]
+
+
+def test_repeated_batch_numbers_are_reported(tmp_path):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(STOCK_REQUIRED_COLUMNS)
+    for i in range(12):
+        row = {column: None for column in STOCK_REQUIRED_COLUMNS}
+        row.update({'Batch Number': f"B{i % 10}", 'Stock Weight': '12 kg' if i != 3 else '12 lb',
+                    'Material ID': 'FIARGRN', 'Real Stock Age': 4})
+        sheet.append([row[column] for column in STOCK_REQUIRED_COLUMNS])
+    path = tmp_path / 'stock.xlsx'
+    workbook.save(path)
+
+    with pytest.raises(UploadValidationError) as excinfo:
+        read_stock_excel(str(path), chunk_size=5)
+    assert [(e["row"], e["error"]) for e in excinfo.value.errors] == [
+        (2, "repeats B0"), (3, "repeats B1"), (5, "is not a weight in KG"), (12, "repeats B0"), (13, "repeats B1")
+    ]
+
+
+def test_missing_columns_are_reported(tmp_path):
+    workbook = Workbook()
+    workbook.active.append(['Batch Number', 'Stock Weight'])
+    path = tmp_path / 'stock.xlsx'
+    workbook.save(path)
+
+    with pytest.raises(ValueError, match="Missing required columns in stock file"):
+        read_stock_excel(str(path))
+
+
+def export_samples(tmp_path, file_format):
+    """Write the sample workbooks in another upload format."""
+    paths = []
+    for name in ('StockAllocation', 'OrdersAllocation'):
+        df = pd.read_excel(f'xlsx/{name}.xlsx')
+        path = tmp_path / f'{name}.{file_format}'
+        if file_format == 'csv':
+            df.to_csv(path, index=False)
+        elif file_format == 'json':
+            df.to_json(path, orient='records', date_format='iso')
+        else:
+            df.to_parquet(path, index=False)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'json', 'parquet'])
+def test_other_formats_allocate_like_the_workbooks(tmp_path, file_format):
+    if file_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    stock_path, orders_path = export_samples(tmp_path, file_format)
+    stock = read_stock_file(stock_path, chunk_size=50)
+    orders = read_orders_file(orders_path, chunk_size=10)
+    expected_stock = read_stock_excel('xlsx/StockAllocation.xlsx')
+    expected_orders = read_orders_excel('xlsx/OrdersAllocation.xlsx')
+
+    assert list(stock.columns) == STOCK_PROJECTED_COLUMNS
+    assert stock['Stock Weight'].tolist() == expected_stock['Stock Weight'].tolist()
+    assert orders.to_dict('records') == expected_orders.to_dict('records')
+    records = orders.to_dict('records')
+    assert (allocate_fruits(stock, records, {"origin": ["Chile"]})
+            == allocate_fruits(expected_stock, records, {"origin": ["Chile"]}))
+
+
+def test_csv_rows_are_validated(tmp_path):
+    path = tmp_path / 'orders.csv'
+    lines = ['Loading Date,Sales Document Item,Sales Document,Order,Sold-to Party,Description material,Quantity KG']
+    rows = [f'2025-03-1{i},10,00{i},,C1,FIARGRN,{"-1" if i == 3 else "5"}' for i in range(6)]
+    path.write_text('\n'.join(lines + rows) + '\n')
+
+    with pytest.raises(UploadValidationError, match=r"negative \(row 5\)"):
+        read_orders_file(str(path), chunk_size=2)
+    # Identifiers stay text, leading zeros included
+    path.write_text('\n'.join(lines + rows[:3]) + '\n')
+    assert read_orders_file(str(path))['sales_document'].tolist()[:2] == ['000', '001']
+
+
+@pytest.mark.parametrize('file_format', ['xlsx', 'csv', 'json'])
+def test_errors_after_blank_rows_keep_their_file_row(tmp_path, file_format):
+    rows = [{'Batch Number': 'B0', 'Stock Weight': '12 kg'}, {}, {},
+            {'Batch Number': 'B1', 'Stock Weight': '12 lb'}, {}, {'Batch Number': 'B0', 'Stock Weight': '3 kg'}]
+    df = pd.DataFrame([{column: row.get(column) for column in STOCK_REQUIRED_COLUMNS} for row in rows])
+    path = tmp_path / f'stock.{file_format}'
+    if file_format == 'xlsx':
+        workbook = Workbook()
+        workbook.active.append(STOCK_REQUIRED_COLUMNS)
+        for record in df.itertuples(index=False):
+            workbook.active.append(list(record))
+        workbook.save(path)
+    elif file_format == 'csv':
+        df.to_csv(path, index=False)
+    else:
+        df.to_json(path, orient='records')
+
+    with pytest.raises(UploadValidationError) as excinfo:
+        read_stock_file(str(path), chunk_size=2)
+    # Sheet and CSV rows count the header; JSON records count from 1
+    first = 2 if file_format in ('xlsx', 'csv') else 1
+    assert [(e["row"] - first, e["error"]) for e in excinfo.value.errors] == [
+        (0, "repeats B0"), (3, "is not a weight in KG"), (5, "repeats B0")
+    ]
+
+
+def test_json_must_be_an_array_of_rows(tmp_path):
+    path = tmp_path / 'stock.json'
+    path.write_text('{"Batch Number": "B1"}')
+    with pytest.raises(ValueError, match="array of objects"):
+        read_stock_file(str(path))
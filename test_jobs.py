@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from allocation_logic import allocate_fruits
+from jobs import JobManager
+from test_stock_pool import make_stock, make_orders
+
+
+def wait_for(job, timeout=10):
+    deadline = time.time() + timeout
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_job_reports_progress_and_result():
+    manager = JobManager(max_workers=1)
+    stock_df, orders = make_stock(), make_orders()
+    seen = []
+
+    def work(progress):
+        def track(processed):
+            seen.append(processed)
+            progress(processed)
+        return {"allocation": allocate_fruits(stock_df, orders, {}, progress=track)}
+
+    job = wait_for(manager.submit(work, total=len(orders)))
+
+    assert job.status == 'completed'
+    assert job.processed == len(orders)
+    assert seen == list(range(len(orders) + 1))
+    assert job.to_dict()["result"]["allocation"] == allocate_fruits(stock_df, orders, {})
+    assert manager.get(job.id) is job
+
+
+def test_failed_job_keeps_error_and_old_jobs_are_pruned():
+    manager = JobManager(max_workers=1, max_finished=2)
+
+    def fail(progress):
+        raise ValueError("boom")
+
+    jobs = [wait_for(manager.submit(fail, total=0)) for _ in range(3)]
+    manager.submit(lambda progress: {}, total=0)
+
+    assert jobs[-1].status == 'failed'
+    assert jobs[-1].to_dict()["error"] == "boom"
+    assert "result" not in jobs[-1].to_dict()
+    assert manager.get(jobs[0].id) is None
+
+
+def test_finished_jobs_always_show_their_result_and_finish_time():
+    manager = JobManager(max_workers=2)
+    for _ in range(50):
+        job = manager.submit(lambda progress: {"allocation": {}}, total=0)
+        while True:
+            data = job.to_dict()
+            if data["status"] in ('completed', 'failed'):
+                break
+        assert data["status"] == 'completed'
+        assert data["result"] == {"allocation": {}}
+        assert data["finished_at"] is not None
+
+
+def test_jobs_are_visible_to_every_manager_sharing_the_folder(tmp_path):
+    worker, other = JobManager(max_workers=1, folder=str(tmp_path)), JobManager(folder=str(tmp_path))
+    stock_df, orders = make_stock(rows=50), make_orders(count=20)
+    job = wait_for(worker.submit(lambda progress: {"allocation": allocate_fruits(stock_df, orders, {}, progress=progress)},
+                                 total=len(orders)))
+
+    seen = other.get(job.id)
+    assert seen is not job
+    assert seen.to_dict() == job.to_dict()
+    assert seen.to_dict()["result"]["allocation"] == allocate_fruits(stock_df, orders, {})
+    assert other.get("0" * 32) is None
+    assert other.get("../" + job.id) is None
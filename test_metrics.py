@@ -0,0 +1,54 @@
+import sys
+import os
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+import metrics
+from allocation_logic import allocate_fruits
+from test_stock_pool import make_stock, make_orders
+
+
+def test_allocation_reports_phases_and_counters():
+    stock_df = make_stock(rows=200)
+    orders = make_orders(count=40)
+    for engine in ('pool', 'vectorized'):
+        token = metrics.start_request()
+        try:
+            allocation = allocate_fruits(stock_df, orders, {}, engine=engine)
+            timing = metrics.current_timing()
+        finally:
+            metrics.finish_request(token)
+
+        touched = sum(len(result['batches']) for result in allocation.values())
+        assert 'allocation' in timing.phases
+        assert timing.counters['orders'] == 40
+        assert timing.counters['stock_batches'] == 200
+        assert timing.counters['batches_touched'] == touched
+        assert timing.counters['batches_scanned'] >= touched > 0
+
+
+def test_phases_are_noops_outside_a_request():
+    assert metrics.current_timing() is None
+    with metrics.phase('allocation'):
+        metrics.count('orders', 3)
+    assert metrics.current_timing() is None
+
+
+def test_server_timing_and_prometheus_rendering():
+    timing = metrics.RequestTiming()
+    timing.add_phase('excel_parse', 0.02)
+    timing.add_phase('excel_parse', 0.01)
+    timing.count('stock_rows', 120)
+    header = timing.server_timing()
+    assert header.startswith('excel_parse;dur=30.0, stock_rows;desc="120", total;dur=')
+
+    registry = metrics.MetricsRegistry()
+    registry.record('POST', '/upload_stock', 200, timing)
+    registry.record('POST', '/upload_stock', 200, timing)
+    text = registry.render()
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert 'http_request_duration_seconds_count{method="POST",route="/upload_stock",status="200"} 2' in text
+    assert 'request_phase_duration_seconds_bucket{route="/upload_stock",phase="excel_parse",le="0.05"} 2' in text
+    assert 'request_phase_duration_seconds_bucket{route="/upload_stock",phase="excel_parse",le="0.025"} 0' in text
+    assert 'request_items_total{route="/upload_stock",item="stock_rows"} 240' in text
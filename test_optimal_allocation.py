@@ -0,0 +1,107 @@
+import random
+import sys
+import os
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from allocation_logic import allocate_fruits, to_grams
+from optimal_allocation import optimize_allocation
+from test_stock_pool import make_stock, make_orders
+
+CUSTOMER_RESTRICTIONS = {"C1": {"origin": ["Chile"]}, "C2": {"quality": ["Good Q/S", "Fair M/C"]}}
+
+
+def make_customer_orders(count, seed=11):
+    rng = random.Random(seed)
+    orders = make_orders(count=count, seed=seed)
+    for order in orders:
+        order["sold_to_party"] = rng.choice(["C1", "C2", "C3"])
+    return orders
+
+
+def test_serves_the_restricted_order_greedy_strands():
+    stock_df = make_stock(rows=2)
+    stock_df["Material ID"] = "FIARGRN"
+    stock_df["Stock Weight"] = ["100.000 KG", "100.000 KG"]
+    stock_df["Origin Country"] = ["Chile", "Peru"]
+    stock_df["Real Stock Age"] = [1, 5]
+    orders = [
+        {"sales_document": "ANY", "sold_to_party": "C3", "description_material": "FIARGRN", "quantity": 100},
+        {"sales_document": "CHILE", "sold_to_party": "C1", "description_material": "FIARGRN", "quantity": 100},
+    ]
+
+    greedy = allocate_fruits(stock_df, orders, {}, customer_restrictions=CUSTOMER_RESTRICTIONS)
+    assert greedy["CHILE"]["status"] == "unfulfilled"
+
+    results, report = optimize_allocation(stock_df, orders, {}, CUSTOMER_RESTRICTIONS)
+    results = dict(results)
+    assert results["ANY"]["status"] == results["CHILE"]["status"] == "fully_allocated"
+    assert [line["batch"] for line in results["CHILE"]["batches"]] == ["B00000"]
+    assert report["status"] == "optimal"
+    assert report["improvement"]["allocated_kg"] == 100
+    assert report["improvement"]["fully_allocated_orders"] == 1
+
+
+def test_younger_stock_is_not_bought_with_more_split_batches():
+    stock_df = make_stock(rows=3)
+    stock_df["Material ID"] = "FIARGRN"
+    stock_df["Stock Weight"] = ["100.000 KG", "100.000 KG", "100.000 KG"]
+    stock_df["Origin Country"] = ["Chile", "Peru", "Chile"]
+    stock_df["Real Stock Age"] = [1, 2, 9]
+    orders = [
+        {"sales_document": "ANY", "sold_to_party": "C3", "description_material": "FIARGRN", "quantity": 100},
+        {"sales_document": "CHILE", "sold_to_party": "C1", "description_material": "FIARGRN", "quantity": 50},
+    ]
+
+    # Serving CHILE from the youngest batch is cheaper in age, but splits ANY over two batches
+    results, report = optimize_allocation(stock_df, orders, {}, CUSTOMER_RESTRICTIONS)
+    assert report["improvement"]["allocated_kg"] == 0
+    assert report["improvement"]["batch_lines"] <= 0
+    assert dict(results) == allocate_fruits(stock_df, orders, {}, customer_restrictions=CUSTOMER_RESTRICTIONS)
+
+
+def test_respects_stock_and_restrictions_and_never_loses_to_greedy():
+    stock_df = make_stock(rows=150)
+    orders = make_customer_orders(120)
+    greedy = allocate_fruits(stock_df, orders, {}, customer_restrictions=CUSTOMER_RESTRICTIONS)
+
+    for time_budget in (0, 30):
+        results, report = optimize_allocation(stock_df, orders, {}, CUSTOMER_RESTRICTIONS, time_budget)
+        assert [doc for doc, _ in results] == list(greedy)
+        assert report["optimized"]["allocated_kg"] >= report["greedy"]["allocated_kg"]
+        if report["improvement"]["allocated_kg"] == 0:
+            assert report["improvement"]["batch_lines"] <= 0
+
+        rows = stock_df.set_index("Batch Number")
+        drawn = {}
+        for order, (_, result) in zip(orders, results):
+            if result["status"] == "error":
+                continue
+            assert to_grams(result["weight"]) <= to_grams(order["quantity"])
+            allowed = CUSTOMER_RESTRICTIONS.get(order["sold_to_party"], {})
+            for line in result["batches"]:
+                batch = rows.loc[line["batch"]]
+                assert batch["Material ID"] in order["description_material"]
+                assert line["origin"] in allowed.get("origin", [line["origin"]])
+                assert line["quality"] in allowed.get("quality", [line["quality"]])
+                drawn[line["batch"]] = drawn.get(line["batch"], 0) + to_grams(line["weight"])
+        for batch, grams in drawn.items():
+            assert grams <= to_grams(rows.loc[batch, "Stock Weight"].split()[0])
+
+
+def test_spent_budget_keeps_greedy_draws_for_the_remaining_materials():
+    stock_df = make_stock(rows=600)
+    orders = make_customer_orders(400)
+    results, report = optimize_allocation(stock_df, orders, {}, CUSTOMER_RESTRICTIONS, time_budget=0)
+    assert report["status"] == "time_budget_exceeded"
+    assert dict(results) == allocate_fruits(stock_df, orders, {}, engine='vectorized',
+                                            customer_restrictions=CUSTOMER_RESTRICTIONS)
+
+
+def test_optimal_engine_through_allocate_fruits():
+    stock_df = make_stock(rows=80)
+    orders = make_orders(count=40)
+    results = allocate_fruits(stock_df, orders, {}, engine='optimal')
+    expected, _ = optimize_allocation(stock_df, orders, {})
+    assert results == dict(expected)
@@ -0,0 +1,64 @@
+import sys
+import os
+import threading
+
+import pytest
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from allocation_logic import ValidationError, allocate_fruits
+from parallel_allocation import get_executor, partition_orders
+from test_stock_pool import make_stock, make_orders
+
+
+def test_partitions_keep_materials_together():
+    orders = make_orders(count=60)
+    partitions = partition_orders(orders, 3)
+    assert sorted(p for partition in partitions for p in partition) == list(range(60))
+    materials = [{orders[p]['description_material'].split()[0] for p in partition} for partition in partitions]
+    for i, first in enumerate(materials):
+        for second in materials[i + 1:]:
+            assert not first & second
+
+
+def test_parallel_run_matches_serial_run():
+    stock_df = make_stock(rows=300)
+    orders = make_orders(count=120)
+    # Repeated sales documents and orders that are skipped or fail must merge as serially
+    orders[5]['sales_document'] = orders[90]['sales_document']
+    orders[7]['description_material'] = ''
+    orders[9]['quantity'] = 'n/a'
+    restrictions = {"origin": ["Chile", "Peru"]}
+    for engine in ('pool', 'vectorized', 'optimal'):
+        expected = allocate_fruits(stock_df, orders, restrictions, engine=engine)
+        processed = []
+        results = allocate_fruits(stock_df, orders, restrictions, engine=engine, workers=3,
+                                  progress=processed.append)
+        assert results == expected
+        assert list(results) == list(expected)
+        assert processed[-1] == len(orders)
+
+
+def test_parallel_run_rejects_bad_stock_weights():
+    stock_df = make_stock(rows=30)
+    stock_df.loc[4, 'Stock Weight'] = 'heavy'
+    with pytest.raises(ValidationError):
+        allocate_fruits(stock_df, make_orders(count=20), {}, workers=2)
+
+
+def test_runs_from_threads_share_one_worker_pool():
+    stock_df = make_stock(rows=100)
+    orders = make_orders(count=40)
+    expected = allocate_fruits(stock_df, orders, {})
+    executor = get_executor(2)
+    results = []
+    # Job threads hand their runs to the pool rather than forking themselves
+    threads = [threading.Thread(target=lambda: results.append(allocate_fruits(stock_df, orders, {}, workers=2)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [expected] * 3
+    assert get_executor(2) is executor
@@ -0,0 +1,89 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+from sqlalchemy import event
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from allocation_logic import allocate_fruits
+from database import db
+from restrictions import (Restriction, delete_restrictions, get_restrictions, get_restrictions_for_customers,
+                          restriction_cache, set_restrictions)
+from test_stock_pool import make_stock, make_orders
+
+
+@pytest.fixture
+def app_context():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    db.init_app(app)
+    restriction_cache.clear()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def count_selects():
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def test_bulk_lookup_uses_one_query(app_context):
+    set_restrictions("default", {"origin": ["Chile"]})
+    set_restrictions("10054809", {"origin": ["Peru"], "quality": ["Fair M/C"]})
+    set_restrictions("C2 (FULL NAME)", {"variety": ["LEGACY"]})
+
+    statements = count_selects()
+    default, resolved = get_restrictions_for_customers(
+        ["10054809 (SOFRUCE)", "C2 (FULL NAME)", "C3 (NO ROW)", "10054809 (SOFRUCE)"]
+    )
+
+    assert len([s for s in statements if 'FROM restriction ' in s]) == 1
+    assert default["origin"] == ["Chile"]
+    assert resolved["10054809 (SOFRUCE)"]["origin"] == ["Peru"]
+    assert resolved["C2 (FULL NAME)"]["variety"] == ["LEGACY"]
+    assert "C3 (NO ROW)" not in resolved
+
+
+def test_reads_are_cached_until_the_version_changes(app_context):
+    set_restrictions("C1", {"origin": ["Peru"]})
+    assert get_restrictions("C1")["origin"] == ["Peru"]
+
+    statements = count_selects()
+    assert get_restrictions("C1")["origin"] == ["Peru"]
+    assert get_restrictions("C9")["origin"] == ["Chile"]
+    assert get_restrictions("C9")["origin"] == ["Chile"]
+    assert len([s for s in statements if 'FROM restriction ' in s]) == 1
+
+    # Another worker edits the row and bumps the shared version without touching this cache
+    Restriction.query.filter_by(customer_id="C1").update({"origin": "Morocco"})
+    db.session.execute(db.text("UPDATE restriction_version SET version = version + 1"))
+    db.session.commit()
+    assert get_restrictions("C1")["origin"] == ["Morocco"]
+
+    delete_restrictions("C1")
+    assert get_restrictions("C1")["origin"] == ["Chile"]
+
+
+def test_orders_use_their_customer_restrictions():
+    stock_df = make_stock()
+    orders = make_orders()
+    for i, order in enumerate(orders):
+        order["sold_to_party"] = "PERU" if i % 2 else "CHILE"
+    per_customer = {"PERU": {"origin": ["Peru"]}}
+    default = {"origin": ["Chile"]}
+
+    for engine in ('pool', 'vectorized'):
+        results = allocate_fruits(stock_df, orders, default, engine=engine, customer_restrictions=per_customer)
+        origins = dict(zip(stock_df['Batch Number'], stock_df['Origin Country']))
+        for order in orders:
+            expected = "Peru" if order["sold_to_party"] == "PERU" else "Chile"
+            for line in results[order["sales_document"]]["batches"]:
+                assert origins[line["batch"]] == expected
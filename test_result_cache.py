@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from result_cache import ResultCache, result_key
+
+
+def test_key_depends_on_every_part_but_not_their_order():
+    key = result_key(stock_id="a", orders_id="b", engine="pool", horizon_days=None)
+    assert key == result_key(engine="pool", horizon_days=None, orders_id="b", stock_id="a")
+    assert key != result_key(stock_id="a", orders_id="b", engine="pool", horizon_days=7)
+    assert len(key) == 64
+
+
+def test_memory_is_a_bounded_lru():
+    cache = ResultCache(max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    # b was least recently used
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (b"aaaa", b"cccc")
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None
+
+
+def test_disk_is_shared_and_trimmed_least_recently_used_first(tmp_path):
+    writer = ResultCache(max_bytes=100, folder=str(tmp_path), max_disk_bytes=10)
+    reader = ResultCache(max_bytes=100, folder=str(tmp_path), max_disk_bytes=10)
+    writer.put("a", b"aaaa")
+    writer.put("b", b"bbbb")
+    assert reader.get("a") == b"aaaa"
+
+    old = time.time() - 60
+    os.utime(tmp_path / "b.json", (old, old))
+    writer.put("c", b"cccc")
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "c.json"]
+    assert ResultCache(max_bytes=100, folder=str(tmp_path)).get("b") is None
+
+    writer.clear()
+    assert os.listdir(tmp_path) == []
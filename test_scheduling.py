@@ -0,0 +1,65 @@
+import sys
+import os
+from datetime import date
+
+import pytest
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from allocation_logic import ValidationError, allocate_fruits
+from scheduling import schedule_orders
+from test_stock_pool import make_stock
+
+TODAY = date(2025, 3, 10)
+
+
+def make_dated_orders():
+    return [
+        {"sales_document": "A", "loading_date": "2025-03-14", "description_material": "FIARGRN", "quantity": 100},
+        {"sales_document": "B", "loading_date": None, "description_material": "FIARGRN", "quantity": 900},
+        {"sales_document": "C", "loading_date": "2025-03-11", "description_material": "FIARGRN", "quantity": 200},
+        {"sales_document": "D", "loading_date": "2025-03-11", "description_material": "FIARGRN", "quantity": 700},
+        {"sales_document": "E", "loading_date": "2025-03-08", "description_material": "FIARGRN", "quantity": 50},
+    ]
+
+
+def documents(orders):
+    return [order['sales_document'] for order in orders]
+
+
+def test_orders_come_out_by_loading_date():
+    orders = make_dated_orders()
+    assert documents(schedule_orders(orders)) == ['E', 'C', 'D', 'A', 'B']
+    assert documents(schedule_orders(orders, tie_break='largest_first')) == ['E', 'D', 'C', 'A', 'B']
+    assert documents(schedule_orders(orders, priority='sheet')) == ['A', 'B', 'C', 'D', 'E']
+
+
+def test_horizon_leaves_later_and_undated_orders_out():
+    orders = make_dated_orders()
+    assert documents(schedule_orders(orders, horizon_days=1, today=TODAY)) == ['E', 'C', 'D']
+    assert documents(schedule_orders(orders, horizon_days=4, today=TODAY)) == ['E', 'C', 'D', 'A']
+    assert documents(schedule_orders(orders, priority='sheet', horizon_days=4, today=TODAY)) == ['A', 'C', 'D', 'E']
+
+
+def test_earlier_loadings_get_stock_first():
+    stock_df = make_stock(rows=1)
+    stock_df['Material ID'] = 'FIARGRN'
+    stock_df['Stock Weight'] = '300.000 KG'
+    orders = [dict(order, quantity=300) for order in make_dated_orders()]
+
+    by_date = allocate_fruits(stock_df, schedule_orders(orders), {})
+    assert by_date['E']['status'] == 'fully_allocated'
+    assert by_date['A']['status'] == 'unfulfilled'
+
+    by_sheet = allocate_fruits(stock_df, schedule_orders(orders, priority='sheet'), {})
+    assert by_sheet['A']['status'] == 'fully_allocated'
+
+
+def test_invalid_schedule_options():
+    with pytest.raises(ValidationError):
+        schedule_orders(make_dated_orders(), priority='customer')
+    with pytest.raises(ValidationError):
+        schedule_orders(make_dated_orders(), tie_break='random')
+    with pytest.raises(ValidationError):
+        schedule_orders(make_dated_orders(), horizon_days=-1)
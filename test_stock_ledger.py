@@ -0,0 +1,170 @@
+import os
+import random
+import sys
+
+import pandas as pd
+import pytest
+from flask import Flask
+from sqlalchemy import event
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from allocation_logic import ValidationError, allocate_fruits
+from database import db
+from ingestion import read_stock_file
+from stock_ledger import (StockLoad, StockRecord, apply_stock_delta, ledger_upload_id, load_stock, query_stock,
+                          stock_for_orders)
+from test_stock_pool import make_stock, make_orders
+
+CUSTOMER_RESTRICTIONS = {"C1": {"origin": ["Chile", "Peru"]}, "C2": {"quality": ["Good Q/S"], "ggn": "4063061591012"}}
+
+
+@pytest.fixture
+def app_context():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def make_customer_orders(count=80, seed=11):
+    rng = random.Random(seed)
+    orders = make_orders(count=count, seed=seed)
+    for order in orders:
+        order["sold_to_party"] = rng.choice(["C1", "C2", "C3"])
+    return orders
+
+
+def test_load_uses_one_executemany_per_chunk(app_context, monkeypatch):
+    monkeypatch.setattr('stock_ledger.LEDGER_INSERT_CHUNK_SIZE', 100)
+    inserts = []
+    event.listen(db.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, parameters, context, executemany:
+                 inserts.append(executemany) if statement.startswith('INSERT INTO stock_batch') else None)
+
+    assert load_stock(make_stock(rows=250), "a" * 64)["inserted"] == 250
+    assert inserts == [True, True, True]
+    assert db.session.query(StockRecord).count() == 250
+    assert ledger_upload_id() == "a" * 64
+
+
+def test_reload_replaces_the_ledger(app_context):
+    load_stock(make_stock(rows=50, seed=1), "a" * 64)
+    load_stock(make_stock(rows=20, seed=2), "b" * 64)
+    assert db.session.query(StockRecord).count() == 20
+    assert ledger_upload_id() == "b" * 64
+
+
+def test_failed_load_keeps_the_previous_stock(app_context):
+    load_stock(make_stock(rows=30), "a" * 64)
+    bad = make_stock(rows=10)
+    bad.loc[5, 'Stock Weight'] = "heavy"
+    with pytest.raises(ValidationError):
+        load_stock(bad, "b" * 64)
+    assert db.session.query(StockRecord).count() == 30
+    assert ledger_upload_id() == "a" * 64
+
+
+def test_ledger_stock_allocates_like_the_upload(app_context):
+    stock_df = make_stock()
+    stock_df.loc[::7, 'Q3: Reinspection Quality'] = None
+    orders = make_customer_orders()
+    load_stock(stock_df, "a" * 64)
+
+    restrictions = {"variety": ["LEGACY", "ROCIO"]}
+    candidates = stock_for_orders(orders, restrictions, CUSTOMER_RESTRICTIONS)
+    assert len(candidates) < len(query_stock()) == len(stock_df)
+    for engine in ('pool', 'vectorized'):
+        expected = allocate_fruits(stock_df, orders, restrictions, engine=engine,
+                                   customer_restrictions=CUSTOMER_RESTRICTIONS)
+        assert allocate_fruits(candidates, orders, restrictions, engine=engine,
+                               customer_restrictions=CUSTOMER_RESTRICTIONS) == expected
+
+
+def test_orders_without_candidates_are_unfulfilled(app_context):
+    load_stock(make_stock(rows=20), "a" * 64)
+    orders = [{"sales_document": "X", "description_material": "UNKNOWN", "quantity": 10}]
+    results = allocate_fruits(stock_for_orders(orders, {}), orders, {})
+    assert results["X"]["status"] == "unfulfilled"
+
+
+def test_empty_ledger_is_an_error(app_context):
+    with pytest.raises(ValidationError):
+        stock_for_orders(make_orders(count=3), {})
+
+
+def edit_stock(stock_df, seed):
+    """Change, drop, add and reorder a few rows, the way consecutive exports differ."""
+    rng = random.Random(seed)
+    edited = stock_df.copy()
+    for row in rng.sample(range(len(edited)), 10):
+        edited.loc[row, 'Stock Weight'] = f"{rng.randint(1, 500000) / 1000:.3f} KG"
+    edited = edited.drop(index=rng.sample(list(edited.index), 8))
+    added = make_stock(rows=6, seed=seed)
+    added['Batch Number'] = [f"N{seed}-{i}" for i in range(6)]
+    # A repeated key is matched by occurrence
+    added.loc[5, ['Batch Number', 'Origin Pallet Number']] = edited.iloc[0][['Batch Number', 'Origin Pallet Number']].tolist()
+    edited = pd.concat([edited, added], ignore_index=True)
+    order = list(range(len(edited)))
+    for _ in range(5):
+        i, j = rng.sample(order, 2)
+        order[i], order[j] = order[j], order[i]
+    return edited.iloc[order].reset_index(drop=True)
+
+
+def test_delta_matches_a_full_load(app_context):
+    stock_df = make_stock(rows=200)
+    load_stock(stock_df, "a" * 64)
+    for step in range(5):
+        stock_df = edit_stock(stock_df, seed=step)
+        changes = apply_stock_delta(stock_df, f"{step}" * 64)
+        assert changes["mode"] == "delta"
+        assert changes["inserted"] + changes["updated"] + changes["unchanged"] == len(stock_df)
+        delta_state = query_stock()
+        load_stock(stock_df, f"{step}" * 64)
+        pd.testing.assert_frame_equal(delta_state, query_stock())
+
+
+def test_delta_counts_and_touches_only_changed_rows(app_context):
+    stock_df = make_stock(rows=100)
+    load_stock(stock_df, "a" * 64)
+    edited = stock_df.copy()
+    edited.loc[10, 'Stock Weight'] = "1.000 KG"
+    edited = edited.drop(index=[50, 99])
+    edited = pd.concat([edited, make_stock(rows=1, seed=3).assign(**{'Batch Number': 'NEW'})], ignore_index=True)
+
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, parameters, context, executemany:
+                 statements.append((statement.split()[0], len(parameters) if executemany else 1)))
+    changes = apply_stock_delta(edited, "b" * 64)
+
+    assert (changes["inserted"], changes["updated"], changes["deleted"]) == (1, 1, 2)
+    assert changes["unchanged"] == 97
+    # Only the 48 rows after the dropped one moved up a position
+    assert ("UPDATE", 48) in statements
+    assert sum(count for verb, count in statements if verb == "INSERT") == 2
+    assert db.session.query(StockLoad).count() == 2
+    assert ledger_upload_id() == "b" * 64
+
+
+def test_the_same_sheet_in_another_format_changes_nothing(app_context, tmp_path):
+    load_stock(read_stock_file('xlsx/StockAllocation.xlsx'), "a" * 64)
+    sheet = pd.read_excel('xlsx/StockAllocation.xlsx')
+    # CSV reads every cell as text and JSON keeps numbers, where the workbook mixes both
+    sheet.to_csv(tmp_path / 'stock.csv', index=False)
+    sheet.to_json(tmp_path / 'stock.json', orient='records')
+    for name in ('stock.csv', 'stock.json'):
+        changes = apply_stock_delta(read_stock_file(str(tmp_path / name)), "b" * 64)
+        assert (changes["inserted"], changes["updated"], changes["deleted"]) == (0, 0, 0)
+        assert changes["unchanged"] == len(sheet)
+
+
+def test_delta_on_an_empty_ledger_is_a_full_load(app_context):
+    changes = apply_stock_delta(make_stock(rows=30), "a" * 64)
+    assert (changes["mode"], changes["inserted"]) == ("full", 30)
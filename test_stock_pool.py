@@ -0,0 +1,171 @@
+import random
+import sys
+import os
+
+import pandas as pd
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from allocation_logic import StockBatch, allocate_fruits, iter_allocations
+from encoding import StockEncoding
+from stock_pool import StockPool, material_code
+
+
+def make_stock(rows=300, seed=7):
+    rng = random.Random(seed)
+    records = []
+    for i in range(rows):
+        records.append({
+            "Location": "", "Batch Number": f"B{i:05d}",
+            "Stock Weight": f"{rng.randint(1, 1200000) / 1000:.3f} KG",
+            "Material ID": rng.choice(["FIARGRN", "FIARORG", "BCB03500PBNLBP"]),
+            "Real Stock Age": rng.randint(0, 20),
+            "Variety": rng.choice(["LEGACY", "BLUE RIBBON", "ROCIO"]),
+            "GGN": rng.choice(["4063061591012", "4059883818772"]),
+            "Origin Country": rng.choice(["Chile", "Peru", "Morocco"]),
+            "Q3: Reinspection Quality": rng.choice(["Good Q/S", "Fair M/C", "Poor M/C", None]),
+            "BL/AWB/CMR": "", "Allocation": "", "MinimumSize": rng.choice([12, 14]),
+            "Origin Pallet Number": f"FP{i:08d}",
+            "Supplier": rng.choice(["BERRY PACKING SERVICES BV", "HORTIFRUT CHILE S.A."]),
+        })
+    return pd.DataFrame(records)
+
+
+def make_orders(count=80, seed=11):
+    rng = random.Random(seed)
+    return [{
+        "sales_document": f"SD{i}",
+        "description_material": rng.choice(["FIARGRN", "FIARORG (BLUEBERRY ORG)", "BCB03500PBNLBP (BULK)", "UNKNOWN"]),
+        "quantity": rng.randint(0, 5000),
+    } for i in range(count)]
+
+
+def reference_allocation(stock_df, orders, restrictions):
+    """Straightforward rescan-every-batch FIFO allocation used as the oracle."""
+    batches = [StockBatch(row) for _, row in
+               stock_df.sort_values('Real Stock Age', kind='stable').iterrows()]
+    results = {}
+    for order in orders:
+        required = order['quantity'] * 1000
+        material = material_code(order['description_material'])
+        matching = sorted(
+            (b for b in batches
+             if b.weight_grams > 0 and b.material_id == material and b.matches_restrictions(restrictions)),
+            key=lambda b: b.age)
+        allocated = 0
+        lines = []
+        for batch in matching:
+            if allocated >= required:
+                break
+            take = min(required - allocated, batch.weight_grams)
+            allocated += take
+            batch.weight_grams -= take
+            lines.append((batch.batch_number, take / 1000))
+        results[order['sales_document']] = (allocated / 1000, lines)
+    return results
+
+
+def test_pool_matches_reference_allocation():
+    stock_df = make_stock()
+    orders = make_orders()
+    restrictions = {"origin": ["Chile", "Peru"], "quality": ["Good Q/S", "Fair M/C"]}
+
+    results = allocate_fruits(stock_df, orders, restrictions)
+    expected = reference_allocation(stock_df, orders, restrictions)
+
+    for sales_doc, (weight, lines) in expected.items():
+        assert results[sales_doc]['weight'] == weight
+        assert [(b['batch'], b['weight']) for b in results[sales_doc]['batches']] == lines
+
+
+def test_orders_only_receive_their_material():
+    stock_df = make_stock()
+    orders = make_orders()
+    results = allocate_fruits(stock_df, orders, {})
+    materials = dict(zip(stock_df['Batch Number'], stock_df['Material ID']))
+
+    for order in orders:
+        result = results[order['sales_document']]
+        for line in result['batches']:
+            assert materials[line['batch']] == material_code(order['description_material'])
+        if order['description_material'] == "UNKNOWN" and order['quantity'] > 0:
+            assert result['status'] == 'unfulfilled'
+
+
+def test_depleted_batches_leave_the_pool():
+    stock_df = make_stock(rows=20)
+    batches = [StockBatch(row) for _, row in stock_df.iterrows()]
+    pool = StockPool(batches)
+    for batch in pool.candidates("FIARGRN", {}):
+        batch.weight_grams = 0
+    assert list(pool.candidates("FIARGRN", {})) == []
+    assert pool.remaining_batches() == sum(1 for b in batches if b.material_id != "FIARGRN" and b.weight_grams > 0)
+
+
+def test_restriction_sets_sharing_buckets_see_each_others_draws():
+    stock_df = make_stock(rows=200)
+    batches = [StockBatch(row) for _, row in stock_df.sort_values('Real Stock Age', kind='stable').iterrows()]
+    pool = StockPool(batches)
+    broad, narrow = {}, {"origin": ["Chile"]}
+    rng = random.Random(3)
+
+    for round_ in range(40):
+        restrictions = broad if round_ % 2 else narrow
+        needed = rng.randint(1, 400000)
+        for batch in pool.candidates("FIARGRN", restrictions):
+            if needed <= 0:
+                break
+            take = min(needed, batch.weight_grams)
+            batch.weight_grams -= take
+            needed -= take
+
+        for checked in (broad, narrow):
+            expected = sorted((b for b in batches if b.material_id == "FIARGRN" and b.weight_grams > 0
+                               and b.matches_restrictions(checked)), key=lambda b: b.age)
+            first = next(pool.candidates("FIARGRN", checked), None)
+            assert first is (expected[0] if expected else None)
+            assert all(bucket.head() is not None for bucket in pool.eligible_buckets("FIARGRN", checked))
+
+
+def test_compiled_restrictions_match_dict_restrictions():
+    stock_df = make_stock(rows=200)
+    encoding = StockEncoding()
+    batches = [StockBatch(row, encoding) for _, row in stock_df.iterrows()]
+    for restrictions in ({}, {"supplier": ["HORTIFRUT CHILE S.A."], "ggn": "4059883818772"},
+                         {"quality": ["Good Q/S", ""], "variety": ["NOT IN STOCK"]}):
+        compiled = encoding.compile(restrictions)
+        for batch in batches:
+            assert batch.matches_restrictions(compiled) == batch.matches_restrictions(restrictions)
+
+
+def test_encoding_interns_repeated_strings():
+    stock_df = make_stock(rows=50)
+    encoding = StockEncoding()
+    batches = [StockBatch(row, encoding) for _, row in stock_df.iterrows()]
+    same_supplier = [b for b in batches if b.supplier == "HORTIFRUT CHILE S.A."]
+    assert len({id(b.supplier) for b in same_supplier}) == 1
+    assert len(encoding.dictionaries['supplier']) == 2
+
+
+def test_weights_are_integer_grams():
+    row = make_stock(rows=1).iloc[0].copy()
+    row['Stock Weight'] = "361.0565 KG"
+    batch = StockBatch(row)
+    assert batch.weight_grams == 361057
+    assert batch.weight == 361.057
+
+
+def test_results_stream_in_order_before_the_run_finishes():
+    stock_df = make_stock(rows=100)
+    orders = make_orders(count=30)
+    for engine in ('pool', 'vectorized'):
+        processed = []
+        results = iter_allocations(stock_df, orders, {}, engine=engine, progress=processed.append)
+        first_doc, _ = next(results)
+        assert first_doc == orders[0]['sales_document']
+        assert max(processed) < len(orders)
+
+        streamed = [first_doc] + [sales_doc for sales_doc, _ in results]
+        assert streamed == [order['sales_document'] for order in orders]
+        assert processed[-1] == len(orders)
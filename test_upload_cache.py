@@ -0,0 +1,36 @@
+import sys
+import os
+
+import pandas as pd
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from upload_cache import SnapshotCache, file_hash, normalize_stock_frame
+
+
+def test_snapshot_is_parsed_once_per_content(tmp_path):
+    cache = SnapshotCache(str(tmp_path / 'snapshots'))
+    stock_file = tmp_path / 'stock.xlsx'
+    stock_file.write_bytes(open('xlsx/StockAllocation.xlsx', 'rb').read())
+    parses = []
+
+    def parse(path):
+        parses.append(path)
+        return normalize_stock_frame(pd.read_excel(path, engine='openpyxl'))
+
+    first = cache.load_for_file('stock', str(stock_file), parse)
+    second = cache.load_for_file('stock', str(stock_file), parse)
+
+    assert len(parses) == 1
+    assert cache.load('stock', file_hash(str(stock_file))) is not None
+    pd.testing.assert_frame_equal(first, second)
+    assert first['Stock Weight'].dtype == float
+    assert first['Real Stock Age'].dtype.kind == 'i'
+
+
+def test_normalize_strips_weight_units():
+    df = pd.DataFrame({" Stock Weight ": ["361.056 KG", "0.008 KG"], "Real Stock Age": [14, None]})
+    normalized = normalize_stock_frame(df)
+    assert normalized['Stock Weight'].tolist() == [361.056, 0.008]
+    assert normalized['Real Stock Age'].tolist() == [14, 0]
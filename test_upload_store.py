@@ -0,0 +1,38 @@
+import io
+import os
+import sys
+import time
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from upload_store import UploadStore
+
+
+def test_identical_uploads_share_an_id(tmp_path):
+    store = UploadStore(str(tmp_path), max_age_seconds=3600, max_bytes=10 ** 6)
+    first_id, first_path, first_new = store.save('stock', io.BytesIO(b'abc'), 'xlsx')
+    second_id, second_path, second_new = store.save('stock', io.BytesIO(b'abc'), 'xlsx')
+    other_id, _, _ = store.save('stock', io.BytesIO(b'abcd'), 'xlsx')
+
+    assert first_id == second_id != other_id
+    assert first_new and not second_new
+    assert first_path == second_path == store.path('stock', first_id)
+    assert store.latest('stock') == other_id
+    assert store.path('orders', first_id) is None
+    assert store.path('stock', '../../etc/passwd') is None
+    assert not [name for name in os.listdir(tmp_path / 'stock') if name.endswith('.tmp')]
+
+
+def test_eviction_by_age_and_size(tmp_path):
+    store = UploadStore(str(tmp_path), max_age_seconds=3600, max_bytes=25)
+    old_id, old_path, _ = store.save('stock', io.BytesIO(b'x' * 10), 'xlsx')
+    os.utime(old_path, (time.time() - 7200, time.time() - 7200))
+    mid_id, mid_path, _ = store.save('orders', io.BytesIO(b'y' * 10), 'xlsx')
+    os.utime(mid_path, (time.time() - 60, time.time() - 60))
+    new_id, _, _ = store.save('stock', io.BytesIO(b'z' * 20), 'xlsx')
+
+    evicted = store.evict()
+
+    assert evicted == [('stock', old_id), ('orders', mid_id)]
+    assert store.path('stock', new_id) is not None
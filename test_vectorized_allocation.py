@@ -0,0 +1,39 @@
+import sys
+import os
+
+import numpy as np
+import pandas as pd
+
+# Add the backend directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from allocation_logic import allocate_fruits, to_grams
+from test_stock_pool import make_stock, make_orders
+from vectorized_allocation import parse_weight_grams
+
+
+def test_vectorized_engine_matches_pool_engine():
+    stock_df = make_stock(rows=500)
+    stock_df.loc[3, 'Real Stock Age'] = np.nan
+    orders = make_orders(count=150)
+    for restrictions in ({}, {"origin": ["Chile"], "variety": ["LEGACY", "ROCIO"]}, {"minimum_size": "12"}):
+        expected = allocate_fruits(stock_df, orders, restrictions)
+        results = allocate_fruits(stock_df, orders, restrictions, engine='vectorized')
+        assert results == expected
+
+
+def test_vectorized_engine_reads_numeric_weights():
+    stock_df = make_stock(rows=50)
+    stock_df['Stock Weight'] = stock_df['Stock Weight'].str.split().str[0].astype(float)
+    orders = make_orders(count=20)
+    assert allocate_fruits(stock_df, orders, {}, engine='vectorized') == allocate_fruits(stock_df, orders, {})
+
+
+def test_half_gram_weights_round_like_to_grams():
+    # 0.5005 * 1000 is 500.49999999999994 in floating point
+    weights = ['0.5005', '0.5015 KG', '12.0045', '361.0565 KG', '0.0005', '0.5004999', '-0.5005']
+    expected = [to_grams(weight.split()[0]) for weight in weights]
+    assert expected[:2] == [501, 502]
+    assert parse_weight_grams(pd.Series(weights)).tolist() == expected
+    numeric = [float(weight.split()[0]) for weight in weights]
+    assert parse_weight_grams(pd.Series(numeric)).tolist() == [to_grams(str(weight)) for weight in numeric]